@@ -0,0 +1,119 @@
+"""
+Допуск запросов к API: лимиты по клиентам и сброс нагрузки.
+
+При всплеске лучше сразу отказать части запросов, чем замедлить все:
+запрос, который ждёт соединение из пула DB_POOL_TIMEOUT секунд, держит
+клиента и ничего не даёт. Поэтому middleware в main.py до эндпоинта
+проверяет:
+
+    RateLimiter          корзина токенов на клиента - 429
+    ConcurrencyLimiter   общий предел одновременных запросов - 503
+
+а пул соединений БД отклоняет (503) запрос, которому понадобилось
+соединение, когда заняты все (database.CheckoutTimedPool).
+
+Отказ всегда с Retry-After. Лимиты действуют в пределах воркера uvicorn:
+при API_WORKERS=N общий предел примерно в N раз больше.
+"""
+
+import time
+
+from starlette.requests import Request
+
+# Столько клиентов помним; дальше забываем тех, чья корзина уже полная
+MAX_CLIENTS = 100_000
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 - токен взят, иначе через сколько секунд появится следующий."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """
+    Корзина на клиента: rate запросов в секунду в среднем и до burst подряд.
+
+    Клиент - ключ из X-Api-Key, если он есть в key_rates (у ключа свой rate,
+    0 - без лимита), иначе IP. Незнакомые ключи не дают своей корзины, иначе
+    лимит обходился бы случайным заголовком.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        key_rates: dict[str, float],
+        trust_forwarded: bool = False,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.key_rates = key_rates
+        self.trust_forwarded = trust_forwarded
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def client(self, request: Request) -> tuple[str, float]:
+        api_key = request.headers.get("x-api-key")
+        if api_key in self.key_rates:
+            return f"key:{api_key}", self.key_rates[api_key]
+        forwarded = request.headers.get("x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}", self.rate
+        host = request.client.host if request.client else "unknown"
+        return f"ip:{host}", self.rate
+
+    def acquire(self, request: Request) -> float:
+        """0 - запрос пропускаем, иначе Retry-After в секундах."""
+        key, rate = self.client(request)
+        if rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CLIENTS:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(rate, max(self.burst, 1), now)
+        return bucket.take(now)
+
+    def _prune(self, now: float) -> None:
+        # Полная корзина ничем не отличается от новой - её можно забыть
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if not bucket.full(now)
+        }
+        if len(self._buckets) >= MAX_CLIENTS:
+            self._buckets.clear()
+
+
+class ConcurrencyLimiter:
+    """Не больше limit запросов одновременно (0 - без предела); без очереди."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        if self.limit and self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
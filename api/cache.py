@@ -0,0 +1,203 @@
+"""
+Необязательный кеш пула куки в Redis (включается через REDIS_URL).
+
+Раскладка ключей:
+    cookies:latest:{0|1}  - ZSET id -> timestamp, для /latest-cookie
+    cookies:ids:{0|1}     - SET id, для /random-cookie (SRANDMEMBER)
+    cookies:bodies        - HASH id -> готовое тело ответа
+    cookies:warm          - флаг, что кеш полностью загружен из БД
+
+Коллектор и чистильщик пишут в кеш через add_cookie/remove_cookies
+(подходят и синхронный, и асинхронный pipeline), API читает через PoolCache.
+Пока кеш холодный или Redis недоступен, чтения идут в Postgres.
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from sqlalchemy import select
+
+try:
+    from models import Cookie, CookieBody, in_current_epoch
+except ImportError:  # импорт из коллектора/чистильщика как api.cache
+    from api.models import Cookie, CookieBody, in_current_epoch
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "cookies"
+BODIES_KEY = f"{PREFIX}:bodies"
+WARM_KEY = f"{PREFIX}:warm"
+WARMING_KEY = f"{PREFIX}:warming"
+
+WARM_BATCH_SIZE = 1000
+WARM_LOCK_SECONDS = 300
+
+
+def latest_key(after_captcha: bool) -> str:
+    return f"{PREFIX}:latest:{int(after_captcha)}"
+
+
+def ids_key(after_captcha: bool) -> str:
+    return f"{PREFIX}:ids:{int(after_captcha)}"
+
+
+def _score(timestamp: datetime) -> float:
+    # В БД наивное UTC-время
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _timestamp(score: float) -> datetime:
+    return datetime.fromtimestamp(score, timezone.utc).replace(tzinfo=None)
+
+
+def add_cookie(pipe, cookie: Cookie) -> None:
+    """Ставит в pipeline добавление сохранённой куки в кеш."""
+    pipe.hset(BODIES_KEY, cookie.id, cookie.response_body())
+    pipe.zadd(latest_key(cookie.after_captcha), {cookie.id: _score(cookie.timestamp)})
+    pipe.sadd(ids_key(cookie.after_captcha), cookie.id)
+
+
+def remove_cookies(pipe, rows: Iterable[tuple[int, bool]]) -> None:
+    """Ставит в pipeline удаление пар (id, after_captcha) из кеша."""
+    by_class: dict[bool, list[int]] = {True: [], False: []}
+    for cookie_id, after_captcha in rows:
+        by_class[after_captcha].append(cookie_id)
+
+    for after_captcha, ids in by_class.items():
+        if ids:
+            pipe.zrem(latest_key(after_captcha), *ids)
+            pipe.srem(ids_key(after_captcha), *ids)
+            pipe.hdel(BODIES_KEY, *ids)
+
+
+def clear(pipe) -> None:
+    """Ставит в pipeline очистку пула; кеш остаётся тёплым (пул пуст и в БД)."""
+    pipe.unlink(
+        BODIES_KEY, latest_key(True), latest_key(False), ids_key(True), ids_key(False)
+    )
+    pipe.set(WARM_KEY, 1)
+
+
+class PoolCache:
+    """Чтение пула из Redis для эндпоинтов API."""
+
+    def __init__(self, client: aioredis.Redis, session_factory):
+        self.client = client
+        self.session_factory = session_factory
+        self._warm_task: asyncio.Task | None = None
+
+    @classmethod
+    def from_url(cls, url: str, session_factory) -> "PoolCache":
+        return cls(aioredis.from_url(url), session_factory)
+
+    def _cold(self) -> None:
+        # Кеш пуст после рестарта Redis - греем в фоне, пока читаем из БД
+        if self._warm_task is None or self._warm_task.done():
+            # Пустой контекст: прогрев - не часть запроса, который его начал
+            # (ни его Server-Timing, ни сброс нагрузки при занятом пуле)
+            self._warm_task = asyncio.create_task(
+                self.warm(), context=contextvars.Context()
+            )
+
+    async def latest(self, after_captcha: bool | None) -> CookieBody | None:
+        """Самая свежая кука или None, если нужно идти в БД."""
+        classes = [True, False] if after_captcha is None else [after_captcha]
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.exists(WARM_KEY)
+                for value in classes:
+                    pipe.zrevrange(latest_key(value), 0, 0, withscores=True)
+                warm, *tops = await pipe.execute()
+            if not warm:
+                self._cold()
+                return None
+
+            candidates = [top[0] for top in tops if top]
+            if not candidates:
+                return None
+            cookie_id, score = max(candidates, key=lambda item: item[1])
+            body = await self.client.hget(BODIES_KEY, cookie_id)
+            if body is None:
+                return None
+            return CookieBody(int(cookie_id), _timestamp(score), body)
+        except RedisError as e:
+            logger.warning(f"Redis недоступен, читаем из БД: {e}")
+            return None
+
+    async def random(self, after_captcha: bool | None) -> bytes | None:
+        """Тело случайной куки или None, если нужно идти в БД."""
+        try:
+            if after_captcha is None:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    pipe.exists(WARM_KEY)
+                    pipe.scard(ids_key(True))
+                    pipe.scard(ids_key(False))
+                    warm, with_captcha, without_captcha = await pipe.execute()
+                if not warm:
+                    self._cold()
+                    return None
+                if not with_captcha + without_captcha:
+                    return None
+                after_captcha = (
+                    random.randrange(with_captcha + without_captcha) < with_captcha
+                )
+            elif not await self.client.exists(WARM_KEY):
+                self._cold()
+                return None
+
+            cookie_id = await self.client.srandmember(ids_key(after_captcha))
+            if cookie_id is None:
+                return None
+            return await self.client.hget(BODIES_KEY, cookie_id)
+        except RedisError as e:
+            logger.warning(f"Redis недоступен, читаем из БД: {e}")
+            return None
+
+    async def clear(self) -> None:
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                clear(pipe)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Не удалось очистить кеш: {e}")
+
+    async def warm(self) -> None:
+        """Загружает пул из БД в Redis; одновременно греет только один процесс."""
+        try:
+            if await self.client.exists(WARM_KEY):
+                return
+            if not await self.client.set(WARMING_KEY, 1, nx=True, ex=WARM_LOCK_SECONDS):
+                return
+
+            loaded = 0
+            last_id = 0
+            async with self.session_factory() as db:
+                while True:
+                    result = await db.execute(
+                        select(Cookie)
+                        .where(Cookie.id > last_id, in_current_epoch())
+                        .order_by(Cookie.id)
+                        .limit(WARM_BATCH_SIZE)
+                    )
+                    batch = result.scalars().all()
+                    if not batch:
+                        break
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for cookie in batch:
+                            add_cookie(pipe, cookie)
+                        await pipe.execute()
+                    loaded += len(batch)
+                    last_id = batch[-1].id
+                    db.expunge_all()
+
+            await self.client.set(WARM_KEY, 1)
+            await self.client.delete(WARMING_KEY)
+            logger.info(f"Кеш пула прогрет: {loaded} куки")
+        except RedisError as e:
+            logger.warning(f"Не удалось прогреть кеш: {e}")
@@ -6,3 +6,110 @@ load_dotenv()
 DB_URL = os.getenv("DB_URL")  # Теперь из .env (PostgreSQL)
 if not DB_URL:
     raise ValueError("DB_URL не найден в .env файле")
+
+# Индекс id для /random-cookie: как часто подтягивать новые строки и
+# как часто перестраивать индекс целиком (чтобы забыть удалённые)
+SAMPLER_SYNC_SECONDS = float(os.getenv("SAMPLER_SYNC_SECONDS", "1"))
+SAMPLER_RESYNC_SECONDS = float(os.getenv("SAMPLER_RESYNC_SECONDS", "300"))
+
+
+# Асинхронный драйвер для эндпоинтов (по умолчанию asyncpg/aiosqlite на тот же
+# DB_URL, см. storage.py). DB_URL=sqlite:///cookies.db - встроенное хранилище
+ASYNC_DB_URL = os.getenv("ASYNC_DB_URL")
+
+# Пул соединений асинхронного движка
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Реплики PostgreSQL для эндпоинтов чтения, через запятую (пусто - всё читается
+# с DB_URL). Отставание проверяется раз в REPLICA_CHECK_SECONDS; реплика,
+# отставшая больше чем на REPLICA_MAX_LAG_SECONDS, не используется до
+# следующей проверки, пока таких нет - чтение идёт с primary
+DB_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "2"))
+
+# Необязательный кеш пула в Redis, например redis://localhost:6379/0
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Сколько секунд процесс отдаёт /latest-cookie из памяти без запроса к БД
+# (0 - только объединение одновременных запросов)
+LATEST_CACHE_TTL_SECONDS = float(os.getenv("LATEST_CACHE_TTL_SECONDS", "0.5"))
+
+# Сколько куки максимум выдаёт один запрос /cookies/lease
+LEASE_MAX_COUNT = int(os.getenv("LEASE_MAX_COUNT", "100"))
+
+# Сколько строк /export читает из серверного курсора за раз
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Снимок пула в memory-mapped файле для нескольких воркеров (пусто - выключен),
+# например /dev/shm/cookies.snapshot. Обновляет один воркер раз в
+# SNAPSHOT_REFRESH_SECONDS; снимок старше SNAPSHOT_MAX_AGE_SECONDS не используется
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "1"))
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "10"))
+
+# /metrics читает пул из БД через своё единственное соединение и ждёт его не
+# дольше METRICS_DB_TIMEOUT_SECONDS, иначе отдаёт прошлые значения. Размер пула
+# (COUNT по классам) пересчитывается не чаще раза в METRICS_POOL_COUNT_SECONDS
+METRICS_DB_TIMEOUT_SECONDS = float(os.getenv("METRICS_DB_TIMEOUT_SECONDS", "2"))
+METRICS_POOL_COUNT_SECONDS = float(os.getenv("METRICS_POOL_COUNT_SECONDS", "60"))
+
+# Заголовок Server-Timing с разбивкой времени запроса по фазам (см. timing.py),
+# только в ответах на запросы с X-Api-Key админа
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Ключ для /admin/* (заголовок X-Api-Key); не задан - админ-эндпоинты выключены
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+# Предел длительности /admin/profile, секунд
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Супервизор сборщика и чистильщика (см. supervisor.py): воркер без пульса
+# дольше WORKER_HEARTBEAT_TIMEOUT_SECONDS перезапускается, на остановку с
+# дозаписью даётся WORKER_DRAIN_SECONDS, задержка перезапуска растёт до
+# WORKER_RESTART_BACKOFF_MAX_SECONDS
+WORKER_HEARTBEAT_TIMEOUT_SECONDS = float(
+    os.getenv("WORKER_HEARTBEAT_TIMEOUT_SECONDS", "30")
+)
+WORKER_DRAIN_SECONDS = float(os.getenv("WORKER_DRAIN_SECONDS", "30"))
+WORKER_RESTART_BACKOFF_MAX_SECONDS = float(
+    os.getenv("WORKER_RESTART_BACKOFF_MAX_SECONDS", "60")
+)
+# Unix-сокет, через который воркеры uvicorn передают команды лидеру
+# (по умолчанию .supervisor.sock в корне проекта)
+WORKER_CONTROL_SOCKET = os.getenv("WORKER_CONTROL_SOCKET")
+# Чистильщик задачей в процессе API, а не отдельным процессом
+CLEANER_IN_PROCESS = os.getenv("CLEANER_IN_PROCESS", "0") == "1"
+
+# Допуск запросов (см. admission.py). Лимит на клиента: RATE_LIMIT_PER_SECOND
+# запросов в секунду в среднем и до RATE_LIMIT_BURST подряд, сверх - 429
+# (0 - без лимита). Клиент - IP или ключ из RATE_LIMIT_KEYS в заголовке
+# X-Api-Key: "ключ=лимит" через запятую, без "=" - общий лимит, 0 - без лимита
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_KEYS = {
+    key.strip(): float(rate) if rate else RATE_LIMIT_PER_SECOND
+    for key, _, rate in (
+        item.partition("=") for item in os.getenv("RATE_LIMIT_KEYS", "").split(",")
+    )
+    if key.strip()
+}
+# IP клиента - первый адрес X-Forwarded-For (только за своим балансировщиком)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+# Одновременных запросов на воркер, сверх - 503 (0 - без предела)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "0"))
+# 503 сразу, когда заняты все соединения пула, а не ожидание DB_POOL_TIMEOUT
+SHED_ON_POOL_SATURATION = os.getenv("SHED_ON_POOL_SATURATION", "1") == "1"
+SHED_RETRY_AFTER_SECONDS = int(os.getenv("SHED_RETRY_AFTER_SECONDS", "1"))
+# Пути без лимитов
+ADMISSION_EXEMPT_PATHS = {
+    path.strip()
+    for path in os.getenv(
+        "ADMISSION_EXEMPT_PATHS", "/health,/metrics"
+    ).split(",")
+    if path.strip()
+}
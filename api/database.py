@@ -1,15 +1,267 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import Engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from models import Base
-from config import DB_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from config import (
+    ASYNC_DB_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_REPLICA_URLS,
+    DB_URL,
+    METRICS_DB_TIMEOUT_SECONDS,
+    REPLICA_CHECK_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
+    SHED_ON_POOL_SATURATION,
+)
+from exceptions import PoolSaturated
+import timing
+from metrics import REGISTRY
+from storage import storage_for
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_CHECKOUT_SECONDS = REGISTRY.histogram(
+    "db_pool_checkout_seconds",
+    "Ожидание соединения из пула асинхронного движка API",
+)
+REPLICA_LAG = REGISTRY.gauge(
+    "db_replica_lag_seconds", "Отставание реплики при последней проверке", ("replica",)
+)
+REPLICA_UP = REGISTRY.gauge(
+    "db_replica_up", "1 - реплика доступна и отстаёт не больше предела", ("replica",)
+)
+READ_SESSIONS = REGISTRY.counter(
+    "db_read_sessions_total", "Сессии эндпоинтов чтения по цели", ("target",)
+)
+
+
+# Запрос API, которому при занятом пуле лучше 503 сразу (shed_when_saturated)
+_shedding: ContextVar[bool] = ContextVar("shedding", default=False)
+
+
+def shed_when_saturated(enabled: bool = True) -> None:
+    """
+    Сброс нагрузки для текущего запроса: если, когда ему понадобится
+    соединение, в пуле (primary или выбранной реплики) заняты все,
+    PoolSaturated (503) сразу, а не ожидание DB_POOL_TIMEOUT. Ответ из
+    снимка, Redis или кеша в памяти соединения не берёт и не отклоняется.
+    """
+    _shedding.set(SHED_ON_POOL_SATURATION and enabled)
+
+
+class CheckoutTimedPool(AsyncAdaptedQueuePool):
+    """
+    Пул, который меряет, сколько запрос ждал свободное соединение, и
+    отклоняет запросы API, когда свободных нет (shed_when_saturated).
+    """
+
+    def _do_get(self):
+        if _shedding.get() and self.checkedout() >= DB_POOL_SIZE + DB_MAX_OVERFLOW:
+            raise PoolSaturated("Все соединения с БД заняты")
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_POOL_CHECKOUT_SECONDS.observe(elapsed)
+            timing.record("checkout", elapsed)
+
+
+storage = storage_for(DB_URL, ASYNC_DB_URL)
 
-engine = create_engine(DB_URL)
+# Синхронный движок - только для миграций и служебных скриптов
+engine = storage.create_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)  # Создание таблицы (если нет)
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+
+def _create_async_engine(storage) -> AsyncEngine:
+    return storage.create_async_engine(
+        poolclass=CheckoutTimedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+def _sessionmaker(engine: AsyncEngine) -> async_sessionmaker:
+    return async_sessionmaker(
+        engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
+
+def _create_metrics_engine(storage) -> AsyncEngine:
+    """
+    Одно своё соединение для /metrics: метрики нужны как раз тогда, когда пул
+    API занят и запросы сбрасываются, и ждать его они не должны.
+    """
+    return storage.create_async_engine(
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=METRICS_DB_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+async_engine = _create_async_engine(storage)
+AsyncSessionLocal = _sessionmaker(async_engine)
+metrics_engine = _create_metrics_engine(storage)
+MetricsSessionLocal = _sessionmaker(metrics_engine)
+
+
+class Replica:
+    def __init__(self, url: str):
+        parsed = make_url(url)
+        self.name = f"{parsed.host}:{parsed.port or 5432}/{parsed.database}"
+        self.storage = storage_for(url)
+        self.engine = _create_async_engine(self.storage)
+        # Для фоновых чтений в потоке (снимок пула); соединения - по требованию
+        self.sync_engine = self.storage.create_engine(pool_pre_ping=True)
+        self.sessions = _sessionmaker(self.engine)
+        self.lag: float | None = None  # None - недоступна или ещё не проверена
+
+
+class ReplicaRouter:
+    """
+    Сессии для эндпоинтов чтения: по очереди с реплик, которые при последней
+    проверке отставали не больше max_lag, иначе с primary. Вызывается как
+    async_sessionmaker, поэтому его можно отдать кешам вместо AsyncSessionLocal.
+
+    Записи, остановка пула и всё, что должно видеть только что вставленное
+    (NOTIFY, аренда), по-прежнему идут через AsyncSessionLocal.
+    """
+
+    def __init__(
+        self,
+        primary: async_sessionmaker,
+        primary_sync: Engine,
+        replicas: list[Replica],
+        max_lag: float,
+        check_seconds: float,
+    ):
+        self.primary = primary
+        self.primary_sync = primary_sync
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._turn = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def __call__(self) -> AsyncSession:
+        return self.pick()()
+
+    def _healthy(self) -> list[Replica]:
+        return [
+            replica
+            for replica in self.replicas
+            if replica.lag is not None and replica.lag <= self.max_lag
+        ]
+
+    def pick(self) -> async_sessionmaker:
+        healthy = self._healthy()
+        if not healthy:
+            if self.replicas:
+                READ_SESSIONS.inc(target="primary")
+            return self.primary
+        READ_SESSIONS.inc(target="replica")
+        return healthy[next(self._turn) % len(healthy)].sessions
+
+    def sync_engine(self) -> Engine:
+        """Синхронный движок по тем же правилам, что и pick."""
+        healthy = self._healthy()
+        if not healthy:
+            return self.primary_sync
+        return healthy[next(self._turn) % len(healthy)].sync_engine
+
+    async def start(self) -> None:
+        if not self.replicas:
+            return
+        # Первая проверка до приёма запросов: иначе всё чтение ушло бы на primary
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for replica in self.replicas:
+            await replica.engine.dispose()
+            replica.sync_engine.dispose()
+
+    async def check(self) -> None:
+        await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+
+    async def _lag(self, replica: Replica) -> float | None:
+        async with replica.engine.connect() as conn:
+            lag = await conn.scalar(text(replica.storage.replica_lag_sql))
+        return float(lag) if lag is not None else None
+
+    async def _check(self, replica: Replica) -> None:
+        was_healthy = replica.lag is not None and replica.lag <= self.max_lag
+        try:
+            replica.lag = await asyncio.wait_for(
+                self._lag(replica), self.check_seconds
+            )
+        except (SQLAlchemyError, OSError, TimeoutError) as e:
+            replica.lag = None
+            if was_healthy:
+                logger.warning(f"Реплика {replica.name} недоступна: {e}")
+
+        healthy = replica.lag is not None and replica.lag <= self.max_lag
+        if replica.lag is not None:
+            REPLICA_LAG.set(replica.lag, replica=replica.name)
+        REPLICA_UP.set(int(healthy), replica=replica.name)
+        if was_healthy and not healthy and replica.lag is not None:
+            logger.warning(
+                f"Реплика {replica.name} отстаёт на {replica.lag:.1f} с, "
+                f"читаем с primary"
+            )
+        elif healthy and not was_healthy:
+            logger.info(f"Реплика {replica.name} догнала primary, читаем с неё")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            await self.check()
+
+
+replicas = []
+if DB_REPLICA_URLS and not storage.supports_replicas:
+    logger.warning("Реплики есть только в PostgreSQL, DB_REPLICA_URLS не используется")
+elif DB_REPLICA_URLS:
+    replicas = [Replica(url) for url in DB_REPLICA_URLS]
+ReadSessionLocal = ReplicaRouter(
+    AsyncSessionLocal, engine, replicas, REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS
+)
+
+
+def read_sessions() -> async_sessionmaker:
+    """Сессии для эндпоинтов чтения: реплика, если она не отстала, иначе primary."""
+    return ReadSessionLocal.pick()
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    async with read_sessions()() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
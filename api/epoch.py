@@ -0,0 +1,80 @@
+"""
+Инвалидация пула поднятием эпохи вместо DELETE всей таблицы.
+
+bump_epoch - один UPDATE одной строки, выполняется мгновенно при любом
+размере таблицы. Строки прошлых эпох убирает reclaim в фоне: TRUNCATE,
+если новых строк ещё нет и таблицу удалось взять без ожидания, иначе
+удаление батчами по id.
+"""
+
+import asyncio
+import logging
+
+from models import Cookie, PoolState
+from sqlalchemy import delete, exists, func, select, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+RECLAIM_BATCH_SIZE = 1000
+
+
+async def bump_epoch(db: AsyncSession) -> tuple[int, int]:
+    """Атомарно начинает новую эпоху. Возвращает (epoch, floor_id)."""
+    result = await db.execute(
+        update(PoolState)
+        .where(PoolState.id == 1)
+        .values(
+            epoch=PoolState.epoch + 1,
+            floor_id=select(func.coalesce(func.max(Cookie.id), 0)).scalar_subquery(),
+        )
+        .returning(PoolState.epoch, PoolState.floor_id)
+    )
+    epoch, floor_id = result.one()
+    await db.commit()
+    return epoch, floor_id
+
+
+async def _try_truncate(db: AsyncSession, floor_id: int) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return False
+    try:
+        await db.execute(text("SET LOCAL lock_timeout = '100ms'"))
+        await db.execute(text("LOCK TABLE cookies IN ACCESS EXCLUSIVE MODE"))
+        if await db.scalar(select(exists().where(Cookie.id > floor_id))):
+            await db.rollback()
+            return False
+        # Без RESTART IDENTITY: id должны расти, на этом держится floor_id
+        await db.execute(text("TRUNCATE cookies"))
+        await db.commit()
+        return True
+    except DBAPIError:
+        await db.rollback()
+        return False
+
+
+async def reclaim(session_factory, floor_id: int) -> None:
+    """Удаляет строки прошлых эпох (id <= floor_id)."""
+    async with session_factory() as db:
+        if await _try_truncate(db, floor_id):
+            logger.info(f"Строки прошлых эпох удалены TRUNCATE (floor_id={floor_id})")
+            return
+
+    deleted = 0
+    while True:
+        async with session_factory() as db:
+            batch = (
+                select(Cookie.id)
+                .where(Cookie.id <= floor_id)
+                .order_by(Cookie.id)
+                .limit(RECLAIM_BATCH_SIZE)
+            )
+            result = await db.execute(delete(Cookie).where(Cookie.id.in_(batch)))
+            await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < RECLAIM_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+
+    logger.info(f"Удалено {deleted} строк прошлых эпох (floor_id={floor_id})")
@@ -1 +1,4 @@
 class ApiKeyError(Exception): ...
+
+
+class PoolSaturated(Exception): ...
@@ -0,0 +1,56 @@
+"""
+Выгрузка всего пула в NDJSON (/export) для офлайн-обработки.
+
+Строки читаются серверным курсором порциями по EXPORT_BATCH_SIZE
+(yield_per) и сразу отдаются клиенту, поэтому память не зависит от
+размера таблицы. Выбираются только колонки, без ORM-объектов: тело
+строки собирается так же, как в остальных ответах API.
+
+Порядок - по id, поэтому для инкрементальной выгрузки достаточно
+передать since_id = id последней полученной строки.
+"""
+
+from collections.abc import AsyncIterator
+from datetime import datetime
+
+from models import Cookie, Proxy, build_response_body, in_current_epoch
+from proxies import proxy_condition
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+async def export_cookies(
+    session_factory: async_sessionmaker,
+    batch_size: int,
+    after_captcha: bool | None = None,
+    since_id: int | None = None,
+    since: datetime | None = None,
+    proxy: str | None = None,
+) -> AsyncIterator[bytes]:
+    """Строки NDJSON: тело ответа каждой подходящей куки и перевод строки."""
+    query = (
+        select(
+            Cookie.id,
+            Proxy.url,
+            Cookie.payload_dict_id,
+            Cookie.payload,
+        )
+        .outerjoin(Proxy, Proxy.id == Cookie.proxy_id)
+        .where(in_current_epoch())
+        .order_by(Cookie.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if after_captcha is not None:
+        query = query.where(Cookie.after_captcha == after_captcha)
+    if since_id is not None:
+        query = query.where(Cookie.id > since_id)
+    if since is not None:
+        query = query.where(Cookie.timestamp >= since)
+    if proxy:
+        query = query.where(proxy_condition(proxy))
+
+    # Своя сессия: ответ стримится уже после выхода из зависимости get_db
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            yield b"".join(build_response_body(*row) + b"\n" for row in rows)
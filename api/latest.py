@@ -0,0 +1,112 @@
+"""
+Кеш /latest-cookie в памяти процесса.
+
+Одновременные запросы с одинаковым after_captcha ждут один общий запрос
+к БД (single-flight), результат живёт ttl секунд. Новые куки сбрасывают
+кеш своего класса через CookieBroadcaster.on_insert; без LISTEN/NOTIFY
+(SQLite) свежесть ограничена только ttl.
+
+NOTIFY приходит с primary, а реплика может отставать до primary_seconds
+(REPLICA_MAX_LAG_SECONDS): столько после сброса класс читается с primary,
+иначе ответ откатился бы к строке, которая была до новой.
+"""
+
+import asyncio
+import time
+
+from models import Cookie, CookieBody, in_current_epoch
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+class LatestCookieCache:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        ttl: float,
+        primary: async_sessionmaker | None = None,
+        primary_seconds: float = 0.0,
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.primary = primary
+        self.primary_seconds = primary_seconds
+        # До какого time.monotonic() класс читается с primary
+        self._primary_until: dict[bool | None, float] = {}
+        self._entries: dict[bool | None, tuple[float, CookieBody | None]] = {}
+        self._inflight: dict[bool | None, asyncio.Task] = {}
+        # Поколение растёт при каждом сбросе: результат запроса, начатого
+        # до сброса, в кеш уже не кладём
+        self._generation = 0
+
+    async def get(self, after_captcha: bool | None) -> CookieBody | None:
+        """Самая свежая кука класса или None, если пул пуст."""
+        entry = self._entries.get(after_captcha)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        task = self._inflight.get(after_captcha)
+        if task is None:
+            task = asyncio.create_task(self._load(after_captcha))
+            self._inflight[after_captcha] = task
+        # shield: отмена одного клиента не отменяет запрос остальным
+        return await asyncio.shield(task)
+
+    def invalidate(self, cookie_id: int, after_captcha: bool) -> None:
+        """Колбэк on_insert: новая кука меняет ответ для своего класса и для None."""
+        self._generation += 1
+        self._entries.pop(after_captcha, None)
+        self._entries.pop(None, None)
+        self._inflight.pop(after_captcha, None)
+        self._inflight.pop(None, None)
+        if self.primary is not None:
+            until = time.monotonic() + self.primary_seconds
+            self._primary_until[after_captcha] = self._primary_until[None] = until
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._inflight.clear()
+
+    async def _load(self, after_captcha: bool | None) -> CookieBody | None:
+        try:
+            return await self._query(after_captcha, self._generation)
+        finally:
+            if self._inflight.get(after_captcha) is asyncio.current_task():
+                del self._inflight[after_captcha]
+
+    async def _query(
+        self, after_captcha: bool | None, generation: int
+    ) -> CookieBody | None:
+        sessions = self.session_factory
+        if self._primary_until.get(after_captcha, 0) > time.monotonic():
+            sessions = self.primary
+        async with sessions() as db:
+            latest = await fetch_latest(db, after_captcha)
+        if self.ttl > 0 and generation == self._generation:
+            self._entries[after_captcha] = (time.monotonic() + self.ttl, latest)
+        return latest
+
+
+def latest_query(after_captcha: bool | None, *conditions) -> Select:
+    query = (
+        select(Cookie)
+        .where(in_current_epoch(), *conditions)
+        .order_by(Cookie.timestamp.desc())
+        .limit(1)
+    )
+    if after_captcha is not None:
+        query = query.where(Cookie.after_captcha == after_captcha)
+    return query
+
+
+async def fetch_latest(
+    db: AsyncSession, after_captcha: bool | None, *conditions
+) -> CookieBody | None:
+    """Самая свежая кука класса с дополнительными условиями, без кеша."""
+    cookie = (
+        await db.execute(latest_query(after_captcha, *conditions))
+    ).scalar_one_or_none()
+    if cookie is None:
+        return None
+    return CookieBody(cookie.id, cookie.timestamp, cookie.response_body())
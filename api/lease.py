@@ -0,0 +1,51 @@
+"""
+Пакетная выдача куки: /cookies/lease.
+
+Выбор и учёт - один запрос UPDATE ... WHERE id IN (SELECT ... FOR UPDATE
+SKIP LOCKED) RETURNING по индексу (after_captcha, last_leased_at, id):
+отдаются n ни разу не выданных или дольше всех не выдававшихся строк.
+Параллельные запросы пропускают строки, уже взятые другими, и не ждут
+друг друга.
+"""
+
+from models import Cookie, in_current_epoch, utcnow
+from sqlalchemy import Update, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def lease_statement(n: int, after_captcha: bool | None) -> Update:
+    candidates = (
+        select(Cookie.id)
+        .where(in_current_epoch())
+        .order_by(Cookie.last_leased_at.asc().nulls_first(), Cookie.id)
+        .limit(n)
+        .with_for_update(skip_locked=True, of=Cookie)
+    )
+    if after_captcha is not None:
+        candidates = candidates.where(Cookie.after_captcha == after_captcha)
+
+    return (
+        update(Cookie)
+        .where(Cookie.id.in_(candidates))
+        .values(lease_count=Cookie.lease_count + 1, last_leased_at=utcnow())
+        .returning(Cookie.id)
+    )
+
+
+async def lease_cookies(
+    db: AsyncSession, n: int, after_captcha: bool | None
+) -> list[Cookie]:
+    """Выдаёт до n разных куки, отмечая выдачу (lease_count, last_leased_at)."""
+    result = await db.scalars(
+        lease_statement(n, after_captcha),
+        execution_options={"synchronize_session": False},
+    )
+    leased_ids = result.all()
+    await db.commit()
+    if not leased_ids:
+        return []
+    # Сами строки (вместе с прокси из справочника) - по первичному ключу
+    result = await db.scalars(
+        select(Cookie).where(Cookie.id.in_(leased_ids)).order_by(Cookie.id)
+    )
+    return result.all()
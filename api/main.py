@@ -1,23 +1,212 @@
+import asyncio
+import hmac
 import logging
-import os
+import math
 import platform
-import random
-import signal
-import subprocess
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from database import get_db
-from fastapi import Depends, FastAPI, HTTPException, Query
-from models import Cookie
-from sqlalchemy.orm import Session
-
-app = FastAPI()
+from admission import ConcurrencyLimiter, RateLimiter
+from cache import PoolCache
+from config import (
+    ADMIN_API_KEY,
+    ADMISSION_EXEMPT_PATHS,
+    CLEANER_IN_PROCESS,
+    EXPORT_BATCH_SIZE,
+    LATEST_CACHE_TTL_SECONDS,
+    LEASE_MAX_COUNT,
+    MAX_CONCURRENT_REQUESTS,
+    METRICS_DB_TIMEOUT_SECONDS,
+    METRICS_POOL_COUNT_SECONDS,
+    PROFILE_MAX_SECONDS,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_KEYS,
+    RATE_LIMIT_PER_SECOND,
+    REDIS_URL,
+    REPLICA_MAX_LAG_SECONDS,
+    SERVER_TIMING,
+    SHED_RETRY_AFTER_SECONDS,
+    SNAPSHOT_MAX_AGE_SECONDS,
+    SNAPSHOT_PATH,
+    SNAPSHOT_REFRESH_SECONDS,
+    TRUST_FORWARDED_FOR,
+    WORKER_CONTROL_SOCKET,
+    WORKER_DRAIN_SECONDS,
+    WORKER_HEARTBEAT_TIMEOUT_SECONDS,
+    WORKER_RESTART_BACKOFF_MAX_SECONDS,
+)
+from database import (
+    AsyncSessionLocal,
+    MetricsSessionLocal,
+    ReadSessionLocal,
+    async_engine,
+    engine,
+    get_db,
+    get_read_db,
+    metrics_engine,
+    read_sessions,
+    shed_when_saturated,
+    storage,
+)
+from epoch import bump_epoch, reclaim
+from exceptions import ApiKeyError, PoolSaturated
+from export import export_cookies
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from latest import LatestCookieCache, fetch_latest
+from lease import lease_cookies
+from metrics import CONTENT_TYPE, REGISTRY
+from migrations import run_migrations
+from models import Cookie, PoolState, in_current_epoch, utcnow
+from notify import CookieBroadcaster
+from payloads import dictionaries
+import profiler
+from proxies import proxy_condition, proxy_summary
+from sampler import CookieSampler, pick_where
+from snapshot import SnapshotReader, SnapshotRefresher
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from supervisor import Supervisor, WorkerSpec
+import timing
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    run_migrations(engine)
+    dictionaries.bind(engine)
+    await ReadSessionLocal.start()
+    if pool_cache:
+        await pool_cache.warm()
+    if broadcaster:
+        broadcaster.start()
+    if snapshot_refresher:
+        snapshot_refresher.start()
+    await supervisor.open()
+    yield
+    # Сборщик дописывает очередь до закрытия пула соединений
+    await supervisor.close()
+    if snapshot_refresher:
+        await snapshot_refresher.stop()
+    if broadcaster:
+        await broadcaster.stop()
+    if pool_cache:
+        await pool_cache.client.aclose()
+    await ReadSessionLocal.stop()
+    await async_engine.dispose()
+    await metrics_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+if SERVER_TIMING:
+    timing.install(
+        async_engine.sync_engine,
+        *(replica.engine.sync_engine for replica in ReadSessionLocal.replicas),
+    )
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 COLLECTOR_DIR = PROJECT_ROOT / "cookie_collector"
 CLEANER_DIR = PROJECT_ROOT / "cookie_cleaner"
-COLLECTOR_PID_FILE = PROJECT_ROOT / ".collector.pid"
-CLEANER_PID_FILE = PROJECT_ROOT / ".cleaner.pid"
+
+supervisor = Supervisor(
+    [
+        WorkerSpec("collector", "run_collector", "main", COLLECTOR_DIR),
+        WorkerSpec(
+            "cleaner",
+            "cookie_cleaner.main",
+            "run" if CLEANER_IN_PROCESS else "main",
+            CLEANER_DIR,
+            in_process=CLEANER_IN_PROCESS,
+        ),
+    ],
+    heartbeat_timeout=WORKER_HEARTBEAT_TIMEOUT_SECONDS,
+    drain_seconds=WORKER_DRAIN_SECONDS,
+    backoff_max=WORKER_RESTART_BACKOFF_MAX_SECONDS,
+    control_path=WORKER_CONTROL_SOCKET or str(PROJECT_ROOT / ".supervisor.sock"),
+)
+
+# Кеши и снимок читают пул с реплик (если они есть и не отстали); строки из
+# NOTIFY, которых на реплике ещё нет, - с primary
+sampler = CookieSampler(primary=AsyncSessionLocal)
+latest_cache = LatestCookieCache(
+    ReadSessionLocal,
+    LATEST_CACHE_TTL_SECONDS,
+    primary=AsyncSessionLocal,
+    primary_seconds=REPLICA_MAX_LAG_SECONDS,
+)
+pool_cache = PoolCache.from_url(REDIS_URL, ReadSessionLocal) if REDIS_URL else None
+
+# Общий для воркеров снимок пула (flock есть только не в Windows)
+snapshot_reader = snapshot_refresher = None
+if SNAPSHOT_PATH and platform.system() != "Windows":
+    snapshot_reader = SnapshotReader(SNAPSHOT_PATH, SNAPSHOT_MAX_AGE_SECONDS)
+    snapshot_refresher = SnapshotRefresher(
+        SNAPSHOT_PATH, ReadSessionLocal.sync_engine, SNAPSHOT_REFRESH_SECONDS
+    )
+
+# LISTEN/NOTIFY есть только в PostgreSQL. Тело новой куки читается с primary:
+# на реплику строка может ещё не доехать
+broadcaster = None
+if storage.supports_notify:
+    broadcaster = CookieBroadcaster(storage.listen_dsn, AsyncSessionLocal)
+    # Новые строки сразу попадают в индекс /random-cookie и в /latest-cookie
+    broadcaster.on_insert.append(sampler.add)
+    broadcaster.on_insert.append(latest_cache.invalidate)
+    if snapshot_refresher:
+        broadcaster.on_insert.append(snapshot_refresher.poke)
+
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Допуск запросов: лимиты по клиентам и общий предел одновременных запросов
+rate_limiter = None
+if RATE_LIMIT_PER_SECOND > 0 or RATE_LIMIT_KEYS:
+    rate_limiter = RateLimiter(
+        RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_KEYS, TRUST_FORWARDED_FOR
+    )
+concurrency = ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS)
+
+# Профайлер один на процесс: два сразу семплировали бы друг друга
+profile_lock = asyncio.Lock()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Время ответа API до заголовков (у потоков - до начала потока)",
+    ("method", "route", "status"),
+)
+POOL_SIZE = REGISTRY.gauge(
+    "cookies_pool_size", "Куки в пуле текущей эпохи", ("after_captcha",)
+)
+NEWEST_AGE = REGISTRY.gauge(
+    "cookies_newest_age_seconds", "Возраст самой свежей куки", ("after_captcha",)
+)
+OLDEST_AGE = REGISTRY.gauge(
+    "cookies_oldest_age_seconds", "Возраст самой старой куки", ("after_captcha",)
+)
+# id растут монотонно (миграция 1, TRUNCATE без RESTART IDENTITY), поэтому
+# rate(cookies_inserted_total[5m]) - скорость вставки коллектором
+INSERTED = REGISTRY.counter("cookies_inserted_total", "Вставлено куки за всё время")
+DB_POOL_CHECKED_OUT = REGISTRY.gauge(
+    "db_pool_checked_out", "Занятые соединения пула асинхронного движка"
+)
+POOL_OBSERVE_FAILURES = REGISTRY.counter(
+    "cookies_pool_observe_failures_total",
+    "Скрейпы /metrics, не дождавшиеся БД: метрики пула в них прошлые",
+)
+IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Запросы в обработке")
+SHED = REGISTRY.counter(
+    "http_requests_shed_total", "Отказы до эндпоинта (429/503) по причинам", ("reason",)
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -28,198 +217,484 @@ logging.basicConfig(
 )
 
 
-# ====== Утилиты управления процессами ======
+# ====== Пул ======
 
 
-def _is_process_running(pid_file: Path) -> bool:
-    if not pid_file.exists():
-        return False
-    try:
-        pid = int(pid_file.read_text().strip())
-        os.kill(pid, 0)
-        return True
-    except (ProcessLookupError, ValueError, OSError):
-        pid_file.unlink(missing_ok=True)
-        return False
+async def _invalidate_pool(db: AsyncSession, background_tasks: BackgroundTasks) -> int:
+    """
+    Мгновенно делает все текущие куки невидимыми, поднимая эпоху пула.
+    Сами строки удаляются в фоне после ответа. Возвращает новую эпоху.
+    """
+    epoch, floor_id = await bump_epoch(db)
+    sampler.clear()
+    latest_cache.clear()
+    if snapshot_refresher:
+        snapshot_refresher.invalidate(epoch)
+    if pool_cache:
+        await pool_cache.clear()
+    background_tasks.add_task(_reclaim, floor_id)
+    logger.info(f"Пул инвалидирован: эпоха {epoch}, видимы только id > {floor_id}")
+    return epoch
 
 
-def _launch_detached(cmd: list[str], cwd: Path, pid_file: Path) -> int:
-    kwargs: dict = {
-        "cwd": str(cwd),
-        "env": os.environ.copy(),
-        "stdout": subprocess.DEVNULL,
-        "stderr": subprocess.DEVNULL,
-        "start_new_session": True,
-    }
+async def _reclaim(floor_id: int) -> None:
+    # Идёт после ответа, в контексте запроса: соединение ждёт, а не получает 503
+    shed_when_saturated(False)
+    await reclaim(AsyncSessionLocal, floor_id)
 
-    if platform.system() == "Windows":
-        kwargs["creationflags"] = (
-            subprocess.CREATE_NEW_PROCESS_GROUP
-            | subprocess.DETACHED_PROCESS
-            | subprocess.CREATE_NO_WINDOW
-        )
-    else:
-        kwargs["preexec_fn"] = os.setsid
 
-    proc = subprocess.Popen(cmd, **kwargs)
-    pid_file.write_text(str(proc.pid))
-    return proc.pid
+# ====== Допуск запросов ======
 
 
-def _kill_process_tree(pid_file: Path) -> bool:
-    """Останавливает процесс и всю его группу. Возвращает True, если что-то убито."""
-    if not pid_file.exists():
-        return False
+def _shed(status: int, reason: str, retry_after: float, detail: str) -> Response:
+    SHED.inc(reason=reason)
+    return JSONResponse(
+        status_code=status,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
+
 
+# Объявлен раньше observe_request, поэтому выполняется внутри него: отказы
+# тоже попадают в гистограмму запросов
+@app.middleware("http")
+async def admit(request: Request, call_next):
+    if request.url.path in ADMISSION_EXEMPT_PATHS:
+        return await call_next(request)
+    if rate_limiter and (retry_after := rate_limiter.acquire(request)):
+        return _shed(429, "rate_limit", retry_after, "Слишком много запросов")
+    if not concurrency.try_acquire():
+        return _shed(503, "concurrency", SHED_RETRY_AFTER_SECONDS, "Сервер перегружен")
+    shed_when_saturated()
     try:
-        pid = int(pid_file.read_text().strip())
-    except (ValueError, OSError):
-        pid_file.unlink(missing_ok=True)
-        return False
+        return await call_next(request)
+    finally:
+        concurrency.release()
 
-    killed = False
 
-    if platform.system() == "Windows":
-        result = subprocess.run(
-            ["taskkill", "/F", "/T", "/PID", str(pid)],
-            capture_output=True,
-            text=True,
-        )
-        killed = result.returncode == 0
-    else:
-        try:
-            pgid = os.getpgid(pid)
-            os.killpg(pgid, signal.SIGTERM)
-            killed = True
-            logger.info(f"Отправлен SIGTERM группе процессов pgid={pgid}")
-        except ProcessLookupError:
-            logger.info(f"Процесс pid={pid} уже не существует")
-        except OSError as e:
-            logger.error(f"Ошибка при убийстве процесса pid={pid}: {e}")
+# Занятость пула проверяется при взятии соединения (database.CheckoutTimedPool):
+# запрос, который отвечает из снимка, Redis или памяти, не отклоняется
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return _shed(503, "db_pool", SHED_RETRY_AFTER_SECONDS, str(exc))
+
+
+@app.get("/health")
+async def health():
+    """Живость процесса, без обращения к БД."""
+    return {"status": "ok"}
+
 
-    pid_file.unlink(missing_ok=True)
-    return killed
+# ====== Метрики ======
 
 
-def _delete_all_cookies(db: Session) -> int:
-    """Удаляет все куки из БД. Возвращает количество удалённых записей."""
-    count = db.query(Cookie).delete()
-    db.commit()
-    logger.info(f"Удалено {count} куки из базы данных")
-    return count
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Шаблон пути, а не сам путь: метки не должны плодиться
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+
+async def server_timing(request: Request, call_next):
+    # Фазы раскрывают устройство сервиса (кеш, снимок, реплика) - только админу
+    if not _is_admin(request.headers.get("x-api-key")):
+        return await call_next(request)
+    timings = timing.start()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = timings.header()
+    return response
+
+
+if SERVER_TIMING:
+    app.middleware("http")(server_timing)
+
+
+# Когда последний раз считали размер пула (COUNT по классам)
+pool_counted_at = -math.inf
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Метрики в формате Prometheus: пул (из БД) и этот воркер. Если БД не ответила
+    за METRICS_DB_TIMEOUT_SECONDS, метрики пула - с прошлого удачного чтения.
+    """
+    try:
+        await asyncio.wait_for(_observe_pool(), METRICS_DB_TIMEOUT_SECONDS)
+    except (SQLAlchemyError, OSError, TimeoutError) as e:
+        POOL_OBSERVE_FAILURES.inc()
+        logger.warning(f"Метрики пула не прочитаны, отдаём прошлые: {e!r}")
+    DB_POOL_CHECKED_OUT.set(async_engine.pool.checkedout())
+    IN_FLIGHT.set(concurrency.active)
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def _edge_timestamp(after_captcha: bool, newest: bool):
+    """Время самой свежей или самой старой куки класса - одна проба по индексу."""
+    order = Cookie.timestamp.desc() if newest else Cookie.timestamp
+    return (
+        select(Cookie.timestamp)
+        .where(in_current_epoch(), Cookie.after_captcha == after_captcha)
+        .order_by(order)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+async def _observe_pool() -> None:
+    """
+    Метрики пула через своё соединение (database.metrics_engine), а не пул API:
+    при занятом пуле скрейп не ждёт DB_POOL_TIMEOUT.
+    """
+    global pool_counted_at
+    classes = (False, True)
+    async with MetricsSessionLocal() as db:
+        now = utcnow()
+        edges = [
+            _edge_timestamp(after_captcha, newest)
+            for after_captcha in classes
+            for newest in (True, False)
+        ]
+        row = (
+            await db.execute(
+                select(
+                    *edges,
+                    select(func.max(Cookie.id)).scalar_subquery(),
+                    select(PoolState.floor_id)
+                    .where(PoolState.id == 1)
+                    .scalar_subquery(),
+                )
+            )
+        ).one()
+        # COUNT проходит весь индекс класса - не на каждый скрейп
+        counts = {}
+        if time.monotonic() - pool_counted_at >= METRICS_POOL_COUNT_SECONDS:
+            for after_captcha in classes:
+                counts[after_captcha] = await db.scalar(
+                    select(func.count())
+                    .select_from(Cookie)
+                    .where(in_current_epoch(), Cookie.after_captcha == after_captcha)
+                )
+            pool_counted_at = time.monotonic()
+
+    for i, after_captcha in enumerate(classes):
+        newest, oldest = row[2 * i], row[2 * i + 1]
+        # Пустой класс (например, сразу после инвалидации): размер 0 без COUNT,
+        # возраст не определён - тоже 0
+        if newest is None:
+            counts[after_captcha] = 0
+        if after_captcha in counts:
+            POOL_SIZE.set(counts[after_captcha], after_captcha=after_captcha)
+        NEWEST_AGE.set(
+            (now - newest).total_seconds() if newest else 0, after_captcha=after_captcha
+        )
+        OLDEST_AGE.set(
+            (now - oldest).total_seconds() if oldest else 0, after_captcha=after_captcha
+        )
+
+    # После TRUNCATE таблица пуста - последний id остаётся в floor_id
+    last_id, floor_id = row[-2:]
+    INSERTED.set_total(max(last_id or 0, floor_id or 0))
 
 
 # ====== Получение куки ======
 
 
+def _raw_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+def _cookie_response(cookie: Cookie) -> Response:
+    # Тело собрано при вставке - отдаём байты без json.loads/повторного кодирования
+    return _raw_response(cookie.response_body())
+
+
+def _since(max_age: int | None) -> datetime | None:
+    return utcnow() - timedelta(seconds=max_age) if max_age else None
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
 @app.get("/latest-cookie")
-def get_latest_cookie(
+async def get_latest_cookie(
     after_captcha: bool | None = Query(
         None, description="True = после капчи, False = без капчи, None = любая"
     ),
-    db: Session = Depends(get_db),
+    max_age: int | None = Query(None, ge=1, description="Не старше, секунд"),
+    proxy: str | None = Query(None, description="Только куки, собранные через прокси"),
+    primary: bool = Query(
+        False, description="Читать с primary в обход реплик, кешей и снимка"
+    ),
+    if_none_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Cookie).order_by(Cookie.timestamp.desc())
-    if after_captcha is not None:
-        query = query.filter(Cookie.after_captcha == after_captcha)
-    cookie = query.first()
-    if not cookie:
+    since = _since(max_age)
+    use_snapshot = snapshot_reader and not proxy and not primary
+    snapshot = snapshot_reader.current() if use_snapshot else None
+    if snapshot:
+        latest = snapshot.latest(after_captcha, since)
+    elif proxy or primary:
+        # Кеши держат только самую свежую куку класса - по прокси идём в БД
+        conditions = [proxy_condition(proxy)] if proxy else []
+        if since:
+            conditions.append(Cookie.timestamp >= since)
+        if primary:
+            # Строгая свежесть: реплика может отставать до REPLICA_MAX_LAG_SECONDS
+            async with AsyncSessionLocal() as primary_db:
+                latest = await fetch_latest(primary_db, after_captcha, *conditions)
+        else:
+            latest = await fetch_latest(db, after_captcha, *conditions)
+    else:
+        latest = None
+        if pool_cache:
+            latest = await pool_cache.latest(after_captcha)
+        if latest is None:
+            # Одновременные одинаковые запросы делят один SELECT
+            latest = await latest_cache.get(after_captcha)
+
+    # Самая свежая строка старше max_age - значит, свежих нет вовсе
+    if latest is None or (since and latest.timestamp < since):
         return {"error": "Нет подходящих куки"}
-    return {
-        "id": cookie.id,
-        "cookies": cookie.to_dict(),
-        "proxy": cookie.proxy,
-        "after_captcha": cookie.after_captcha,
-        "timestamp": cookie.timestamp.isoformat(),
-    }
+
+    # Тело строки не меняется, поэтому id достаточно для ETag
+    headers = {"ETag": f'"{latest.id}"', "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=latest.body, media_type="application/json", headers=headers)
 
 
 @app.get("/random-cookie")
-def get_random_cookie(
+async def get_random_cookie(
     after_captcha: bool | None = Query(
         None, description="True = после капчи, False = без капчи, None = любая"
     ),
-    db: Session = Depends(get_db),
+    max_age: int | None = Query(None, ge=1, description="Не старше, секунд"),
+    proxy: str | None = Query(None, description="Только куки, собранные через прокси"),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Cookie)
-    if after_captcha is not None:
-        query = query.filter(Cookie.after_captcha == after_captcha)
-    cookies_list = query.all()
-    if not cookies_list:
+    since = _since(max_age)
+    snapshot = snapshot_reader.current() if snapshot_reader and not proxy else None
+    if snapshot:
+        body = snapshot.random(after_captcha, since)
+        if body is None:
+            return {"error": "Нет подходящих куки"}
+        return _raw_response(body)
+
+    conditions = []
+    if since:
+        conditions.append(Cookie.timestamp >= since)
+    if proxy:
+        conditions.append(proxy_condition(proxy))
+
+    if conditions:
+        # Кеш и индекс в памяти не знают возраст и прокси строк - выбираем в БД
+        random_cookie = await pick_where(db, after_captcha, *conditions)
+    elif pool_cache and (body := await pool_cache.random(after_captcha)):
+        return _raw_response(body)
+    else:
+        random_cookie = await sampler.pick(db, after_captcha)
+    if not random_cookie:
         return {"error": "Нет подходящих куки"}
-    random_cookie = random.choice(cookies_list)
-    return {
-        "id": random_cookie.id,
-        "cookies": random_cookie.to_dict(),
-        "proxy": random_cookie.proxy,
-        "after_captcha": random_cookie.after_captcha,
-        "timestamp": random_cookie.timestamp.isoformat(),
-    }
+    return _cookie_response(random_cookie)
 
 
-# ====== Сборщик куки ======
+@app.get("/proxies")
+async def get_proxies(db: AsyncSession = Depends(get_read_db)):
+    """Сколько куки в пуле по каждому прокси и когда собрана самая свежая."""
+    return await proxy_summary(db)
 
 
-@app.post("/start_cookie_collector")
-async def start_collector():
-    if _is_process_running(COLLECTOR_PID_FILE):
-        raise HTTPException(409, detail="Сборщик куков уже запущен")
+@app.post("/cookies/lease")
+async def lease(
+    n: int = Query(1, ge=1, le=LEASE_MAX_COUNT, description="Сколько куки выдать"),
+    after_captcha: bool | None = Query(
+        None, description="True = после капчи, False = без капчи, None = любая"
+    ),
+    db: AsyncSession = Depends(get_db),
+):
+    """До n разных куки за один запрос, начиная с дольше всех не выдававшихся."""
+    cookies = await lease_cookies(db, n, after_captcha)
+    if not cookies:
+        return {"error": "Нет подходящих куки"}
+    return _raw_response(
+        b'{"count":%d,"cookies":[' % len(cookies)
+        + b",".join(cookie.response_body() for cookie in cookies)
+        + b"]}"
+    )
 
-    try:
-        pid = _launch_detached(
-            cmd=["uv", "run", "python", "run_collector.py"],
-            cwd=COLLECTOR_DIR,
-            pid_file=COLLECTOR_PID_FILE,
+
+@app.get("/export")
+async def export(
+    after_captcha: bool | None = Query(
+        None, description="True = после капчи, False = без капчи, None = любая"
+    ),
+    since_id: int | None = Query(
+        None, ge=0, description="Только id больше этого (инкрементальная выгрузка)"
+    ),
+    max_age: int | None = Query(None, ge=1, description="Не старше, секунд"),
+    proxy: str | None = Query(None, description="Только куки, собранные через прокси"),
+    sessions: async_sessionmaker = Depends(read_sessions),
+):
+    """Весь пул в NDJSON по возрастанию id: на строку кука, как в /random-cookie."""
+    return StreamingResponse(
+        export_cookies(
+            sessions,
+            EXPORT_BATCH_SIZE,
+            after_captcha=after_captcha,
+            since_id=since_id,
+            since=_since(max_age),
+            proxy=proxy,
+        ),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stream/cookies")
+async def stream_cookies(
+    after_captcha: bool | None = Query(
+        None, description="True = после капчи, False = без капчи, None = любая"
+    ),
+):
+    """Server-Sent Events: каждая новая кука сразу после сохранения коллектором."""
+    if broadcaster is None:
+        raise HTTPException(501, detail="Push доступен только с PostgreSQL")
+
+    subscription = broadcaster.subscribe(after_captcha)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    cookie_id, body = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=STREAM_KEEPALIVE_SECONDS
+                    )
+                except TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"id: %d\nevent: cookie\ndata: %s\n\n" % (cookie_id, body)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ====== Администрирование ======
+
+
+@app.exception_handler(ApiKeyError)
+async def api_key_error_handler(request: Request, exc: ApiKeyError):
+    return JSONResponse(status_code=403, content={"detail": str(exc)})
+
+
+def _is_admin(x_api_key: str | None) -> bool:
+    return bool(
+        ADMIN_API_KEY and x_api_key and hmac.compare_digest(x_api_key, ADMIN_API_KEY)
+    )
+
+
+def require_admin(x_api_key: str | None = Header(None)) -> None:
+    if not ADMIN_API_KEY:
+        raise ApiKeyError("Админ-эндпоинты выключены: не задан ADMIN_API_KEY")
+    if not x_api_key or not hmac.compare_digest(x_api_key, ADMIN_API_KEY):
+        raise ApiKeyError("Неверный X-Api-Key")
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Период семплирования"),
+):
+    """
+    Семплирует стеки всех потоков этого воркера seconds секунд.
+    Ответ - свёрнутые стеки для flamegraph.pl или speedscope.
+    """
+    if profile_lock.locked():
+        raise HTTPException(409, detail="Профилирование уже идёт")
+    async with profile_lock:
+        counts = await asyncio.to_thread(
+            profiler.sample, seconds, interval_ms / 1000
         )
-        return {
-            "status": "launched",
-            "pid": pid,
-        }
+    return PlainTextResponse(profiler.collapsed(counts))
+
+
+# ====== Фоновые воркеры ======
+
+
+@app.get("/workers")
+async def workers():
+    """Состояние сборщика и чистильщика: pid, аптайм, пульс, перезапуски."""
+    return await supervisor.status()
+
+
+async def _start_worker(name: str, title: str) -> dict:
+    try:
+        status = await supervisor.start(name)
     except Exception as e:
-        raise HTTPException(500, detail=f"Не удалось запустить сборщик: {e}")
+        raise HTTPException(500, detail=f"Не удалось запустить {title}: {e}")
+    if status is None:
+        raise HTTPException(409, detail=f"{title.capitalize()} куков уже запущен")
+    return {"status": "launched", "pid": status["pid"]}
 
 
-@app.post("/stop_cookie_collector")
-async def stop_collector(db: Session = Depends(get_db)):
-    killed = _kill_process_tree(COLLECTOR_PID_FILE)
-    deleted = _delete_all_cookies(db)
+async def _stop_worker(
+    name: str, db: AsyncSession, background_tasks: BackgroundTasks
+) -> dict:
+    killed = await supervisor.stop(name)
+    epoch = await _invalidate_pool(db, background_tasks)
 
     return {
         "status": "stopped",
         "process_killed": killed,
-        "cookies_deleted": deleted,
+        "pool_epoch": epoch,
     }
 
 
+# ====== Сборщик куки ======
+
+
+@app.post("/start_cookie_collector")
+async def start_collector():
+    return await _start_worker("collector", "сборщик")
+
+
+@app.post("/stop_cookie_collector")
+async def stop_collector(
+    background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)
+):
+    return await _stop_worker("collector", db, background_tasks)
+
+
 # ====== Чистильщик куки ======
 
 
 @app.post("/start_cookie_cleaner")
 async def start_cleaner():
-    if _is_process_running(CLEANER_PID_FILE):
-        raise HTTPException(409, detail="Чистильщик куков уже запущен")
-
-    try:
-        pid = _launch_detached(
-            cmd=["uv", "run", "python", "main.py"],
-            cwd=CLEANER_DIR,
-            pid_file=CLEANER_PID_FILE,
-        )
-        return {
-            "status": "launched",
-            "pid": pid,
-        }
-    except Exception as e:
-        raise HTTPException(500, detail=f"Не удалось запустить чистильщик: {e}")
+    return await _start_worker("cleaner", "чистильщик")
 
 
 @app.post("/stop_cookie_cleaner")
-async def stop_cleaner(db: Session = Depends(get_db)):
-    killed = _kill_process_tree(CLEANER_PID_FILE)
-    deleted = _delete_all_cookies(db)
-
-    return {
-        "status": "stopped",
-        "process_killed": killed,
-        "cookies_deleted": deleted,
-    }
+async def stop_cleaner(
+    background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)
+):
+    return await _stop_worker("cleaner", db, background_tasks)
@@ -0,0 +1,432 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция описывает схему на момент своей версии (без импорта
+текущих моделей), применённые версии записываются в schema_version.
+API и коллектор применяют миграции при старте; вручную:
+
+    python migrations.py
+
+Что горячие запросы идут по индексам, проверяет tests/test_query_plans.py.
+"""
+
+import json
+import logging
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from collections.abc import Iterator
+from typing import Callable
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Engine,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки, чтобы API и коллектор не мигрировали одновременно
+MIGRATION_LOCK_KEY = 74_211_001
+# Столько строк cookies миграция данных держит в памяти за раз
+MIGRATION_BATCH = 1000
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column(
+        "applied_at",
+        DateTime,
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc).replace(tzinfo=None),
+    ),
+)
+
+Migration = Callable[[Connection], None]
+MIGRATIONS: list[tuple[int, str, Migration]] = []
+
+
+def migration(version: int, description: str):
+    def register(upgrade: Migration) -> Migration:
+        MIGRATIONS.append((version, description, upgrade))
+        return upgrade
+
+    return register
+
+
+def _add_column(conn: Connection, table: str, column: Column) -> None:
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+
+def _batches(conn: Connection, query: str, **types) -> Iterator[list]:
+    """
+    Строки query (SELECT id, ... FROM cookies WHERE ...) пачками по
+    MIGRATION_BATCH в порядке id: keyset по id, а не вся таблица в памяти.
+    """
+    after = 0
+    while True:
+        rows = conn.execute(
+            text(f"{query} AND id > :after ORDER BY id LIMIT :limit").columns(**types),
+            {"after": after, "limit": MIGRATION_BATCH},
+        ).all()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1].id
+
+
+# ====== Миграции ======
+
+
+@migration(1, "Таблица cookies")
+def _create_cookies(conn: Connection) -> None:
+    # Та же схема, что раньше создавал Base.metadata.create_all.
+    # id обязаны только расти (на этом держится эпоха пула), поэтому
+    # в SQLite - AUTOINCREMENT, иначе id удалённых строк переиспользуются
+    if conn.dialect.name == "postgresql":
+        id_column = "id SERIAL NOT NULL PRIMARY KEY"
+    else:
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS cookies ("
+            f" {id_column},"
+            " timestamp TIMESTAMP WITHOUT TIME ZONE,"
+            " cookies_json VARCHAR,"
+            " proxy VARCHAR,"
+            " after_captcha BOOLEAN NOT NULL)"
+        )
+    )
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_cookies_id ON cookies (id)"))
+
+
+@migration(2, "Индексы для /latest-cookie и чистильщика")
+def _add_timestamp_indexes(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_cookies_after_captcha_timestamp"
+            " ON cookies (after_captcha, timestamp)"
+        )
+    )
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_cookies_timestamp ON cookies (timestamp)")
+    )
+
+
+@migration(3, "Готовое тело ответа в cookies.payload")
+def _add_payload(conn: Connection) -> None:
+    _add_column(conn, "cookies", Column("payload", LargeBinary))
+
+    # Формат на момент версии 3 (см. models.encode_payload)
+    for rows in _batches(
+        conn,
+        "SELECT id, timestamp, cookies_json, proxy, after_captcha"
+        " FROM cookies WHERE payload IS NULL",
+        timestamp=DateTime,
+        after_captcha=Boolean,
+    ):
+        updates = [
+            {
+                "row_id": row.id,
+                "payload": json.dumps(
+                    {
+                        "cookies": json.loads(row.cookies_json),
+                        "proxy": row.proxy,
+                        "after_captcha": row.after_captcha,
+                        "timestamp": row.timestamp.isoformat(),
+                    },
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                ).encode(),
+            }
+            for row in rows
+        ]
+        conn.execute(
+            text("UPDATE cookies SET payload = :payload WHERE id = :row_id").bindparams(
+                bindparam("payload", type_=LargeBinary)
+            ),
+            updates,
+        )
+
+
+@migration(4, "Эпоха пула для мгновенной инвалидации")
+def _add_pool_state(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS pool_state ("
+            " id INTEGER NOT NULL,"
+            " epoch INTEGER NOT NULL DEFAULT 0,"
+            " floor_id BIGINT NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (id))"
+        )
+    )
+    conn.execute(
+        text(
+            "INSERT INTO pool_state (id, epoch, floor_id)"
+            " SELECT 1, 0, 0 WHERE NOT EXISTS (SELECT 1 FROM pool_state WHERE id = 1)"
+        )
+    )
+
+
+@migration(5, "Учёт выдачи куки через /cookies/lease")
+def _add_lease_columns(conn: Connection) -> None:
+    _add_column(
+        conn,
+        "cookies",
+        Column("lease_count", Integer, nullable=False, server_default="0"),
+    )
+    _add_column(conn, "cookies", Column("last_leased_at", DateTime))
+    # Порядок выдачи: сначала ни разу не выданные, затем давно выданные.
+    # В SQLite NULL и так идут первыми, а NULLS FIRST в индексе запрещён
+    nulls_first = " NULLS FIRST" if conn.dialect.name == "postgresql" else ""
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_cookies_after_captcha_lease"
+            f" ON cookies (after_captcha, last_leased_at{nulls_first}, id)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_cookies_lease"
+            f" ON cookies (last_leased_at{nulls_first}, id)"
+        )
+    )
+
+
+@migration(6, "Справочник прокси вместо URL в каждой строке")
+def _add_proxies(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        id_column = "id SERIAL NOT NULL PRIMARY KEY"
+    else:
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS proxies ("
+            f" {id_column},"
+            " url VARCHAR NOT NULL UNIQUE)"
+        )
+    )
+    # Без внешнего ключа: справочник только пополняется, а LIKE при
+    # секционировании (RETENTION_MODE=partition) внешние ключи не переносит
+    _add_column(conn, "cookies", Column("proxy_id", Integer))
+    conn.execute(
+        text(
+            "INSERT INTO proxies (url)"
+            " SELECT DISTINCT proxy FROM cookies"
+            " WHERE proxy IS NOT NULL AND proxy NOT IN (SELECT url FROM proxies)"
+        )
+    )
+    conn.execute(
+        text(
+            "UPDATE cookies SET proxy_id ="
+            " (SELECT proxies.id FROM proxies WHERE proxies.url = cookies.proxy)"
+            " WHERE proxy IS NOT NULL"
+        )
+    )
+
+    # proxy больше не хранится в payload - его подставляет Cookie.response_body
+    for rows in _batches(
+        conn,
+        "SELECT id, payload FROM cookies WHERE payload IS NOT NULL",
+        payload=LargeBinary,
+    ):
+        updates = []
+        for row in rows:
+            payload = json.loads(row.payload)
+            payload.pop("proxy", None)
+            updates.append(
+                {
+                    "row_id": row.id,
+                    "payload": json.dumps(
+                        payload, ensure_ascii=False, separators=(",", ":")
+                    ).encode(),
+                }
+            )
+        conn.execute(
+            text("UPDATE cookies SET payload = :payload WHERE id = :row_id").bindparams(
+                bindparam("payload", type_=LargeBinary)
+            ),
+            updates,
+        )
+
+    conn.execute(text("ALTER TABLE cookies DROP COLUMN proxy"))
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_cookies_proxy_id_timestamp"
+            " ON cookies (proxy_id, timestamp)"
+        )
+    )
+
+
+def _zdict_v7(names: list[str]) -> bytes:
+    # Формат словаря на момент версии 7 (см. payloads.build_zdict)
+    parts = ['{"cookies":{']
+    parts += [f'"{name}":"' for name in names]
+    parts.append('"},"after_captcha":false,"after_captcha":true,"timestamp":"20')
+    return "".join(parts).encode()[-32 * 1024 :]
+
+
+@migration(7, "Сжатие payload словарём имён куки, без cookies_json")
+def _compress_payloads(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        id_column = "id SERIAL NOT NULL PRIMARY KEY"
+    else:
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    blob = LargeBinary().compile(dialect=conn.dialect)
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS payload_dicts ("
+            f" {id_column},"
+            " names VARCHAR NOT NULL,"
+            f" zdict {blob} NOT NULL,"
+            " created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL)"
+        )
+    )
+    _add_column(conn, "cookies", Column("payload_dict_id", Integer))
+
+    # Два прохода: сначала частоты имён для словаря, затем сжатие
+    names = Counter()
+    for rows in _batches(
+        conn,
+        "SELECT id, cookies_json FROM cookies WHERE payload_dict_id IS NULL",
+    ):
+        for row in rows:
+            # Только ключи: update(dict) прибавил бы значения кук как счётчики
+            names.update(
+                json.loads(row.cookies_json).keys() if row.cookies_json else ()
+            )
+
+    ordered = sorted(names, key=names.__getitem__)
+    zdict = _zdict_v7(ordered)
+    dict_id = None
+    for rows in _batches(
+        conn,
+        "SELECT id, timestamp, cookies_json, after_captcha, payload FROM cookies"
+        " WHERE payload_dict_id IS NULL",
+        timestamp=DateTime,
+        after_captcha=Boolean,
+        payload=LargeBinary,
+    ):
+        if dict_id is None:
+            dict_id = conn.execute(
+                text(
+                    "INSERT INTO payload_dicts (names, zdict, created_at)"
+                    " VALUES (:names, :zdict, :created_at) RETURNING id"
+                ).bindparams(bindparam("zdict", type_=LargeBinary)),
+                {
+                    "names": json.dumps(ordered),
+                    "zdict": zdict,
+                    "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+                },
+            ).scalar_one()
+
+        updates = []
+        for row in rows:
+            cookies = json.loads(row.cookies_json) if row.cookies_json else {}
+            # Формат payload на момент версии 6: без proxy
+            body = (
+                row.payload
+                or json.dumps(
+                    {
+                        "cookies": cookies,
+                        "after_captcha": row.after_captcha,
+                        "timestamp": row.timestamp.isoformat(),
+                    },
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                ).encode()
+            )
+            compressor = zlib.compressobj(level=6, wbits=-15, zdict=zdict)
+            updates.append(
+                {
+                    "row_id": row.id,
+                    "payload": compressor.compress(body) + compressor.flush(),
+                    "dict_id": dict_id,
+                }
+            )
+        conn.execute(
+            text(
+                "UPDATE cookies SET payload = :payload, payload_dict_id = :dict_id"
+                " WHERE id = :row_id"
+            ).bindparams(bindparam("payload", type_=LargeBinary)),
+            updates,
+        )
+
+    conn.execute(text("ALTER TABLE cookies DROP COLUMN cookies_json"))
+
+
+@migration(8, "id в индексе (after_captcha, timestamp) для батчей чистильщика")
+def _add_id_to_class_index(conn: Connection) -> None:
+    # Чистильщик идёт по ключу (timestamp, id) внутри класса: без id в индексе
+    # каждый батч сортирует весь класс. /latest-cookie индекс так же подходит
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_cookies_after_captcha_timestamp_id"
+            " ON cookies (after_captcha, timestamp, id)"
+        )
+    )
+    conn.execute(text("DROP INDEX IF EXISTS ix_cookies_after_captcha_timestamp"))
+
+
+# ====== Применение ======
+
+
+def current_version(conn: Connection) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """Применяет недостающие миграции в одной транзакции. Возвращает версию схемы."""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+            )
+
+        version = current_version(conn)
+        for target, description, upgrade in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if target <= version:
+                continue
+            logger.info(f"Миграция схемы {version} -> {target}: {description}")
+            upgrade(conn)
+            conn.execute(
+                insert(schema_version).values(version=target, description=description)
+            )
+            version = target
+
+    return version
+
+
+if __name__ == "__main__":
+    from config import DB_URL
+    from storage import storage_for
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    engine = storage_for(DB_URL).create_engine()
+    version = run_migrations(engine)
+    logger.info(f"Версия схемы: {version}")
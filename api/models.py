@@ -1,19 +1,157 @@
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    select,
+)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+
+try:
+    import timing
+    from payloads import decode_payload
+except ImportError:  # импорт из коллектора/чистильщика как api.models
+    from api import timing
+    from api.payloads import decode_payload
 
 Base = declarative_base()
 
 
+def utcnow() -> datetime:
+    """Текущее время UTC без зоны: колонки DateTime в пуле наивные."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def encode_payload(cookies: dict, after_captcha: bool, timestamp: datetime) -> bytes:
+    """Тело ответа без id и proxy - кодируется один раз при вставке."""
+    return json.dumps(
+        {
+            "cookies": cookies,
+            "after_captcha": after_captcha,
+            "timestamp": timestamp.isoformat(),
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+def build_response_body(
+    cookie_id: int, proxy: str | None, dict_id: int | None, payload: bytes
+) -> bytes:
+    """JSON ответа: id и proxy дописываются в начало готового payload."""
+    started = time.perf_counter()
+    payload = decode_payload(dict_id, payload)
+    proxy = json.dumps(proxy, ensure_ascii=False).encode()
+    body = b'{"id":%d,"proxy":%s,' % (cookie_id, proxy) + payload[1:]
+    timing.record("decode", time.perf_counter() - started)
+    return body
+
+
+class CookieBody(NamedTuple):
+    """Готовое тело ответа вместе с полями, которые нужны без его разбора."""
+
+    id: int
+    timestamp: datetime
+    body: bytes
+
+
+class Proxy(Base):
+    """Справочник прокси: URL (с логином и паролем) хранится один раз."""
+
+    __tablename__ = "proxies"
+    id = Column(Integer, primary_key=True)
+    url = Column(String, nullable=False, unique=True)
+
+
 class Cookie(Base):
     __tablename__ = "cookies"
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    cookies_json = Column(String)
-    proxy = Column(String)
+    timestamp = Column(DateTime, default=utcnow)
+    proxy_id = Column(Integer, ForeignKey("proxies.id"))
+    # Только чтение, LEFT JOIN proxies в каждом select(Cookie); пишется proxy_id
+    proxy_ref = relationship(Proxy, lazy="joined", viewonly=True)
     after_captcha = Column(Boolean, default=False, nullable=False)
+    # Готовое тело ответа без id и proxy, сжатое словарём payload_dict_id
+    payload = Column(LargeBinary)
+    payload_dict_id = Column(Integer)
+    # Учёт выдачи через /cookies/lease
+    lease_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_leased_at = Column(DateTime)
+
+    # Схема меняется только через migrations.py - индексы здесь для справки ORM
+    __table_args__ = (
+        Index(
+            "ix_cookies_after_captcha_timestamp_id", "after_captcha", "timestamp", "id"
+        ),
+        Index("ix_cookies_timestamp", "timestamp"),
+        Index(
+            "ix_cookies_after_captcha_lease",
+            "after_captcha",
+            last_leased_at.asc().nulls_first(),
+            "id",
+        ),
+        Index("ix_cookies_lease", last_leased_at.asc().nulls_first(), "id"),
+        Index("ix_cookies_proxy_id_timestamp", "proxy_id", "timestamp"),
+    )
+
+    @classmethod
+    def create(cls, cookies: dict, proxy: str, after_captcha: bool) -> "Cookie":
+        """
+        Новая кука. proxy_id проставляет proxies.intern_proxies перед
+        сохранением, до этого URL лежит в несохраняемом proxy_ref.
+        """
+        timestamp = utcnow()
+        return cls(
+            timestamp=timestamp,
+            proxy_ref=Proxy(url=proxy) if proxy else None,
+            after_captcha=after_captcha,
+            payload=encode_payload(cookies, after_captcha, timestamp),
+        )
+
+    @property
+    def proxy(self) -> str | None:
+        return self.proxy_ref.url if self.proxy_ref else None
 
     def to_dict(self):
-        return json.loads(self.cookies_json)
+        payload = decode_payload(self.payload_dict_id, self.payload)
+        return json.loads(payload)["cookies"]
+
+    def response_body(self) -> bytes:
+        return build_response_body(
+            self.id, self.proxy, self.payload_dict_id, self.payload
+        )
+
+
+class PoolState(Base):
+    """
+    Единственная строка (id=1) с эпохой пула.
+
+    Остановка сборщика/чистильщика не удаляет куки, а поднимает эпоху и
+    запоминает floor_id = max(cookies.id): читатели видят только id > floor_id,
+    старые строки удаляются в фоне.
+    """
+
+    __tablename__ = "pool_state"
+    id = Column(Integer, primary_key=True)
+    epoch = Column(Integer, nullable=False, default=0)
+    floor_id = Column(BigInteger, nullable=False, default=0)
+
+
+def floor_id_subquery():
+    return select(PoolState.floor_id).where(PoolState.id == 1).scalar_subquery()
+
+
+def in_current_epoch():
+    """Условие для всех чтений пула: строка не инвалидирована остановкой."""
+    return Cookie.id > floor_id_subquery()
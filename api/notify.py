@@ -0,0 +1,140 @@
+"""
+Push новых куки через Postgres LISTEN/NOTIFY.
+
+Коллектор в транзакции сохранения вызывает notify_inserts - уведомление
+уходит подписчикам только после commit. В API один CookieBroadcaster
+слушает канал, подгружает тело новой строки один раз и раздаёт его
+всем подключённым клиентам (/stream/cookies).
+"""
+
+import asyncio
+import logging
+from collections.abc import Callable
+
+import asyncpg
+from sqlalchemy import text
+
+try:
+    from models import Cookie
+except ImportError:  # импорт из коллектора как api.notify
+    from api.models import Cookie
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cookie_inserted"
+RECONNECT_SECONDS = 5
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def notify_inserts(session, cookies: list[Cookie]) -> None:
+    """Ставит NOTIFY о сохранённых (уже flush-нутых) куках в текущую транзакцию."""
+    if not cookies or session.get_bind().dialect.name != "postgresql":
+        return
+    session.execute(
+        text(
+            "SELECT pg_notify(:channel, payload)"
+            " FROM unnest(CAST(:payloads AS text[])) AS payload"
+        ),
+        {
+            "channel": CHANNEL,
+            "payloads": [f"{c.id}:{int(c.after_captcha)}" for c in cookies],
+        },
+    )
+
+
+def _parse(payload: str) -> tuple[int, bool]:
+    cookie_id, after_captcha = payload.split(":")
+    return int(cookie_id), after_captcha == "1"
+
+
+class Subscription:
+    def __init__(self, after_captcha: bool | None):
+        self.after_captcha = after_captcha
+        self.queue: asyncio.Queue[tuple[int, bytes]] = asyncio.Queue(
+            SUBSCRIBER_QUEUE_SIZE
+        )
+
+    def push(self, cookie_id: int, body: bytes) -> None:
+        if self.queue.full():
+            # Медленный клиент - выкидываем самое старое, ему важнее свежее
+            self.queue.get_nowait()
+        self.queue.put_nowait((cookie_id, body))
+
+
+class CookieBroadcaster:
+    """Одно LISTEN-соединение на процесс API, раздача новых куки подписчикам."""
+
+    def __init__(self, dsn: str, session_factory):
+        self.dsn = dsn
+        self.session_factory = session_factory
+        self.subscriptions: set[Subscription] = set()
+        # Вызываются на каждую вставку с (id, after_captcha), без загрузки тела
+        self.on_insert: list[Callable[[int, bool], None]] = []
+        self._events: asyncio.Queue[str] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, after_captcha: bool | None) -> Subscription:
+        subscription = Subscription(after_captcha)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self._events.put_nowait(payload)
+
+    async def _run(self) -> None:
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(CHANNEL, self._on_notify)
+                logger.info(f"Слушаем канал {CHANNEL}")
+                while not connection.is_closed():
+                    try:
+                        payload = await asyncio.wait_for(
+                            self._events.get(), timeout=RECONNECT_SECONDS
+                        )
+                    except TimeoutError:
+                        continue
+                    await self._dispatch(*_parse(payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"LISTEN {CHANNEL} прерван: {e}, переподключение")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _dispatch(self, cookie_id: int, after_captcha: bool) -> None:
+        for callback in self.on_insert:
+            callback(cookie_id, after_captcha)
+
+        targets = [
+            s
+            for s in self.subscriptions
+            if s.after_captcha is None or s.after_captcha == after_captcha
+        ]
+        if not targets:
+            return
+
+        async with self.session_factory() as db:
+            cookie = await db.get(Cookie, cookie_id)
+        if cookie is None:
+            return
+        body = cookie.response_body()
+        for subscription in targets:
+            subscription.push(cookie_id, body)
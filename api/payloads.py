@@ -0,0 +1,169 @@
+"""
+Сжатие cookies.payload общими словарями zlib.
+
+Имена куки и каркас JSON повторяются в каждой строке, значения - нет. Из
+имён собирается preset-словарь zlib (zdict), его версия хранится в
+payload_dicts, а строка cookies ссылается на неё маленьким целым
+payload_dict_id. Повторы в теле сжимаются в ссылки на словарь, чтение -
+один zlib-распаковщик без разбора JSON. payload_dict_id = NULL - тело
+хранится без сжатия.
+
+Версии неизменяемы. Новую собирает коллектор, когда в батче много имён,
+которых нет в текущей. Процессы держат словари в памяти и подгружают
+незнакомую версию при первой встрече (в API - синхронным запросом, это
+случается один раз на версию).
+"""
+
+import json
+import threading
+import zlib
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Engine,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    func,
+    insert,
+    select,
+)
+
+ZDICT_MAX_BYTES = 32 * 1024
+# Доля незнакомых имён в батче, после которой нужна новая версия словаря
+DRIFT_THRESHOLD = 0.2
+# Сырой deflate: без заголовка и контрольной суммы zlib (минус 6 байт на строку)
+WBITS = -15
+
+payload_dicts = Table(
+    "payload_dicts",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("names", String, nullable=False),
+    Column("zdict", LargeBinary, nullable=False),
+    Column(
+        "created_at",
+        DateTime,
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc).replace(tzinfo=None),
+    ),
+)
+
+
+def build_zdict(names: list[str]) -> bytes:
+    """Словарь из имён от редких к частым: ссылки на конец словаря короче."""
+    parts = ['{"cookies":{']
+    parts += [f'"{name}":"' for name in names]
+    parts.append('"},"after_captcha":false,"after_captcha":true,"timestamp":"20')
+    return "".join(parts).encode()[-ZDICT_MAX_BYTES:]
+
+
+def compress(zdict: bytes, data: bytes) -> bytes:
+    compressor = zlib.compressobj(level=6, wbits=WBITS, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(zdict: bytes, data: bytes) -> bytes:
+    decompressor = zlib.decompressobj(wbits=WBITS, zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class PayloadDictionaries:
+    """Версии словаря в памяти процесса; bind(engine) - откуда их подгружать."""
+
+    def __init__(self):
+        self.engine: Engine | None = None
+        self._zdicts: dict[int, bytes] = {}
+        self._current: tuple[int, list[str], bytes] | None = None
+        self._lock = threading.Lock()
+
+    def bind(self, engine: Engine) -> None:
+        # Версии из другой БД здесь не действуют
+        with self._lock:
+            self.engine = engine
+            self._zdicts.clear()
+            self._current = None
+
+    def zdict(self, dict_id: int) -> bytes:
+        zdict = self._zdicts.get(dict_id)
+        if zdict is None:
+            with self.engine.connect() as conn:
+                zdict = conn.execute(
+                    select(payload_dicts.c.zdict).where(payload_dicts.c.id == dict_id)
+                ).scalar_one()
+            self._zdicts[dict_id] = zdict
+        return zdict
+
+    def for_names(self, names: Counter) -> tuple[int, bytes]:
+        """Текущая версия, если она знает почти все имена, иначе новая."""
+        with self._lock:
+            if self._current is None:
+                self._current = self._load_latest()
+            if self._current is not None:
+                dict_id, known, zdict = self._current
+                known_set = set(known)
+                unknown = [name for name in names if name not in known_set]
+                if len(unknown) <= DRIFT_THRESHOLD * len(names):
+                    return dict_id, zdict
+                # Старые имена остаются, новые - ближе к концу словаря
+                ordered = known + sorted(unknown, key=names.__getitem__)
+            else:
+                ordered = sorted(names, key=names.__getitem__)
+
+            self._current = self._create(ordered)
+            dict_id, _, zdict = self._current
+            return dict_id, zdict
+
+    def _load_latest(self) -> tuple[int, list[str], bytes] | None:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(payload_dicts).where(
+                    payload_dicts.c.id
+                    == select(func.max(payload_dicts.c.id)).scalar_subquery()
+                )
+            ).first()
+        if row is None:
+            return None
+        self._zdicts[row.id] = row.zdict
+        return row.id, json.loads(row.names), row.zdict
+
+    def _create(self, names: list[str]) -> tuple[int, list[str], bytes]:
+        # Своя транзакция: версия должна существовать, даже если батч откатится
+        zdict = build_zdict(names)
+        with self.engine.begin() as conn:
+            dict_id = conn.execute(
+                insert(payload_dicts)
+                .values(names=json.dumps(names), zdict=zdict)
+                .returning(payload_dicts.c.id)
+            ).scalar_one()
+        self._zdicts[dict_id] = zdict
+        return dict_id, names, zdict
+
+
+dictionaries = PayloadDictionaries()
+
+
+def decode_payload(dict_id: int | None, payload: bytes) -> bytes:
+    if dict_id is None:
+        return payload
+    return decompress(dictionaries.zdict(dict_id), payload)
+
+
+def compress_payloads(cookies: Iterable) -> None:
+    """Сжимает payload ещё не сжатых новых куки (коллектор, перед вставкой)."""
+    cookies = [cookie for cookie in cookies if cookie.payload_dict_id is None]
+    if not cookies:
+        return
+    names = Counter(
+        name for cookie in cookies for name in json.loads(cookie.payload)["cookies"]
+    )
+    dict_id, zdict = dictionaries.for_names(names)
+    for cookie in cookies:
+        cookie.payload = compress(zdict, cookie.payload)
+        cookie.payload_dict_id = dict_id
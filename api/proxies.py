@@ -0,0 +1,72 @@
+"""
+Справочник прокси (таблица proxies).
+
+Каждая кука ссылается на свой прокси по proxy_id, URL хранится один раз.
+Коллектор пополняет справочник через intern_proxies перед вставкой батча,
+API фильтрует по прокси и отдаёт сводку /proxies.
+"""
+
+from collections.abc import Iterable
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+try:
+    from models import Cookie, Proxy, in_current_epoch
+except ImportError:  # импорт из коллектора как api.proxies
+    from api.models import Cookie, Proxy, in_current_epoch
+
+
+def intern_proxies(session: Session, cookies: Iterable[Cookie]) -> None:
+    """Проставляет куки proxy_id, добавляя в справочник недостающие URL."""
+    cookies = [cookie for cookie in cookies if cookie.proxy_ref is not None]
+    urls = {cookie.proxy_ref.url for cookie in cookies}
+    if not urls:
+        return
+
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    session.execute(
+        insert(Proxy)
+        .values([{"url": url} for url in urls])
+        .on_conflict_do_nothing(index_elements=[Proxy.url])
+    )
+    ids = dict(
+        session.execute(select(Proxy.url, Proxy.id).where(Proxy.url.in_(urls))).all()
+    )
+    for cookie in cookies:
+        cookie.proxy_id = ids[cookie.proxy_ref.url]
+
+
+def proxy_condition(url: str):
+    """Условие для select(Cookie): кука собрана через прокси url."""
+    return Cookie.proxy_id == (
+        select(Proxy.id).where(Proxy.url == url).scalar_subquery()
+    )
+
+
+async def proxy_summary(db: AsyncSession) -> list[dict]:
+    """
+    Количество куки и время самой свежей по каждому прокси.
+
+    Прокси немного, поэтому на каждый - свои подзапросы по индексу
+    (proxy_id, timestamp), а не GROUP BY по всей таблице.
+    """
+    in_pool = (Cookie.proxy_id == Proxy.id) & in_current_epoch()
+    count = select(func.count()).where(in_pool).scalar_subquery()
+    latest = select(func.max(Cookie.timestamp)).where(in_pool).scalar_subquery()
+    rows = await db.execute(
+        select(Proxy.url, count.label("count"), latest.label("latest")).order_by(
+            Proxy.id
+        )
+    )
+    return [
+        {
+            "proxy": row.url,
+            "count": row.count,
+            "latest": row.latest.isoformat() if row.latest else None,
+        }
+        for row in rows
+    ]
@@ -0,0 +1,263 @@
+import asyncio
+import random
+import time
+from array import array
+
+from config import SAMPLER_RESYNC_SECONDS, SAMPLER_SYNC_SECONDS
+from models import Cookie, in_current_epoch
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+MAX_PICK_ATTEMPTS = 5
+# pick_where: до стольких подходящих строк - счёт и k-я строка по индексу,
+# больше - случайные id по PICK_POINTS за запрос, не больше PICK_ROUNDS запросов
+PICK_COUNT_LIMIT = 1000
+PICK_POINTS = 64
+PICK_ROUNDS = 3
+
+
+class IdPool:
+    """Набор id с добавлением, удалением и случайным выбором за O(1)."""
+
+    __slots__ = ("_ids", "_pos")
+
+    def __init__(self):
+        self._ids = array("q")
+        self._pos: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index: int) -> int:
+        return self._ids[index]
+
+    def add(self, cookie_id: int) -> None:
+        if cookie_id in self._pos:
+            return
+        self._pos[cookie_id] = len(self._ids)
+        self._ids.append(cookie_id)
+
+    def discard(self, cookie_id: int) -> bool:
+        index = self._pos.pop(cookie_id, None)
+        if index is None:
+            return False
+        last = self._ids.pop()
+        if index < len(self._ids):
+            # Переносим последний id на место удалённого
+            self._ids[index] = last
+            self._pos[last] = index
+        return True
+
+    def clear(self) -> None:
+        self._ids = array("q")
+        self._pos.clear()
+
+
+class CookieSampler:
+    """
+    Индекс id подходящих куки в памяти, разбитый по after_captcha.
+
+    Новые строки подтягиваются инкрементально (id > последнего виденного),
+    удалённые чистильщиком выкидываются лениво при промахе и при полной
+    пересинхронизации раз в SAMPLER_RESYNC_SECONDS.
+
+    id из NOTIFY (add) приходят с primary, а читает pick с реплики, которая
+    могла ещё не доиграть строку. Промах по id новее всего, что реплика
+    отдавала при синхронизации, перепроверяется на primary, а без него
+    id остаётся в индексе до следующей синхронизации.
+
+    Работает в одном event loop: изменения индекса не содержат await,
+    поэтому отдельная блокировка нужна только для синхронизации с БД.
+    """
+
+    def __init__(
+        self,
+        sync_seconds: float = SAMPLER_SYNC_SECONDS,
+        resync_seconds: float = SAMPLER_RESYNC_SECONDS,
+        primary: async_sessionmaker | None = None,
+    ):
+        self.sync_seconds = sync_seconds
+        self.resync_seconds = resync_seconds
+        self.primary = primary
+        self._pools = {True: IdPool(), False: IdPool()}
+        self._max_id = 0
+        # Самый большой id, который вернула БД чтения; _max_id двигает и NOTIFY
+        self._synced_max_id = 0
+        self._synced_at = 0.0
+        self._resynced_at = 0.0
+        self._sync_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pools[True]) + len(self._pools[False])
+
+    def add(self, cookie_id: int, after_captcha: bool) -> None:
+        self._pools[after_captcha].add(cookie_id)
+        self._max_id = max(self._max_id, cookie_id)
+
+    def discard(self, cookie_id: int) -> None:
+        if not self._pools[True].discard(cookie_id):
+            self._pools[False].discard(cookie_id)
+
+    def clear(self) -> None:
+        self._pools[True].clear()
+        self._pools[False].clear()
+
+    async def sync(self, db: AsyncSession, full: bool = False) -> None:
+        """Подтягивает новые id из БД; full=True перестраивает индекс целиком."""
+        since = 0 if full else self._max_id
+        result = await db.execute(
+            select(Cookie.id, Cookie.after_captcha)
+            .where(Cookie.id > since, in_current_epoch())
+            .order_by(Cookie.id)
+        )
+        rows = result.all()
+
+        if full:
+            # id, добавленные пока шёл запрос, подтянет следующая синхронизация
+            self._pools = {True: IdPool(), False: IdPool()}
+            self._max_id = rows[-1][0] if rows else self._max_id
+            self._synced_max_id = 0
+            self._resynced_at = time.monotonic()
+        for cookie_id, after_captcha in rows:
+            self._pools[after_captcha].add(cookie_id)
+        if rows:
+            self._max_id = max(self._max_id, rows[-1][0])
+            self._synced_max_id = max(self._synced_max_id, rows[-1][0])
+        self._synced_at = time.monotonic()
+
+    async def maybe_sync(self, db: AsyncSession) -> None:
+        if time.monotonic() - self._synced_at < self.sync_seconds:
+            return
+
+        # Пока индекс ни разу не строился - ждём; дальше синхронизирует
+        # один запрос, остальные отвечают по текущему индексу
+        if self._sync_lock.locked() and self._resynced_at > 0:
+            return
+        async with self._sync_lock:
+            if time.monotonic() - self._synced_at < self.sync_seconds:
+                return
+            full = (
+                self._resynced_at == 0
+                or time.monotonic() - self._resynced_at >= self.resync_seconds
+            )
+            await self.sync(db, full=full)
+
+    def choose(self, after_captcha: bool | None) -> int | None:
+        """Случайный id из индекса без обращения к БД."""
+        if after_captcha is not None:
+            pool = self._pools[after_captcha]
+            return pool[random.randrange(len(pool))] if len(pool) else None
+
+        with_captcha, without_captcha = self._pools[True], self._pools[False]
+        total = len(with_captcha) + len(without_captcha)
+        if not total:
+            return None
+        index = random.randrange(total)
+        if index < len(with_captcha):
+            return with_captcha[index]
+        return without_captcha[index - len(with_captcha)]
+
+    async def pick(
+        self, db: AsyncSession, after_captcha: bool | None
+    ) -> Cookie | None:
+        """Выбирает случайную куку и загружает из БД только её."""
+        await self.maybe_sync(db)
+
+        for attempt in range(MAX_PICK_ATTEMPTS + 1):
+            if attempt == MAX_PICK_ATTEMPTS:
+                # Слишком много промахов - чистильщик удалил много строк
+                await self.sync(db, full=True)
+            cookie_id = self.choose(after_captcha)
+            if cookie_id is None:
+                return None
+            cookie = await _load(db, cookie_id)
+            if cookie is not None:
+                return cookie
+            if cookie_id > self._synced_max_id:
+                # id из NOTIFY: реплика могла ещё не доиграть строку
+                if self.primary is None:
+                    continue
+                if db.bind is not self.primary.kw["bind"]:
+                    async with self.primary() as primary_db:
+                        cookie = await _load(primary_db, cookie_id)
+                    if cookie is not None:
+                        return cookie
+            self.discard(cookie_id)
+        return None
+
+
+async def _load(db: AsyncSession, cookie_id: int) -> Cookie | None:
+    return await db.scalar(
+        select(Cookie).where(Cookie.id == cookie_id, in_current_epoch())
+    )
+
+
+async def pick_where(
+    db: AsyncSession, after_captcha: bool | None, *conditions
+) -> Cookie | None:
+    """
+    Случайная кука с дополнительными условиями (возраст, прокси), без индекса
+    в памяти. Все подходящие строки выпадают с равной вероятностью.
+
+    Подходящих меньше PICK_COUNT_LIMIT - они пересчитываются, и берётся k-я
+    по индексу ((after_captcha | proxy_id), timestamp): проход не длиннее
+    предела. Больше - случайные id между самой старой и самой свежей
+    подходящей строкой (id растут вместе с timestamp) проверяются пачкой по
+    первичному ключу, ответ - первая точка, попавшая в подходящую строку.
+    Случайный момент времени вместо id не годится: строка после долгой
+    паузы в сборе выпадала бы чаще остальных. Если подходящие строки редки
+    среди id (один прокси из многих) и ни одна точка не попала - полный
+    счёт и OFFSET.
+    """
+    conditions = [in_current_epoch(), *conditions]
+    if after_captcha is not None:
+        conditions.append(Cookie.after_captcha == after_captcha)
+
+    limited = select(Cookie.id).where(*conditions).limit(PICK_COUNT_LIMIT)
+    count = await db.scalar(select(func.count()).select_from(limited.subquery()))
+    if not count:
+        return None
+    if count == PICK_COUNT_LIMIT:
+        cookie = await _pick_by_id(db, conditions)
+        if cookie is not None:
+            return cookie
+        count = await db.scalar(select(func.count(Cookie.id)).where(*conditions))
+        if not count:
+            return None
+
+    ordered = select(Cookie).where(*conditions).order_by(Cookie.timestamp, Cookie.id)
+    cookie = await db.scalar(ordered.offset(random.randrange(count)).limit(1))
+    if cookie is None:
+        # Строки между запросами успел удалить чистильщик - берём самую старую
+        cookie = await db.scalar(ordered.limit(1))
+    return cookie
+
+
+async def _pick_by_id(db: AsyncSession, conditions: list) -> Cookie | None:
+    # Края через ORDER BY ... LIMIT 1: MIN/MAX с условиями SQLite считает
+    # проходом по всему диапазону, а так это два спуска по индексу
+    edge = select(Cookie.id).where(*conditions).limit(1)
+    oldest, newest = (
+        await db.execute(
+            select(
+                edge.order_by(Cookie.timestamp).scalar_subquery(),
+                edge.order_by(Cookie.timestamp.desc()).scalar_subquery(),
+            )
+        )
+    ).one()
+    if oldest is None:
+        return None
+    low, high = min(oldest, newest), max(oldest, newest)
+    # Условия - в списке выборки, а не в WHERE: иначе SQLite идёт диапазоном
+    # индекса (after_captcha, timestamp) вместо PICK_POINTS поисков по ключу
+    matches = and_(*conditions).label("matches")
+    for _ in range(PICK_ROUNDS):
+        points = [random.randint(low, high) for _ in range(PICK_POINTS)]
+        rows = await db.execute(select(Cookie.id, matches).where(Cookie.id.in_(points)))
+        found = {cookie_id for cookie_id, ok in rows if ok}
+        for point in points:
+            if point in found:
+                cookie = await db.scalar(select(Cookie).where(Cookie.id == point))
+                if cookie is not None:
+                    return cookie
+    return None
@@ -0,0 +1,372 @@
+"""
+Снимок пула в memory-mapped файле для нескольких воркеров uvicorn.
+
+Включается через SNAPSHOT_PATH. Один воркер (кто первым взял flock на
+SNAPSHOT_PATH.lock) раз в SNAPSHOT_REFRESH_SECONDS и при каждой новой
+куке перечитывает пул из БД и записывает снимок во временный файл, затем
+атомарно подменяет его через os.replace. Остальные воркеры только читают
+через mmap и замечают подмену по inode файла. Сравнение эпох и подмена
+идут под flock на SNAPSHOT_PATH.swap.lock: пустой снимок новой эпохи
+(инвалидация из любого воркера) не перетирается снимком старой. Тела
+кук не меняются, поэтому при пересборке распаковываются только новые
+строки, остальные тела копируются из прошлого снимка.
+
+Формат файла:
+    заголовок  HEADER: magic, эпоха пула, время сборки, число строк
+               без капчи и после капчи
+    записи     RECORD на строку: id, timestamp, смещение и длина тела;
+               сначала after_captcha=False, затем True, внутри класса -
+               по timestamp, поэтому диапазон класса и бинарный поиск
+               по max_age не требуют индексов
+    тела       готовые тела ответов (Cookie.response_body) подряд
+"""
+
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+from models import (
+    Cookie,
+    CookieBody,
+    PoolState,
+    Proxy,
+    build_response_body,
+    in_current_epoch,
+)
+from sqlalchemy import Engine, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: main.py снимок не включает
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CKSNAP01"
+HEADER = struct.Struct("<8sqdqq")
+RECORD = struct.Struct("<qdqq")
+TIMESTAMP = struct.Struct("<d")
+TIMESTAMP_OFFSET = 8  # timestamp внутри RECORD, после id
+
+
+def _unix(timestamp: datetime) -> float:
+    # В БД наивное UTC-время
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _datetime(seconds: float) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+# Строки снимка: только нужные столбцы, без ORM-объектов
+INDEX_COLUMNS = (Cookie.id, Cookie.timestamp, Cookie.after_captcha)
+BODY_COLUMNS = (Cookie.id, Proxy.url, Cookie.payload_dict_id, Cookie.payload)
+# Столько id в одном IN при дочитывании тел новых строк
+BODY_CHUNK = 500
+
+
+def write_snapshot(
+    path: str,
+    epoch: int,
+    rows: list[tuple],
+    body: Callable[[int], bytes | None],
+) -> None:
+    """
+    Записывает снимок из строк INDEX_COLUMNS (тело строки - body(id), None -
+    строку пропускаем) и атомарно подменяет им файл path, если там не
+    снимок более новой эпохи.
+    """
+    by_class = {False: [], True: []}
+    for row in rows:
+        by_class[row[2]].append(row)
+
+    records = bytearray()
+    bodies = bytearray()
+    counts = {False: 0, True: 0}
+    for after_captcha in (False, True):
+        by_class[after_captcha].sort(key=lambda row: (row[1], row[0]))
+        for cookie_id, timestamp, _ in by_class[after_captcha]:
+            cookie_body = body(cookie_id)
+            if cookie_body is None:
+                continue
+            records += RECORD.pack(
+                cookie_id, _unix(timestamp), len(bodies), len(cookie_body)
+            )
+            bodies += cookie_body
+            counts[after_captcha] += 1
+
+    header = HEADER.pack(MAGIC, epoch, time.time(), counts[False], counts[True])
+    # Своё имя на каждую запись: инвалидация и обновление могут писать разом
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(records)
+            f.write(bodies)
+        with open(f"{path}.swap.lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if _file_epoch(path) > epoch:
+                # Пока собирали, пул инвалидировали - не возвращаем старые куки
+                os.unlink(tmp_path)
+                return
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def read_pool(
+    engine: Engine, known: dict[int, tuple[int, int]]
+) -> tuple[int, list[tuple], dict[int, bytes]]:
+    """
+    Эпоха, строки INDEX_COLUMNS и тела строк, которых нет в known (синхронно,
+    в потоке обновлятеля). Тела не меняются, поэтому распаковываем только
+    новые куки, остальные берём из прошлого снимка.
+    """
+    bodies_query = select(*BODY_COLUMNS).outerjoin(Proxy, Cookie.proxy_id == Proxy.id)
+    bodies = {}
+    with engine.connect() as conn:
+        # Эпоха читается до строк: если пул инвалидируют между запросами,
+        # снимок получит старую эпоху и не перезапишет пустой снимок новой
+        epoch = conn.scalar(select(PoolState.epoch).where(PoolState.id == 1))
+        rows = conn.execute(select(*INDEX_COLUMNS).where(in_current_epoch())).all()
+        missing = [row[0] for row in rows if row[0] not in known]
+        if not known:
+            chunks = [bodies_query.where(in_current_epoch())]
+        else:
+            chunks = [
+                bodies_query.where(Cookie.id.in_(missing[i : i + BODY_CHUNK]))
+                for i in range(0, len(missing), BODY_CHUNK)
+            ]
+        for query in chunks:
+            for cookie_id, proxy, dict_id, payload in conn.execute(query):
+                bodies[cookie_id] = build_response_body(
+                    cookie_id, proxy, dict_id, payload
+                )
+    return epoch or 0, rows, bodies
+
+
+def _file_epoch(path: str) -> int:
+    try:
+        with open(path, "rb") as f:
+            magic, epoch, *_ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return -1
+    return epoch if magic == MAGIC else -1
+
+
+class Snapshot:
+    """Открытый через mmap снимок; методы не обращаются к БД."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.epoch, self.built_at, without_captcha, with_captcha = (
+            HEADER.unpack_from(self._mm)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не снимок пула")
+        total = without_captcha + with_captcha
+        self._ranges = {
+            False: (0, without_captcha),
+            True: (without_captcha, total),
+            None: (0, total),
+        }
+        self._bodies_start = HEADER.size + total * RECORD.size
+
+    def _timestamp(self, index: int) -> float:
+        offset = HEADER.size + index * RECORD.size + TIMESTAMP_OFFSET
+        return TIMESTAMP.unpack_from(self._mm, offset)[0]
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def body_spans(self) -> dict[int, tuple[int, int]]:
+        """id -> (начало, конец) тела в файле, для переиспользования тел."""
+        records = self._mm[HEADER.size : self._bodies_start]
+        return {
+            cookie_id: (
+                self._bodies_start + offset,
+                self._bodies_start + offset + length,
+            )
+            for cookie_id, _, offset, length in RECORD.iter_unpack(records)
+        }
+
+    def body_at(self, start: int, end: int) -> bytes:
+        return self._mm[start:end]
+
+    def _record(self, index: int) -> CookieBody:
+        cookie_id, timestamp, offset, length = RECORD.unpack_from(
+            self._mm, HEADER.size + index * RECORD.size
+        )
+        start = self._bodies_start + offset
+        body = self._mm[start : start + length]
+        return CookieBody(cookie_id, _datetime(timestamp), body)
+
+    def _classes(self, after_captcha: bool | None) -> list[tuple[int, int]]:
+        if after_captcha is None:
+            return [self._ranges[False], self._ranges[True]]
+        return [self._ranges[after_captcha]]
+
+    def _fresh(self, after_captcha: bool | None, since: datetime | None):
+        """Диапазоны индексов записей класса не старше since."""
+        ranges = []
+        for start, end in self._classes(after_captcha):
+            if since is not None:
+                # Бинарный поиск прямо по записям в mmap, без копии в список
+                start = bisect.bisect_left(
+                    range(end), _unix(since), start, end, key=self._timestamp
+                )
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+
+    def latest(
+        self, after_captcha: bool | None, since: datetime | None = None
+    ) -> CookieBody | None:
+        candidates = [end - 1 for _, end in self._fresh(after_captcha, since)]
+        if not candidates:
+            return None
+        return self._record(max(candidates, key=self._timestamp))
+
+    def random(
+        self, after_captcha: bool | None, since: datetime | None = None
+    ) -> bytes | None:
+        ranges = self._fresh(after_captcha, since)
+        total = sum(end - start for start, end in ranges)
+        if not total:
+            return None
+        index = random.randrange(total)
+        for start, end in ranges:
+            if index < end - start:
+                return self._record(start + index).body
+            index -= end - start
+
+
+class SnapshotReader:
+    """Текущий снимок для воркера; переоткрывает файл после подмены."""
+
+    def __init__(self, path: str, max_age: float):
+        self.path = path
+        self.max_age = max_age
+        self._snapshot: Snapshot | None = None
+
+    def current(self) -> Snapshot | None:
+        """Свежий снимок или None, если его нет или обновлятель отстал."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        if self._snapshot is None or self._snapshot.inode != inode:
+            try:
+                snapshot = Snapshot(self.path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Не удалось открыть снимок пула: {e}")
+                return None
+            if self._snapshot:
+                self._snapshot.close()
+            self._snapshot = snapshot
+        if time.time() - self._snapshot.built_at > self.max_age:
+            return None
+        return self._snapshot
+
+
+class SnapshotRefresher:
+    """Пересобирает снимок, пока этот воркер держит flock обновлятеля."""
+
+    def __init__(self, path: str, engine: Callable[[], Engine], refresh_seconds: float):
+        self.path = path
+        # Синхронный движок для чтения пула (ReplicaRouter.sync_engine): запрос
+        # и сборка снимка идут в потоке, а не в event loop воркера
+        self.engine = engine
+        self.refresh_seconds = refresh_seconds
+        self._wakeup = asyncio.Event()
+        self._lock_file = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._lock_file:
+            self._lock_file.close()
+
+    def poke(self, *_) -> None:
+        """Колбэк on_insert: пересобрать снимок, не дожидаясь интервала."""
+        self._wakeup.set()
+
+    def invalidate(self, epoch: int) -> None:
+        """Пул инвалидирован: сразу пустой снимок новой эпохи из любого воркера."""
+        write_snapshot(self.path, epoch, [], {}.get)
+        self._wakeup.set()
+
+    def _try_lock(self) -> bool:
+        if self._lock_file:
+            return True
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"Воркер pid={os.getpid()} обновляет снимок пула {self.path}")
+        return True
+
+    def _previous(self) -> Snapshot | None:
+        try:
+            return Snapshot(self.path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _rebuild(self) -> None:
+        previous = self._previous()
+        known = previous.body_spans() if previous else {}
+        try:
+            epoch, rows, bodies = read_pool(self.engine(), known)
+
+            def body(cookie_id: int) -> bytes | None:
+                if cookie_id in bodies:
+                    return bodies[cookie_id]
+                span = known.get(cookie_id)
+                # Нет ни там, ни там - строку удалили между запросами
+                return previous.body_at(*span) if span else None
+
+            write_snapshot(self.path, epoch, rows, body)
+        finally:
+            if previous:
+                previous.close()
+
+    async def refresh(self) -> None:
+        await asyncio.to_thread(self._rebuild)
+
+    async def _run(self) -> None:
+        while True:
+            if self._try_lock():
+                try:
+                    await self.refresh()
+                except Exception:
+                    logger.exception("Не удалось обновить снимок пула")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refresh_seconds)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
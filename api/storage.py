@@ -0,0 +1,118 @@
+"""
+Бэкенды хранилища пула: PostgreSQL или встроенный SQLite на одном узле.
+
+API, коллектор и чистильщик создают движки только через storage_for(DB_URL);
+бэкенд выбирается по схеме URL. Схема, запросы и ORM общие (SQLAlchemy),
+здесь собрано то, чем бэкенды различаются: настройка соединений и
+возможности, которые есть только в PostgreSQL.
+
+SQLite работает в режиме WAL: читатели не блокируют писателя, писатели
+(коллектор, чистильщик, остановка из API) ждут друг друга до
+SQLITE_BUSY_TIMEOUT_MS. Относительный путь к файлу считается от корня
+проекта, чтобы все компоненты открыли один и тот же файл.
+"""
+
+from pathlib import Path
+
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+class Storage:
+    # LISTEN/NOTIFY: push новых куки в API (/stream/cookies, сброс кешей)
+    supports_notify = False
+    # Секционирование по времени (RETENTION_MODE=partition)
+    supports_partitions = False
+    # Реплики для чтения (DB_REPLICA_URLS) с проверкой отставания
+    supports_replicas = False
+
+    def __init__(self, url: str, async_url: str):
+        self.url = url
+        self.async_url = async_url
+
+    def create_engine(self, **kwargs) -> Engine:
+        engine = create_engine(self.url, **kwargs)
+        self._configure(engine)
+        return engine
+
+    def create_async_engine(self, **kwargs) -> AsyncEngine:
+        engine = create_async_engine(self.async_url, **kwargs)
+        self._configure(engine.sync_engine)
+        return engine
+
+    def _configure(self, engine: Engine) -> None:
+        pass
+
+
+class PostgresStorage(Storage):
+    supports_notify = True
+    supports_partitions = True
+    supports_replicas = True
+
+    # Отставание реплики, секунд. Всё полученное проиграно - реплика догнала
+    # primary, даже если записей давно не было; NULL - ещё ничего не проиграно
+    replica_lag_sql = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """
+
+    @property
+    def listen_dsn(self) -> str:
+        """DSN для отдельного соединения asyncpg под LISTEN."""
+        return (
+            make_url(self.async_url)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, url: str, async_url: str):
+        super().__init__(_absolute(url), _absolute(async_url))
+
+    def _configure(self, engine: Engine) -> None:
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.close()
+
+
+def _absolute(url: str) -> str:
+    parsed = make_url(url)
+    database = parsed.database
+    if not database or database == ":memory:" or Path(database).is_absolute():
+        return url
+    path = PROJECT_ROOT / database
+    return parsed.set(database=str(path)).render_as_string(hide_password=False)
+
+
+def _async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    driver = {
+        "postgresql": "postgresql+asyncpg",
+        "postgresql+psycopg2": "postgresql+asyncpg",
+        "sqlite": "sqlite+aiosqlite",
+    }.get(scheme, scheme)
+    return f"{driver}://{rest}"
+
+
+def storage_for(url: str, async_url: str | None = None) -> Storage:
+    """Бэкенд по DB_URL; async_url по умолчанию - тот же адрес с async-драйвером."""
+    async_url = async_url or _async_url(url)
+    backend = make_url(url).get_backend_name()
+    if backend == "postgresql":
+        return PostgresStorage(url, async_url)
+    if backend == "sqlite":
+        return SQLiteStorage(url, async_url)
+    raise ValueError(f"Неподдерживаемая БД в DB_URL: {backend}")
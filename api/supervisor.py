@@ -0,0 +1,418 @@
+"""
+Супервизор фоновых воркеров API: сборщика и чистильщика куки.
+
+Воркер - async-функция модуля своего компонента (run_collector.main,
+cookie_cleaner.main.main). Процессы запускаются из форк-сервера
+multiprocessing, который один раз импортирует тяжёлые зависимости
+(SQLAlchemy, драйверы БД, Playwright), поэтому старт и перезапуск не
+платят за новый интерпретатор и `uv run`. В Windows форк-сервера нет,
+там процесс запускается spawn.
+
+Живость проверяется по пульсу: event loop воркера раз в секунду пишет
+время в общую память. Процесс, который завис (жив, но loop не крутится
+дольше heartbeat_timeout), убивается; упавший или убитый перезапускается
+с экспоненциальной задержкой. Остановка - SIGTERM, воркер дописывает
+очередь и выходит; кто не уложился в drain_seconds, получает SIGKILL.
+
+Воркер с in_process=True - задача в event loop самого API (чистильщик при
+CLEANER_IN_PROCESS=1): отдельный процесс ему не нужен.
+
+При нескольких воркерах uvicorn воркерами управляет один - лидер, взявший
+flock на {control_path}.lock. Остальные передают ему команды через
+unix-сокет control_path; если лидер умер, лидером становится следующий,
+кто получил команду. Модуль импортируется в процессе воркера до его
+собственных модулей, поэтому не импортирует ничего из API.
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: каждый воркер uvicorn сам себе лидер
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+API_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = API_DIR.parent
+
+# Что форк-сервер импортирует заранее; отсутствующие модули пропускаются
+PRELOAD = [
+    "sqlalchemy",
+    "sqlalchemy.orm",
+    "sqlalchemy.ext.asyncio",
+    "psycopg2",
+    "asyncpg",
+    "redis",
+    "dotenv",
+    "playwright.async_api",
+]
+HEARTBEAT_SECONDS = 1.0
+MONITOR_SECONDS = 1.0
+BACKOFF_MIN_SECONDS = 1.0
+# Столько проработал без падений - задержка перезапуска снова минимальная
+STABLE_SECONDS = 60.0
+
+
+@dataclass(frozen=True)
+class WorkerSpec:
+    """Воркер: async-функция function модуля module, рабочий каталог cwd."""
+
+    name: str
+    module: str
+    function: str
+    cwd: Path
+    in_process: bool = False
+
+
+# ====== Процесс воркера ======
+
+
+async def _with_heartbeat(target, heartbeat) -> None:
+    main = asyncio.current_task()
+    parent = os.getppid()
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            # Родитель умер (API упал без остановки воркеров) - не остаёмся сиротой
+            if os.getppid() != parent:
+                logger.error("Процесс API завершился, останавливаемся")
+                main.cancel()
+                return
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    beat_task = asyncio.create_task(beat())
+    try:
+        await target()
+    finally:
+        beat_task.cancel()
+
+
+def _bootstrap(cwd: str, module: str, function: str, heartbeat) -> None:
+    """Точка входа процесса-воркера: окружение как при запуске его скрипта."""
+    # Модули API не должны заслонять одноимённые модули компонента (config)
+    sys.path[:] = [p for p in sys.path if Path(p or ".").resolve() != API_DIR]
+    os.chdir(cwd)
+    sys.path[:0] = [cwd, str(PROJECT_ROOT)]
+    target = getattr(importlib.import_module(module), function)
+    try:
+        asyncio.run(_with_heartbeat(target, heartbeat))
+    except KeyboardInterrupt:
+        pass
+
+
+# ====== Супервизор ======
+
+
+def _iso(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class Worker:
+    """Состояние одного воркера под надзором."""
+
+    def __init__(self, spec: WorkerSpec):
+        self.spec = spec
+        self.wanted = False  # должен работать: после падения - перезапуск
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.task: asyncio.Task | None = None
+        self.heartbeat = None
+        self.started_at: float | None = None
+        self.restarts = 0
+        self.backoff = BACKOFF_MIN_SECONDS
+        self.restart_at: float | None = None  # time.monotonic()
+        self.exit_code: int | None = None
+
+    def alive(self) -> bool:
+        if self.task is not None:
+            return not self.task.done()
+        return self.process is not None and self.process.is_alive()
+
+    def heartbeat_age(self) -> float | None:
+        if self.heartbeat is None or not self.alive():
+            return None
+        # До первого пульса (импорт модулей воркера) отсчёт от старта
+        return time.time() - (self.heartbeat.value or self.started_at)
+
+    def status(self) -> dict:
+        alive = self.alive()
+        if alive:
+            state = "running"
+        elif self.wanted:
+            state = "restarting"
+        else:
+            state = "stopped"
+        age = self.heartbeat_age()
+        return {
+            "name": self.spec.name,
+            "state": state,
+            "in_process": self.spec.in_process,
+            "pid": self.process.pid if alive and self.process else None,
+            "started_at": _iso(self.started_at) if alive else None,
+            "uptime_seconds": (
+                round(time.time() - self.started_at, 1) if alive else None
+            ),
+            "heartbeat_age_seconds": round(age, 1) if age is not None else None,
+            "restarts": self.restarts,
+            "last_exit_code": self.exit_code,
+        }
+
+
+class Supervisor:
+    def __init__(
+        self,
+        specs: list[WorkerSpec],
+        heartbeat_timeout: float,
+        drain_seconds: float,
+        backoff_max: float,
+        control_path: str | None = None,
+    ):
+        self.workers = {spec.name: Worker(spec) for spec in specs}
+        self.heartbeat_timeout = heartbeat_timeout
+        self.drain_seconds = drain_seconds
+        self.backoff_max = backoff_max
+        self.control_path = control_path if fcntl else None
+        self._lock = asyncio.Lock()  # команды и проверки не пересекаются
+        self._lock_file = None
+        self._monitor_task: asyncio.Task | None = None
+        self._server: asyncio.Server | None = None
+
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(PRELOAD)
+        else:
+            self._context = multiprocessing.get_context("spawn")
+
+    @property
+    def leader(self) -> bool:
+        return self._monitor_task is not None
+
+    async def open(self) -> None:
+        await self._try_lead()
+
+    async def close(self) -> None:
+        if self._server:
+            self._server.close()
+        if self._monitor_task:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            async with self._lock:
+                for worker in self.workers.values():
+                    worker.wanted = False
+                    await self._terminate(worker)
+        if self._lock_file:
+            self._lock_file.close()
+
+    # ----- команды (локально у лидера или через его сокет) -----
+
+    async def start(self, name: str) -> dict | None:
+        """Запускает воркер; None - он уже работает."""
+        if not await self._try_lead():
+            return await self._call("start", name)
+        worker = self.workers[name]
+        async with self._lock:
+            if worker.wanted:
+                return None
+            worker.restarts = 0
+            worker.backoff = BACKOFF_MIN_SECONDS
+            worker.restart_at = None
+            # wanted - только после удачного запуска: иначе следующий start
+            # получил бы "уже запущен", а надзор перезапускал бы то, что не стартует
+            self._spawn(worker)
+            worker.wanted = True
+            return worker.status()
+
+    async def stop(self, name: str) -> bool:
+        """Останавливает воркер с дозаписью; True - было что останавливать."""
+        if not await self._try_lead():
+            return await self._call("stop", name)
+        worker = self.workers[name]
+        async with self._lock:
+            running = worker.wanted or worker.alive()
+            worker.wanted = False
+            await self._terminate(worker)
+            return running
+
+    async def status(self) -> dict:
+        if not await self._try_lead():
+            return await self._call("status")
+        return {
+            "leader_pid": os.getpid(),
+            "workers": [worker.status() for worker in self.workers.values()],
+        }
+
+    # ----- процессы -----
+
+    def _spawn(self, worker: Worker) -> None:
+        spec = worker.spec
+        worker.started_at = time.time()
+        worker.exit_code = None
+        if spec.in_process:
+            if str(PROJECT_ROOT) not in sys.path:
+                sys.path.append(str(PROJECT_ROOT))  # пакет компонента, не модули API
+            target = getattr(importlib.import_module(spec.module), spec.function)
+            worker.task = asyncio.create_task(target(), name=spec.name)
+            logger.info(f"Воркер {spec.name} запущен задачей в процессе API")
+            return
+        worker.heartbeat = self._context.Value("d", 0.0, lock=False)
+        process = self._context.Process(
+            target=_bootstrap,
+            args=(str(spec.cwd), spec.module, spec.function, worker.heartbeat),
+            name=spec.name,
+        )
+        process.start()
+        worker.process = process
+        logger.info(f"Воркер {spec.name} запущен, pid={worker.process.pid}")
+
+    def _reap(self, worker: Worker) -> None:
+        """Забирает итог завершившегося воркера."""
+        if worker.task is not None:
+            if not worker.task.cancelled() and worker.task.exception():
+                logger.error(
+                    f"Воркер {worker.spec.name} упал",
+                    exc_info=worker.task.exception(),
+                )
+                worker.exit_code = 1
+            else:
+                worker.exit_code = 0
+            worker.task = None
+        elif worker.process is not None:
+            worker.exit_code = worker.process.exitcode
+            worker.process.close()
+            worker.process = None
+            worker.heartbeat = None
+
+    async def _terminate(self, worker: Worker) -> None:
+        name = worker.spec.name
+        if worker.task is not None:
+            worker.task.cancel()
+            done, _ = await asyncio.wait({worker.task}, timeout=self.drain_seconds)
+            if not done:
+                logger.warning(
+                    f"Воркер {name} не остановился за {self.drain_seconds} с"
+                )
+                return
+        elif worker.process is not None and worker.process.is_alive():
+            # SIGTERM: воркер дописывает очередь и выходит сам (в Windows - сразу)
+            worker.process.terminate()
+            await asyncio.to_thread(worker.process.join, self.drain_seconds)
+            if worker.process.is_alive():
+                logger.warning(
+                    f"Воркер {name} не остановился за {self.drain_seconds} с, SIGKILL"
+                )
+                worker.process.kill()
+                await asyncio.to_thread(worker.process.join)
+        if worker.task is not None or worker.process is not None:
+            self._reap(worker)
+            logger.info(f"Воркер {name} остановлен, код {worker.exit_code}")
+
+    def _check(self, worker: Worker) -> None:
+        name = worker.spec.name
+        if worker.alive():
+            if time.time() - worker.started_at > STABLE_SECONDS:
+                worker.backoff = BACKOFF_MIN_SECONDS
+            age = worker.heartbeat_age()
+            if age is not None and age > self.heartbeat_timeout:
+                # Завис: процесс есть, а event loop стоит. Перезапуск - на
+                # следующей проверке, как у упавшего
+                logger.error(f"Воркер {name} без пульса {age:.0f} с, SIGKILL")
+                worker.process.kill()
+            return
+
+        if worker.restart_at is None:
+            self._reap(worker)
+            worker.restart_at = time.monotonic() + worker.backoff
+            logger.error(
+                f"Воркер {name} завершился с кодом {worker.exit_code}, "
+                f"перезапуск через {worker.backoff:.0f} с"
+            )
+            worker.backoff = min(worker.backoff * 2, self.backoff_max)
+        elif time.monotonic() >= worker.restart_at:
+            worker.restart_at = None
+            worker.restarts += 1
+            self._spawn(worker)
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(MONITOR_SECONDS)
+            async with self._lock:
+                for worker in self.workers.values():
+                    if worker.wanted:
+                        try:
+                            self._check(worker)
+                        except Exception:
+                            logger.exception(f"Ошибка надзора за {worker.spec.name}")
+
+    # ----- лидер и сокет управления -----
+
+    async def _try_lead(self) -> bool:
+        if self.leader:
+            return True
+        if self.control_path:
+            lock_file = open(f"{self.control_path}.lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.control_path
+            )
+            logger.info(f"Воркер pid={os.getpid()} управляет сборщиком и чистильщиком")
+        self._monitor_task = asyncio.create_task(self._monitor())
+        return True
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = json.loads(await reader.readline())
+            try:
+                if request["op"] == "status":
+                    response = {"result": await self.status()}
+                else:
+                    name = request["name"]
+                    response = {"result": await getattr(self, request["op"])(name)}
+            except Exception as e:
+                # Например, воркер не запустился - ошибку увидит вызвавший
+                logger.exception("Ошибка команды управления воркерами")
+                response = {"error": str(e)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except Exception:
+            logger.exception("Ошибка команды управления воркерами")
+        finally:
+            writer.close()
+
+    async def _call(self, op: str, name: str | None = None):
+        reader, writer = await asyncio.open_unix_connection(self.control_path)
+        try:
+            writer.write(json.dumps({"op": op, "name": name}).encode() + b"\n")
+            await writer.drain()
+            # Остановка ждёт дозаписи воркера
+            line = await asyncio.wait_for(reader.readline(), self.drain_seconds + 10)
+        finally:
+            writer.close()
+        if not line:
+            raise ConnectionError("Лидер не ответил на команду")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
@@ -0,0 +1,84 @@
+"""
+Разбивка времени запроса по фазам для заголовка Server-Timing.
+
+Middleware в main.py (SERVER_TIMING=1, запросы с ключом админа) заводит на
+запрос RequestTimings в contextvar, а места, где тратится время, добавляют
+в него свои фазы:
+
+    checkout  ожидание соединения из пула (database.CheckoutTimedPool)
+    db        выполнение SQL драйвером (события курсора движка)
+    orm       ORM-запрос без db и checkout: построение объектов из строк
+    decode    распаковка payload и сборка тела (models.build_response_body)
+    app       остальное: код эндпоинта, снимок, кодирование ответа
+
+Вне запроса (коллектор, чистильщик, фоновые задачи) record ничего не делает.
+"""
+
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import ORMExecuteState, Session
+
+PHASES = ("checkout", "db", "orm", "decode")
+
+_current: ContextVar["RequestTimings | None"] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def header(self) -> str:
+        total = time.perf_counter() - self.started
+        phases = dict(self.phases)
+        phases["app"] = max(total - sum(phases.values()), 0.0)
+        phases["total"] = total
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()
+        )
+
+
+def start() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def record(phase: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.phases[phase] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    context._timing_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    record("db", time.perf_counter() - context._timing_started)
+
+
+def install(*engines: Engine) -> None:
+    """Подписывает движки (sync_engine асинхронных) и ORM-сессии на замеры."""
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    @event.listens_for(Session, "do_orm_execute")
+    def do_orm_execute(state: ORMExecuteState):
+        timings = _current.get()
+        if timings is None:
+            return None
+        # Вложенные ORM-запросы (подгрузка связей) уже учли своё время
+        before = sum(timings.phases[p] for p in ("checkout", "db", "orm"))
+        started = time.perf_counter()
+        # Выполняем сами, чтобы замерить запрос вместе с построением объектов
+        result = state.invoke_statement()
+        elapsed = time.perf_counter() - started
+        inner = sum(timings.phases[p] for p in ("checkout", "db", "orm")) - before
+        timings.phases["orm"] += max(elapsed - inner, 0.0)
+        return result
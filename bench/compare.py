@@ -0,0 +1,81 @@
+"""
+Сравнение результата bench/run.py с сохранённым базовым.
+
+Замеры сопоставляются по (rows, endpoint, concurrency). Регрессия -
+пропускная способность упала или p99 выросла больше чем на threshold
+(доля, по умолчанию 10%); код выхода 1, если есть хоть одна.
+
+    python bench/compare.py bench/results/baseline.json bench/results/current.json
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def _key(result: dict) -> tuple:
+    return result["rows"], result["endpoint"], result["concurrency"]
+
+
+def _change(old: float | None, new: float | None) -> float | None:
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def _percent(change: float | None) -> str:
+    return "—" if change is None else f"{change:+.1%}"
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Печатает таблицу сравнения и возвращает регрессии."""
+    old_results = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(
+        f"{'rows':>8} {'c':>4}  {'endpoint':<45} {'rps':>10} {'Δrps':>8}"
+        f" {'p99 ms':>9} {'Δp99':>8}"
+    )
+    for result in current["results"]:
+        old = old_results.get(_key(result))
+        if old is None:
+            rps_change = p99_change = None
+        else:
+            rps_change = _change(old["rps"], result["rps"])
+            p99_change = _change(old["p99_ms"], result["p99_ms"])
+        regressed = (rps_change is not None and rps_change < -threshold) or (
+            p99_change is not None and p99_change > threshold
+        )
+        if regressed:
+            regressions.append(result)
+        print(
+            f"{result['rows']:>8} {result['concurrency']:>4}  {result['endpoint']:<45}"
+            f" {result['rps']:>10} {_percent(rps_change):>8}"
+            f" {result['p99_ms'] or 0:>9} {_percent(p99_change):>8}"
+            + ("  РЕГРЕССИЯ" if regressed else "")
+        )
+    if baseline.get("meta", {}).get("commit"):
+        print(f"\nБаза: {baseline['meta']['commit']}, сейчас: {current['meta'].get('commit')}")
+    print(f"Регрессий (порог {threshold:.0%}): {len(regressions)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    regressions = compare(
+        json.loads(args.baseline.read_text()),
+        json.loads(args.current.read_text()),
+        args.threshold,
+    )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Бенчмарк эндпоинтов чтения API на синтетических пулах.
+
+Для каждого размера пула заливает БД (seed.py), поднимает API через
+uvicorn отдельным процессом и гоняет каждый эндпоинт при каждом уровне
+конкурентности: N соединений keep-alive, каждое шлёт следующий запрос
+сразу после ответа на предыдущий (замкнутый цикл), сначала прогрев, потом
+замер duration секунд. Результат - JSON (пропускная способность и
+p50/p99/p999 задержки), который можно сравнить с сохранённым через
+compare.py или сразу через --baseline.
+
+    python bench/run.py --sizes 1000 100000 1000000 --output bench/results/current.json
+    python bench/run.py --baseline bench/results/baseline.json
+
+Без --db-url каждый размер живёт в своём SQLite-файле в bench/.data.
+С --db-url (например, PostgreSQL) таблица cookies этой БД ПЕРЕЗАПИСЫВАЕТСЯ.
+Остальные настройки API (API_WORKERS, SNAPSHOT_PATH, REDIS_URL, ...)
+берутся из окружения и .env как обычно и записываются в meta результата.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compare
+import seed as seeder
+from api.storage import storage_for
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger("bench")
+
+BENCH_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCH_DIR.parent
+DATA_DIR = BENCH_DIR / ".data"
+
+DEFAULT_ENDPOINTS = [
+    "/latest-cookie",
+    "/latest-cookie?after_captcha=true",
+    "/random-cookie",
+    "/random-cookie?after_captcha=false",
+    "/random-cookie?max_age=1800",
+    f"/random-cookie?proxy={quote(seeder.PROXIES[0], safe='')}",
+]
+# Настройки, от которых зависят цифры, - в meta результата
+RECORDED_ENV = [
+    "API_WORKERS",
+    "SNAPSHOT_PATH",
+    "REDIS_URL",
+    "LATEST_CACHE_TTL_SECONDS",
+    "DB_POOL_SIZE",
+    "SERVER_TIMING",
+]
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = dict(
+        line.lower().split(": ", 1) for line in header_lines if ": " in line
+    )
+    # Ответы чтения не потоковые: uvicorn всегда ставит content-length
+    body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split(" ", 2)[1]), body
+
+
+async def _connection(
+    port: int, path: str, deadline: float, latencies: list[float], counts: dict
+) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+            status, body = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                counts["errors"] += 1
+            elif b'"error"' in body[:16]:
+                counts["empty"] += 1  # {"error": "Нет подходящих куки"}
+    finally:
+        writer.close()
+
+
+async def drive(port: int, path: str, concurrency: int, duration: float) -> dict:
+    """Замер одного эндпоинта при заданной конкурентности."""
+    latencies: list[float] = []
+    counts = {"errors": 0, "empty": 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(
+        *(
+            _connection(port, path, deadline, latencies, counts)
+            for _ in range(concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        **counts,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "p999_ms": percentile(latencies, 0.999),
+    }
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = max(math.ceil(q * len(sorted_values)) - 1, 0)
+    return round(sorted_values[index] * 1000, 3)
+
+
+def start_api(db_url: str, port: int) -> subprocess.Popen:
+    workers = os.getenv("API_WORKERS", "1")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", workers, "--log-level", "warning"],
+        cwd=PROJECT_ROOT / "api",
+        env={**os.environ, "DB_URL": db_url},
+    )  # fmt: skip
+    # uvicorn открывает порт только после миграций и прогрева в lifespan
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API завершился с кодом {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API не поднялся за 60 с")
+
+
+def stop_api(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    results = []
+    for rows in args.sizes:
+        db_url = args.db_url or f"sqlite:///{DATA_DIR / f'pool-{rows}.db'}"
+        DATA_DIR.mkdir(exist_ok=True)
+        engine = storage_for(db_url).create_engine()
+        if args.reuse and seeder.existing_rows(engine) == rows:
+            logger.info(f"Пул {rows} уже залит, используем как есть")
+        else:
+            seeder.seed(engine, rows, args.seed)
+        engine.dispose()
+
+        api = start_api(db_url, args.port)
+        try:
+            for path in args.endpoints:
+                for concurrency in args.concurrency:
+                    asyncio.run(drive(args.port, path, concurrency, args.warmup))
+                    stats = asyncio.run(
+                        drive(args.port, path, concurrency, args.duration)
+                    )
+                    result = {
+                        "rows": rows,
+                        "endpoint": path,
+                        "concurrency": concurrency,
+                        **stats,
+                    }
+                    logger.info(json.dumps(result, ensure_ascii=False))
+                    results.append(result)
+        finally:
+            stop_api(api)
+
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "db": make_url(args.db_url).get_backend_name() if args.db_url else "sqlite",
+            "duration": args.duration,
+            "seed": args.seed,
+            "env": {name: os.getenv(name) for name in RECORDED_ENV if os.getenv(name)},
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--duration", type=float, default=10, help="Замер, секунд")
+    parser.add_argument("--warmup", type=float, default=2, help="Прогрев, секунд")
+    parser.add_argument("--db-url", help="Своя БД вместо SQLite в bench/.data (перезаписывается)")
+    parser.add_argument("--reuse", action="store_true", help="Не перезаливать пул того же размера")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", type=Path, help="Куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", type=Path, help="Сравнить с сохранённым результатом")
+    parser.add_argument("--threshold", type=float, default=compare.DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare.compare(baseline, report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
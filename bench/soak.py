@@ -0,0 +1,358 @@
+"""
+Длительный прогон под конкурентной нагрузкой: вставка, чтение и очистка.
+
+Одновременно работают отдельными процессами:
+    API        uvicorn, как в run.py
+    писатель   синтетические куки через CookieWriter.put - тот же путь
+               сохранения, что у run_collector.collector_task
+    чистильщик настоящий cookie_cleaner.cleanup_old_cookies раз в
+               --cleaner-interval секунд (в проде - раз в десятки минут)
+и генератор нагрузки на эндпоинты чтения в этом процессе.
+
+Раз в --window секунд снимается точка временного ряда: задержки чтений
+за окно (p50/p99/max), ожидания блокировок и раздувание таблицы из БД,
+счётчики писателя и чистильщика с их /metrics. Результат - JSON с рядом
+и сводкой; по нему сравнивают настройки хранения и индексов.
+
+    python bench/soak.py --duration 600 --write-rate 50 --max-age-minutes 2
+
+Без --db-url используется SQLite bench/.data/soak.db. С --db-url таблица
+cookies этой БД ПЕРЕЗАПИСЫВАЕТСЯ.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import run
+import seed as seeder
+from api.storage import storage_for
+from sqlalchemy import Engine, text
+
+logger = logging.getLogger("bench.soak")
+
+DEFAULT_ENDPOINTS = ["/latest-cookie", "/random-cookie", "/random-cookie?max_age=60"]
+
+
+# ------------------- Процессы писателя и чистильщика -------------------
+
+
+async def writer_main(args) -> None:
+    """Синтетический коллектор: --write-rate куки в секунду через CookieWriter."""
+    sys.path.insert(0, str(run.PROJECT_ROOT / "cookie_collector"))
+    from api.metrics import serve
+    from api.payloads import dictionaries
+    from sqlalchemy.orm import sessionmaker
+    from writer import CookieWriter
+
+    serve(args.metrics_port)
+    engine = storage_for(args.db_url).create_engine()
+    dictionaries.bind(engine)
+    session_factory = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+    writer = CookieWriter(session_factory)
+    writer.start()
+
+    rng = random.Random(args.seed)
+    interval = 1 / args.write_rate
+    next_at = time.monotonic()
+    try:
+        while True:
+            cookies = seeder.synthetic_cookies(rng)
+            await writer.put(cookies, rng.choice(seeder.PROXIES), rng.random() < 0.3)
+            next_at += interval
+            await asyncio.sleep(max(next_at - time.monotonic(), 0))
+    finally:
+        await writer.close()
+
+
+def cleaner_main(args) -> None:
+    """Настоящая задача чистильщика на коротком интервале."""
+    from api.metrics import serve
+    from cookie_cleaner import main as cleaner
+
+    serve(args.metrics_port)
+    while True:
+        started = time.monotonic()
+        cleaner.cleanup_old_cookies()
+        time.sleep(max(args.cleaner_interval - (time.monotonic() - started), 0))
+
+
+def _spawn(role: str, args, metrics_port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, __file__, role, "--db-url", args.db_url,
+         "--metrics-port", str(metrics_port), "--write-rate", str(args.write_rate),
+         "--cleaner-interval", str(args.cleaner_interval), "--seed", str(args.seed)],
+        env={**os.environ, "DB_URL": args.db_url, **env},
+    )  # fmt: skip
+
+
+# ------------------- Наблюдение -------------------
+
+
+def _scrape(port: int) -> dict[str, float]:
+    """Сумма сэмплов каждой метрики по всем меткам (без гистограммных корзин)."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+            body = r.read().decode()
+    except OSError:
+        return {}
+    totals: dict[str, float] = {}
+    for line in body.splitlines():
+        if not line or line.startswith("#") or "_bucket{" in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        name = name.split("{", 1)[0]
+        totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+def _db_stats(engine: Engine) -> dict:
+    """Размер пула, мёртвые строки/свободные страницы и ожидания блокировок."""
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            live, dead, size = conn.execute(
+                text(
+                    "SELECT coalesce(sum(n_live_tup), 0), coalesce(sum(n_dead_tup), 0),"
+                    " coalesce(sum(pg_total_relation_size(relid)), 0)"
+                    " FROM pg_stat_user_tables"
+                    " WHERE relname = 'cookies' OR relname LIKE 'cookies_p%'"
+                )
+            ).one()
+            waiting = conn.scalar(
+                text(
+                    "SELECT count(*) FROM pg_stat_activity"
+                    " WHERE wait_event_type = 'Lock' AND datname = current_database()"
+                )
+            )
+            return {
+                "rows": int(live),
+                "dead_rows": int(dead),
+                "table_bytes": int(size),
+                "lock_waiters": waiting,
+            }
+
+        # SQLite: блокировки не видны снаружи - их видно по времени
+        # сброса писателя и батча чистильщика; раздувание - свободные страницы
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        pages = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        rows = conn.exec_driver_sql("SELECT count(*) FROM cookies").scalar()
+    wal = Path(f"{engine.url.database}-wal")
+    return {
+        "rows": rows,
+        "free_bytes": free * page_size,
+        "table_bytes": pages * page_size,
+        "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+        "lock_waiters": None,
+    }
+
+
+def _delta_avg_ms(now: dict, before: dict, name: str) -> float | None:
+    count = now.get(f"{name}_count", 0) - before.get(f"{name}_count", 0)
+    if count <= 0:
+        return None
+    total = now.get(f"{name}_sum", 0) - before.get(f"{name}_sum", 0)
+    return round(total / count * 1000, 3)
+
+
+def _delta(now: dict, before: dict, name: str) -> float:
+    return now.get(name, 0) - before.get(name, 0)
+
+
+# ------------------- Нагрузка и временной ряд -------------------
+
+
+async def _reader(port: int, path: str, stop: asyncio.Event, samples: list) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"GET {path} HTTP/1.1\r\nHost: soak\r\n\r\n".encode()
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            writer.write(request)
+            status, _ = await run.read_response(reader)
+            samples.append((time.perf_counter() - started, status >= 400))
+    finally:
+        writer.close()
+
+
+async def _scrape_all(ports: dict) -> dict[str, dict]:
+    # В потоках: не задерживаем генератор нагрузки
+    scraped = await asyncio.gather(
+        *(asyncio.to_thread(_scrape, port) for port in ports.values())
+    )
+    return dict(zip(ports, scraped))
+
+
+async def soak(args, engine: Engine, ports: dict) -> list[dict]:
+    stop = asyncio.Event()
+    samples: list[tuple[float, bool]] = []
+    readers = [
+        asyncio.create_task(_reader(ports["api"], path, stop, samples))
+        for path in args.endpoints
+        for _ in range(args.concurrency)
+    ]
+
+    series = []
+    scraped = await _scrape_all(ports)
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        await asyncio.sleep(args.window)
+        window, samples[:] = samples[:], []
+        latencies = sorted(latency for latency, _ in window)
+        now = await _scrape_all(ports)
+        point = {
+            "t": round(time.monotonic() - started, 1),
+            "reads": len(window),
+            "read_errors": sum(1 for _, failed in window if failed),
+            "read_p50_ms": run.percentile(latencies, 0.50),
+            "read_p99_ms": run.percentile(latencies, 0.99),
+            "read_max_ms": run.percentile(latencies, 1.0),
+            **await asyncio.to_thread(_db_stats, engine),
+            "api_checkout_avg_ms": _delta_avg_ms(
+                now["api"], scraped["api"], "db_pool_checkout_seconds"
+            ),
+            "writer_rows": _delta(
+                now["writer"], scraped["writer"], "collector_rows_saved_total"
+            ),
+            "writer_flush_avg_ms": _delta_avg_ms(
+                now["writer"], scraped["writer"], "collector_flush_seconds"
+            ),
+            "writer_queue": now["writer"].get("collector_queue_depth"),
+            "cleaner_deleted": _delta(
+                now["cleaner"], scraped["cleaner"], "cleaner_rows_deleted_total"
+            ),
+            "cleaner_batch_avg_ms": _delta_avg_ms(
+                now["cleaner"], scraped["cleaner"], "cleaner_delete_batch_seconds"
+            ),
+        }
+        scraped = now
+        logger.info(json.dumps(point))
+        series.append(point)
+
+    stop.set()
+    await asyncio.gather(*readers, return_exceptions=True)
+    return series
+
+
+def _summary(series: list[dict]) -> dict:
+    p99 = [p["read_p99_ms"] for p in series if p["read_p99_ms"] is not None]
+    cleaning = [p for p in series if p["cleaner_deleted"]]
+    idle = [p for p in series if not p["cleaner_deleted"]]
+
+    def worst(points):
+        values = [p["read_p99_ms"] for p in points if p["read_p99_ms"] is not None]
+        return max(values) if values else None
+
+    return {
+        "reads": sum(p["reads"] for p in series),
+        "read_errors": sum(p["read_errors"] for p in series),
+        "read_p99_ms_median": sorted(p99)[len(p99) // 2] if p99 else None,
+        "read_p99_ms_worst": worst(series),
+        # Всплески во время очистки против окон без неё
+        "read_p99_ms_worst_while_cleaning": worst(cleaning),
+        "read_p99_ms_worst_idle": worst(idle),
+        "rows_written": sum(p["writer_rows"] for p in series),
+        "rows_deleted": sum(p["cleaner_deleted"] for p in series),
+        "table_bytes_end": series[-1]["table_bytes"] if series else None,
+    }
+
+
+def main_run(args) -> None:
+    args.db_url = args.db_url or f"sqlite:///{run.DATA_DIR / 'soak.db'}"
+    run.DATA_DIR.mkdir(exist_ok=True)
+    engine = storage_for(args.db_url).create_engine()
+    seeder.seed(engine, args.initial_rows, args.seed)
+
+    ports = {"api": args.port, "writer": args.port + 1, "cleaner": args.port + 2}
+    # Настройки чистильщика: короткий срок жизни, чтобы удаление шло всё время
+    cleaner_env = {
+        "COOKIE_MAX_AGE_MINUTES": str(args.max_age_minutes),
+        "TARGET_SIZE_AFTER_CAPTCHA": str(args.target_size),
+        "TARGET_SIZE_WITHOUT_CAPTCHA": str(args.target_size),
+    }
+    api = run.start_api(args.db_url, args.port)
+    processes = [
+        _spawn("writer", args, ports["writer"], {}),
+        _spawn("cleaner", args, ports["cleaner"], cleaner_env),
+    ]
+    try:
+        series = asyncio.run(soak(args, engine, ports))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(30)
+        run.stop_api(api)
+
+    report = {
+        "meta": {
+            "commit": run.git_commit(),
+            "db": engine.dialect.name,
+            "duration": args.duration,
+            "window": args.window,
+            "write_rate": args.write_rate,
+            "cleaner_interval": args.cleaner_interval,
+            "max_age_minutes": args.max_age_minutes,
+            "target_size": args.target_size,
+            "initial_rows": args.initial_rows,
+            "concurrency": args.concurrency,
+            "endpoints": args.endpoints,
+            "env": {n: os.getenv(n) for n in run.RECORDED_ENV if os.getenv(n)},
+        },
+        "summary": _summary(series),
+        "series": series,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("role", nargs="?", default="run", choices=["run", "writer", "cleaner"])
+    parser.add_argument("--duration", type=float, default=300, help="Секунд")
+    parser.add_argument("--window", type=float, default=5, help="Шаг ряда, секунд")
+    parser.add_argument("--write-rate", type=float, default=20, help="Куки в секунду")
+    parser.add_argument("--cleaner-interval", type=float, default=15, help="Секунд")
+    parser.add_argument("--max-age-minutes", type=int, default=2)
+    parser.add_argument("--target-size", type=int, default=0, help="0 - без лимита")
+    parser.add_argument("--initial-rows", type=int, default=50_000)
+    parser.add_argument("--concurrency", type=int, default=4, help="Соединений на эндпоинт")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--db-url", help="Своя БД вместо SQLite в bench/.data (перезаписывается)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8775, help="API; +1 писатель, +2 чистильщик")
+    parser.add_argument("--metrics-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if args.role == "writer":
+        try:
+            asyncio.run(writer_main(args))
+        except KeyboardInterrupt:
+            pass
+    elif args.role == "cleaner":
+        cleaner_main(args)
+    else:
+        main_run(args)
+
+
+if __name__ == "__main__":
+    main()
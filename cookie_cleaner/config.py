@@ -0,0 +1,40 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_URL = os.getenv("DB_URL")
+if not DB_URL:
+    raise ValueError("DB_URL не найден в .env файле")
+
+# Необязательный кеш пула в Redis (тот же, что у API)
+REDIS_URL = os.getenv("REDIS_URL")
+
+# delete - удалять старые строки батчами; partition - сначала целые часовые секции
+RETENTION_MODE = os.getenv("RETENTION_MODE", "delete")
+
+# Сколько куки каждого класса (after_captcha True/False) оставлять всегда
+MIN_COUNT_TO_CLEAN = int(os.getenv("MIN_COUNT_TO_CLEAN", "25"))
+
+# Максимальный возраст куки, минут (0 - без ограничения)
+MAX_AGE_MINUTES = int(os.getenv("COOKIE_MAX_AGE_MINUTES", "60"))
+
+# Целевой размер пула по классам (0 - без ограничения)
+TARGET_SIZE = {
+    True: int(os.getenv("TARGET_SIZE_AFTER_CAPTCHA", "500")),
+    False: int(os.getenv("TARGET_SIZE_WITHOUT_CAPTCHA", "500")),
+}
+
+# Плановая очистка раз в INTERVAL_MINUTES, внеплановая - как только пул
+# превысил HIGH_WATER_MARK (проверка раз в HIGH_WATER_CHECK_SECONDS, 0 - выкл)
+INTERVAL_MINUTES = int(os.getenv("CLEANER_INTERVAL_MINUTES", "30"))
+HIGH_WATER_MARK = int(os.getenv("POOL_HIGH_WATER_MARK", "2000"))
+HIGH_WATER_CHECK_SECONDS = int(os.getenv("HIGH_WATER_CHECK_SECONDS", "30"))
+
+# Удаление маленькими транзакциями, чтобы чтения API не ждали чистильщика
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+BATCH_PAUSE_SECONDS = float(os.getenv("DELETE_BATCH_PAUSE_SECONDS", "0.05"))
+
+# Порт /metrics чистильщика для Prometheus (0 - выключено)
+METRICS_PORT = int(os.getenv("CLEANER_METRICS_PORT", "9102"))
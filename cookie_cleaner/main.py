@@ -1,30 +1,31 @@
+import asyncio
 import logging
-from datetime import datetime
+import os
+import platform
+import signal
+import sys
+import threading
 import time
-from sqlalchemy import (
-    create_engine,
-    func,
-    Boolean,
-    Column,
-    DateTime,
-    Integer,
-    String,
-    delete,
-)
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker, declarative_base
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
 
-# ------------------- Настройки -------------------
-DB_USER = "postgres"
-DB_PASS = "secretpassword"
-DB_NAME = "cookies"
-DB_HOST = "localhost"
-DB_PORT = 5432
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-MIN_COUNT_TO_CLEAN = 25
-INTERVAL_MINUTES = 30
+try:  # внутри процесса API (CLEANER_IN_PROCESS=1): общие с API модули
+    import cache
+    from metrics import REGISTRY, serve
+    from models import Cookie, floor_id_subquery, in_current_epoch, utcnow
+    from storage import storage_for
+except ImportError:  # отдельный процесс
+    from api import cache
+    from api.metrics import REGISTRY, serve
+    from api.models import Cookie, floor_id_subquery, in_current_epoch, utcnow
+    from api.storage import storage_for
+from cookie_cleaner import config, partitions
+from redis import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import Select, delete, func, select, tuple_
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
 
 # ------------------- Логирование -------------------
 logging.basicConfig(
@@ -35,105 +36,332 @@ logging.basicConfig(
 logger = logging.getLogger("cookie-cleaner")
 
 
-Base = declarative_base()
+# ------------------- Подключение к БД -------------------
+storage = storage_for(config.DB_URL)
+engine = storage.create_engine(echo=False, pool_pre_ping=True)
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+cache_client = Redis.from_url(config.REDIS_URL) if config.REDIS_URL else None
 
+# Плановый запуск и срабатывание по верхней отметке не должны идти одновременно
+cleanup_lock = threading.Lock()
+# Остановка: текущий батч дописывается, следующие не начинаются
+stop_requested = threading.Event()
 
-class Cookie(Base):
-    __tablename__ = "cookies"
+# ------------------- Метрики -------------------
+ROWS_DELETED = REGISTRY.counter(
+    "cleaner_rows_deleted_total",
+    "Удалённые куки: epoch - прошлые эпохи, retention - возраст и размер, "
+    "partition - целыми секциями",
+    ("reason",),
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "cleaner_run_seconds",
+    "Длительность одной очистки",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+DELETE_BATCH_SECONDS = REGISTRY.histogram(
+    "cleaner_delete_batch_seconds", "Одна транзакция DELETE батча"
+)
+RUNS = REGISTRY.counter("cleaner_runs_total", "Запуски очистки", ("result",))
+LAST_RUN = REGISTRY.gauge(
+    "cleaner_last_run_timestamp_seconds", "Unix-время окончания последней очистки"
+)
+POOL_SIZE = REGISTRY.gauge(
+    "cleaner_pool_size", "Размер пула при последней проверке верхней отметки"
+)
 
-    id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
-    cookies_json = Column(String)
-    proxy = Column(String)
-    after_captcha = Column(Boolean, default=False, nullable=False)
 
+def _uncache(rows: list[tuple[int, bool]]) -> None:
+    if cache_client is None or not rows:
+        return
+    try:
+        pipe = cache_client.pipeline(transaction=False)
+        cache.remove_cookies(pipe, rows)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Не удалось убрать удалённые куки из кеша: {e}")
 
-# ------------------- Подключение к БД -------------------
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
+def _cutoff() -> datetime | None:
+    if config.MAX_AGE_MINUTES <= 0:
+        return None
+    return utcnow() - timedelta(minutes=config.MAX_AGE_MINUTES)
 
-def cleanup_old_cookies():
-    try:
+
+def pool_size() -> int:
+    with SessionLocal() as session:
+        return session.scalar(select(func.count()).where(in_current_epoch()))
+
+
+def reclaim_old_epochs() -> int:
+    """Добирает строки, инвалидированные остановкой (API удаляет их в фоне сам)."""
+    deleted_total = 0
+    while not stop_requested.is_set():
+        started = time.perf_counter()
         with SessionLocal() as session:
-            total = session.query(func.count(Cookie.id)).scalar()
+            batch = (
+                select(Cookie.id)
+                .where(Cookie.id <= floor_id_subquery())
+                .order_by(Cookie.id)
+                .limit(config.DELETE_BATCH_SIZE)
+            )
+            deleted = session.execute(
+                delete(Cookie)
+                .where(Cookie.id.in_(batch))
+                .returning(Cookie.id, Cookie.after_captcha)
+            ).all()
+            session.commit()
+        DELETE_BATCH_SECONDS.observe(time.perf_counter() - started)
+        ROWS_DELETED.inc(len(deleted), reason="epoch")
+        _uncache([tuple(row) for row in deleted])
+        deleted_total += len(deleted)
+        if len(deleted) < config.DELETE_BATCH_SIZE:
+            break
+        time.sleep(config.BATCH_PAUSE_SECONDS)
+    return deleted_total
 
-            if total <= MIN_COUNT_TO_CLEAN:
-                logger.info(
-                    f"Записей всего {total}, меньше минимального значения: {MIN_COUNT_TO_CLEAN}, пропускаем"
+
+def _plan_deletion(
+    session: Session, after_captcha: bool, cutoff: datetime | None
+) -> int:
+    """Сколько самых старых куки класса удалить по возрасту и по целевому размеру."""
+    in_class = (Cookie.after_captcha == after_captcha) & in_current_epoch()
+    total = session.scalar(select(func.count()).where(in_class))
+    expired = 0
+    if cutoff is not None:
+        expired = session.scalar(
+            select(func.count()).where(in_class, Cookie.timestamp < cutoff)
+        )
+    target = config.TARGET_SIZE[after_captcha]
+    over_target = total - target if target > 0 else 0
+
+    to_delete = min(max(expired, over_target), total - config.MIN_COUNT_TO_CLEAN)
+    logger.info(
+        f"after_captcha={after_captcha}: всего {total}, просрочено {expired}, "
+        f"сверх цели {max(over_target, 0)}, удаляем {max(to_delete, 0)} "
+        f"(минимум {config.MIN_COUNT_TO_CLEAN})"
+    )
+    return max(to_delete, 0)
+
+
+def oldest_batch(after_captcha: bool, limit: int, last_key: tuple | None) -> Select:
+    """Следующие limit самых старых куки класса после ключа (timestamp, id)."""
+    oldest = (
+        select(Cookie.id, Cookie.timestamp)
+        .where(Cookie.after_captcha == after_captcha, in_current_epoch())
+        .order_by(Cookie.timestamp, Cookie.id)
+        .limit(limit)
+    )
+    if last_key is not None:
+        oldest = oldest.where(tuple_(Cookie.timestamp, Cookie.id) > last_key)
+    return oldest
+
+
+def delete_oldest(after_captcha: bool, to_delete: int) -> int:
+    """
+    Удаляет to_delete самых старых куки класса батчами по DELETE_BATCH_SIZE.
+
+    Каждый батч - своя короткая транзакция; курсор по (timestamp, id) не даёт
+    заново просматривать только что удалённые записи в начале индекса.
+    """
+    deleted_total = 0
+    last_key = None
+
+    while deleted_total < to_delete and not stop_requested.is_set():
+        limit = min(config.DELETE_BATCH_SIZE, to_delete - deleted_total)
+        oldest = oldest_batch(after_captcha, limit, last_key)
+
+        started = time.perf_counter()
+        with SessionLocal() as session:
+            batch = session.execute(oldest).all()
+            if not batch:
+                break
+            deleted = [
+                tuple(row)
+                for row in session.execute(
+                    delete(Cookie)
+                    .where(Cookie.id.in_([row.id for row in batch]))
+                    .returning(Cookie.id, Cookie.after_captcha)
                 )
-                return
+            ]
+            session.commit()
+        DELETE_BATCH_SECONDS.observe(time.perf_counter() - started)
+        ROWS_DELETED.inc(len(deleted), reason="retention")
+
+        _uncache(deleted)
+        deleted_total += len(deleted)
+        last_key = (batch[-1].timestamp, batch[-1].id)
+        time.sleep(config.BATCH_PAUSE_SECONDS)
+
+    return deleted_total
+
+
+def drop_expired_partitions(cutoff: datetime) -> None:
+    """Режим partition: целиком удаляем секции старше cutoff, сохраняя минимум."""
+    partitions.ensure_partitions(engine)
 
-            want_to_delete = total // 2
-            would_remain = total - want_to_delete
+    with engine.connect() as conn:
+        remaining = dict(
+            conn.execute(
+                select(Cookie.after_captcha, func.count())
+                .where(in_current_epoch())
+                .group_by(Cookie.after_captcha)
+            ).all()
+        )
+        for after_captcha in (True, False):
+            remaining.setdefault(after_captcha, 0)
 
-            if would_remain < MIN_COUNT_TO_CLEAN:
-                to_delete = total - MIN_COUNT_TO_CLEAN
+        for partition in partitions.list_partitions(conn):
+            if partition.end > cutoff or stop_requested.is_set():
+                break
+            counts = partitions.count_rows(conn, partition)
+            if any(
+                remaining[c] - counts[c] < config.MIN_COUNT_TO_CLEAN and counts[c]
+                for c in (True, False)
+            ):
                 logger.info(
-                    f"Хотели удалить половину ({want_to_delete}), но осталось бы {would_remain} < {MIN_COUNT_TO_CLEAN}, удаляем {to_delete}"
+                    f"Секция {partition.name} нужна для минимума пула, оставляем"
                 )
-            else:
-                to_delete = want_to_delete
-                logger.info(f"Удаляем примерно половину: {to_delete} шт")
-
-            if to_delete <= 0:
-                logger.info("Ничего удалять не нужно после всех проверок")
-                return
-
-            # ────────────── само удаление ──────────────
-
-            # Подзапрос на самые старые id
-            subq = (
-                session.query(Cookie.id)
-                .order_by(Cookie.timestamp.asc())
-                .limit(to_delete)
-                .subquery()
+                break
+            conn.rollback()  # не держим снимок, пока отцепляем секцию
+            try:
+                _uncache(partitions.drop_partition(engine, partition))
+            except DBAPIError as e:
+                # Не отцепили (например, не дождались блокировки) - батчевая
+                # очистка по возрасту и квотам всё равно должна пройти
+                logger.warning(f"Не удалось удалить секцию {partition.name}: {e.orig}")
+                continue
+            ROWS_DELETED.inc(sum(counts.values()), reason="partition")
+            for c in (True, False):
+                remaining[c] -= counts[c]
+            logger.info(
+                f"Удалена секция {partition.name}: {sum(counts.values())} записей"
             )
 
-            # Удаляем по id из подзапроса
-            stmt = delete(Cookie).where(Cookie.id.in_(subq))
 
-            result = session.execute(stmt)
-            session.commit()
+def cleanup_old_cookies():
+    if not cleanup_lock.acquire(blocking=False):
+        logger.info("Очистка уже идёт, пропускаем")
+        return
 
-            logger.info(
-                f"Успешно удалено {result.rowcount} записей (из запланированных {to_delete})"
-            )
+    started = time.perf_counter()
+    result = "error"
+    try:
+        deleted = reclaim_old_epochs()
+
+        cutoff = _cutoff()
+        if config.RETENTION_MODE == "partition" and cutoff is not None:
+            drop_expired_partitions(cutoff)
+
+        # Остаток по возрасту и лимиты по классам - батчами
+        for after_captcha in (True, False):
+            with SessionLocal() as session:
+                to_delete = _plan_deletion(session, after_captcha, cutoff)
+            if to_delete > 0 and not stop_requested.is_set():
+                deleted += delete_oldest(after_captcha, to_delete)
+
+        logger.info(
+            f"Очистка завершена: удалено {deleted} записей "
+            f"за {time.perf_counter() - started:.2f} с"
+        )
+        result = "ok"
 
     except SQLAlchemyError as e:
         logger.error(f"Ошибка базы: {e}", exc_info=True)
     except Exception as e:
         logger.exception(f"Неожиданная ошибка: {e}")
+    finally:
+        RUN_SECONDS.observe(time.perf_counter() - started)
+        RUNS.inc(result=result)
+        LAST_RUN.set(time.time())
+        cleanup_lock.release()
 
 
-def main():
-    scheduler = BackgroundScheduler()
+def check_high_water_mark():
+    try:
+        size = pool_size()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы при проверке размера пула: {e}")
+        return
+    POOL_SIZE.set(size)
+    if size > config.HIGH_WATER_MARK:
+        logger.info(
+            f"Пул {size} > верхней отметки {config.HIGH_WATER_MARK}, внеплановая очистка"
+        )
+        cleanup_old_cookies()
+
+
+def prepare_retention() -> None:
+    if config.RETENTION_MODE == "partition":
+        if not storage.supports_partitions:
+            logger.warning("Секции есть только в PostgreSQL, удаляем батчами")
+            config.RETENTION_MODE = "delete"
+        else:
+            partitions.ensure_partitioned(engine)
+            partitions.ensure_partitions(engine)
 
-    # Запускаем каждые INTERVAL_MINUTES минут
-    scheduler.add_job(
-        cleanup_old_cookies,
-        trigger=IntervalTrigger(minutes=INTERVAL_MINUTES),
-        id="cookie_cleanup_job",
-        name="Удаление старых cookies каждые {INTERVAL_MINUTES} минут",
-        replace_existing=True,
-    )
 
+async def _in_thread(job) -> None:
+    """
+    Запускает синхронную задачу в потоке. При отмене корутины задача
+    дописывает текущий батч и останавливается, а не бросается посреди DELETE.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(job))
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        stop_requested.set()
+        await future
+        raise
+
+
+async def run() -> None:
+    """
+    Расписание чистильщика: плановая очистка раз в INTERVAL_MINUTES и
+    проверка верхней отметки раз в HIGH_WATER_CHECK_SECONDS. Одна и та же
+    корутина работает и в отдельном процессе, и задачей внутри API.
+    """
+    stop_requested.clear()
+    await _in_thread(prepare_retention)
     logger.info(
-        f"Планировщик запущен. Очистка каждые {INTERVAL_MINUTES} минут. "
-        f"Минимальное количество записей для очистки: {MIN_COUNT_TO_CLEAN}"
+        f"Чистильщик запущен. Очистка каждые {config.INTERVAL_MINUTES} минут "
+        f"и при пуле больше {config.HIGH_WATER_MARK}. "
+        f"Возраст до {config.MAX_AGE_MINUTES} мин, цель по классам {config.TARGET_SIZE}, "
+        f"минимум по классу: {config.MIN_COUNT_TO_CLEAN}"
     )
 
+    interval = config.INTERVAL_MINUTES * 60
+    check_interval = config.HIGH_WATER_CHECK_SECONDS
+    check_enabled = config.HIGH_WATER_MARK > 0 and check_interval > 0
+    next_cleanup = time.monotonic() + interval
+    next_check = time.monotonic() + check_interval if check_enabled else float("inf")
+    while True:
+        await asyncio.sleep(max(min(next_cleanup, next_check) - time.monotonic(), 0))
+        if time.monotonic() >= next_cleanup:
+            await _in_thread(cleanup_old_cookies)
+            next_cleanup = time.monotonic() + interval
+        elif time.monotonic() >= next_check:
+            await _in_thread(check_high_water_mark)
+            next_check = time.monotonic() + check_interval
+
+
+async def main():
+    if config.METRICS_PORT:
+        serve(config.METRICS_PORT)  # /metrics чистильщика
+
+    # SIGTERM от супервизора API - дописать текущий батч и выйти
+    if platform.system() != "Windows":
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
     try:
-        scheduler.start()
-        # Держим процесс живым
-        while True:
-            time.sleep(1)
-    except (KeyboardInterrupt, SystemExit):
-        logger.info("Остановка планировщика...")
-        scheduler.shutdown()
-        logger.info("Программа завершена")
+        await run()
+    except asyncio.CancelledError:
+        logger.info("Чистильщик остановлен")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Остановка по Ctrl+C")
@@ -0,0 +1,197 @@
+"""
+Секционирование таблицы cookies по timestamp (только PostgreSQL).
+
+В режиме RETENTION_MODE=partition таблица один раз превращается в
+секционированную по часам, чистильщик заранее создаёт секции на
+PARTITIONS_AHEAD часов вперёд, а устаревшие куки удаляет целыми
+секциями (DETACH + DROP) вместо DELETE по id.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Engine, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger("cookie-cleaner.partitions")
+
+PARTITION_INTERVAL = timedelta(hours=1)
+PARTITIONS_AHEAD = 24
+DEFAULT_PARTITION = "cookies_default"
+PARTITION_LOCK_KEY = 74_211_008
+
+# DETACH берёт ACCESS EXCLUSIVE на родителя, и пока он ждёт блокировку, за ним
+# встают все чтения API. Поэтому ждём не дольше DETACH_LOCK_TIMEOUT и пробуем
+# несколько раз с паузой; не вышло - секция останется до следующего запуска.
+# DETACH ... CONCURRENTLY не подходит: он запрещён при секции DEFAULT
+DETACH_LOCK_TIMEOUT = "50ms"
+DETACH_ATTEMPTS = 5
+DETACH_RETRY_PAUSE_SECONDS = 0.5
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+@dataclass
+class Partition:
+    name: str
+    start: datetime
+    end: datetime
+
+
+def _floor(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _partition_name(start: datetime) -> str:
+    return f"cookies_p{start:%Y%m%d%H}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('cookies')")
+    ).scalar()
+    return relkind == "p"
+
+
+def _create_partition(conn: Connection, table: str, start: datetime) -> None:
+    end = start + PARTITION_INTERVAL
+    conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(start)} PARTITION OF {table}"
+            f" FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    )
+
+
+def ensure_partitioned(engine: Engine) -> None:
+    """Однократно переводит обычную таблицу cookies на секции по часам."""
+    with engine.begin() as conn:
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}
+        )
+        if is_partitioned(conn):
+            return
+
+        logger.info("Переводим таблицу cookies на секционирование по timestamp")
+        conn.execute(text("LOCK TABLE cookies IN ACCESS EXCLUSIVE MODE"))
+        index_defs = conn.execute(
+            text(
+                "SELECT indexdef FROM pg_indexes"
+                " WHERE tablename = 'cookies' AND indexname <> 'cookies_pkey'"
+            )
+        ).scalars().all()
+
+        conn.execute(
+            text(
+                "UPDATE cookies SET timestamp = now() AT TIME ZONE 'utc'"
+                " WHERE timestamp IS NULL"
+            )
+        )
+        # Ключ секционирования обязан входить в первичный ключ
+        conn.execute(
+            text(
+                "CREATE TABLE cookies_new (LIKE cookies INCLUDING DEFAULTS)"
+                " PARTITION BY RANGE (timestamp)"
+            )
+        )
+        conn.execute(
+            text("ALTER TABLE cookies_new ALTER COLUMN timestamp SET NOT NULL")
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE cookies_new"
+                " ADD CONSTRAINT cookies_new_pkey PRIMARY KEY (id, timestamp)"
+            )
+        )
+        conn.execute(
+            text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF cookies_new DEFAULT")
+        )
+
+        oldest = conn.execute(text("SELECT min(timestamp) FROM cookies")).scalar()
+        now = _floor(datetime.now(timezone.utc).replace(tzinfo=None))
+        start = _floor(oldest) if oldest else now
+        while start <= now + PARTITIONS_AHEAD * PARTITION_INTERVAL:
+            _create_partition(conn, "cookies_new", start)
+            start += PARTITION_INTERVAL
+
+        conn.execute(text("INSERT INTO cookies_new SELECT * FROM cookies"))
+        conn.execute(text("ALTER SEQUENCE cookies_id_seq OWNED BY cookies_new.id"))
+        conn.execute(text("DROP TABLE cookies"))
+        conn.execute(text("ALTER TABLE cookies_new RENAME TO cookies"))
+        conn.execute(text("ALTER INDEX cookies_new_pkey RENAME TO cookies_pkey"))
+        for index_def in index_defs:
+            conn.execute(text(index_def))
+
+
+def ensure_partitions(engine: Engine, now: datetime | None = None) -> None:
+    """Создаёт секции от текущего часа на PARTITIONS_AHEAD часов вперёд."""
+    start = _floor(now or datetime.now(timezone.utc).replace(tzinfo=None))
+    with engine.begin() as conn:
+        for i in range(PARTITIONS_AHEAD + 1):
+            try:
+                with conn.begin_nested():
+                    _create_partition(conn, "cookies", start + i * PARTITION_INTERVAL)
+            except DBAPIError as e:
+                # Например, в DEFAULT уже лежат строки из этого диапазона
+                logger.warning(f"Не удалось создать секцию: {e.orig}")
+
+
+def list_partitions(conn: Connection) -> list[Partition]:
+    """Секции по часам (без DEFAULT), от старых к новым."""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i"
+            " JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass('cookies')"
+            " AND c.relname LIKE 'cookies_p%'"
+        )
+    ).scalars()
+    partitions = []
+    for name in rows:
+        start = datetime.strptime(name.removeprefix("cookies_p"), "%Y%m%d%H")
+        partitions.append(Partition(name, start, start + PARTITION_INTERVAL))
+    return sorted(partitions, key=lambda p: p.start)
+
+
+def count_rows(conn: Connection, partition: Partition) -> dict[bool, int]:
+    """Количество строк секции по after_captcha."""
+    rows = conn.execute(
+        text(f"SELECT after_captcha, count(*) FROM {partition.name} GROUP BY 1")
+    ).all()
+    counts = {True: 0, False: 0}
+    counts.update(dict(rows))
+    return counts
+
+
+def _detach(engine: Engine, partition: Partition) -> None:
+    for attempt in range(1, DETACH_ATTEMPTS + 1):
+        try:
+            # В транзакции только DETACH: блокировка родителя держится миг
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+                conn.execute(
+                    text(f"ALTER TABLE cookies DETACH PARTITION {partition.name}")
+                )
+            return
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) != LOCK_NOT_AVAILABLE:
+                raise
+            if attempt == DETACH_ATTEMPTS:
+                raise
+            time.sleep(DETACH_RETRY_PAUSE_SECONDS)
+
+
+def drop_partition(engine: Engine, partition: Partition) -> list[tuple[int, bool]]:
+    """Отцепляет и удаляет секцию. Возвращает (id, after_captcha) удалённых строк."""
+    # Секция прошлого часа: новых строк в ней нет, id можно прочитать заранее
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT id, after_captcha FROM {partition.name}")
+        ).all()
+    _detach(engine, partition)
+    # Отцепленная таблица - уже не часть cookies, DROP родителя не блокирует
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {partition.name}"))
+    return [tuple(row) for row in rows]
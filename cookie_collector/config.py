@@ -22,6 +22,9 @@ DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise ValueError("DB_URL не найден в .env файле")
 
+# Необязательный кеш пула в Redis (тот же, что у API)
+REDIS_URL = os.getenv("REDIS_URL")
+
 PAGE_URL_POOL = [
     "https://www.idealo.de/preisvergleich/MainSearchProductCategory.html?q=840122905254",
     "https://www.idealo.de/preisvergleich/MainSearchProductCategory.html?q=30144941",
@@ -31,3 +34,11 @@ PAGE_URL_POOL = [
 HEADLESS = os.getenv("HEADLESS", "False").lower() == "true"
 CONCURRENT_BROWSERS = 5
 INTERVAL_BETWEEN_STARTS = 5  # секунд - задержка между запуском новых задач
+
+WRITER_BATCH_SIZE = 50  # сколько куки писать в БД одним INSERT
+WRITER_FLUSH_SECONDS = 1.0  # не дольше стольких секунд держать куки в очереди
+# Сжимать тело куки общим словарём имён (см. api/payloads.py)
+COMPRESS_PAYLOAD = os.getenv("COMPRESS_PAYLOAD", "1") == "1"
+
+# Порт /metrics коллектора для Prometheus (0 - выключено)
+METRICS_PORT = int(os.getenv("COLLECTOR_METRICS_PORT", "9101"))
@@ -1,19 +1,24 @@
 import asyncio
 import datetime
-import json
 import logging
+import platform
 import random
+import signal
 import sys
 import os
 
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from api.models import Base, Cookie
-from sqlalchemy import create_engine
+from api.metrics import REGISTRY, serve
+from api.migrations import run_migrations
+from api.payloads import dictionaries
+from api.storage import storage_for
+from redis import Redis
 from sqlalchemy.orm import sessionmaker
 import config
 from collector import get_cookies_via_playwright
+from writer import CookieWriter
 from typing import Optional
 
 logging.basicConfig(
@@ -22,8 +27,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger("collector")
 
+COLLECTED = REGISTRY.counter(
+    "collector_cookies_collected_total", "Собранные куки", ("after_captcha",)
+)
+ATTEMPTS_FAILED = REGISTRY.counter(
+    "collector_attempts_failed_total", "Попытки сбора без куки (в т.ч. с ошибкой)"
+)
+
 
-async def collector_task(task_id: int, session_factory: sessionmaker):
+async def collector_task(task_id: int, writer: CookieWriter):
     """Один бесконечный сборщик куки (работает в своём цикле)"""
 
     logger.info(f"[collector-{task_id}] Запущен")
@@ -41,25 +53,21 @@ async def collector_task(task_id: int, session_factory: sessionmaker):
 
             if result:
                 cookies, used_proxy, after_captcha = result
-                db_session = session_factory()
-                try:
-                    new_cookie = Cookie(
-                        cookies_json=json.dumps(cookies),
-                        proxy=used_proxy,
-                        after_captcha=after_captcha,
-                    )
-                    db_session.add(new_cookie)
-                    db_session.commit()
-                    logger.info(
-                        f"[collector-{task_id}] Куки сохранены | "
-                        f"proxy={used_proxy} | after_captcha={after_captcha} | {datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
-                    )
-                finally:
-                    db_session.close()
+                COLLECTED.inc(after_captcha=after_captcha)
+                # Запись в БД делает общий писатель, задача сразу идёт дальше
+                await writer.put(cookies, used_proxy, after_captcha)
+                logger.info(
+                    f"[collector-{task_id}] Куки собраны | "
+                    f"proxy={used_proxy} | after_captcha={after_captcha} | "
+                    f"в очереди на запись={writer.stats.queue_depth} | "
+                    f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+                )
             else:
+                ATTEMPTS_FAILED.inc()
                 logger.warning(f"[collector-{task_id}] Не удалось получить куки")
 
         except Exception as e:
+            ATTEMPTS_FAILED.inc()
             logger.exception(f"[collector-{task_id}] Ошибка в цикле")
 
         # небольшая рандомизированная пауза между попытками одного сборщика
@@ -70,21 +78,49 @@ async def main():
     logger.info(
         f"Запуск коллектора | параллельных браузеров = {config.CONCURRENT_BROWSERS}"
     )
-    engine = create_engine(config.DB_URL)  # PostgreSQL из .env
-    Base.metadata.create_all(bind=engine)  # Создание таблицы (если нет)
-    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-    tasks = []
-    for i in range(1, config.CONCURRENT_BROWSERS + 1):
-        task = asyncio.create_task(collector_task(i, session_factory))
-        tasks.append(task)
+    if config.METRICS_PORT:
+        serve(config.METRICS_PORT)  # /metrics коллектора
+    engine = storage_for(config.DB_URL).create_engine()  # PostgreSQL или SQLite
+    run_migrations(engine)  # Создание/обновление схемы
+    dictionaries.bind(engine)  # словари сжатия payload
+    session_factory = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+    cache_client = Redis.from_url(config.REDIS_URL) if config.REDIS_URL else None
+    writer = CookieWriter(
+        session_factory,
+        cache_client,
+        batch_size=config.WRITER_BATCH_SIZE,
+        flush_seconds=config.WRITER_FLUSH_SECONDS,
+        compress=config.COMPRESS_PAYLOAD,
+    )
+    writer.start()
 
-        # небольшая задержка между стартом задач, чтобы не перегружать систему сразу
-        if i < config.CONCURRENT_BROWSERS:
-            await asyncio.sleep(config.INTERVAL_BETWEEN_STARTS)
+    # SIGTERM от API (/stop_cookie_collector) - штатная остановка с дозаписью очереди
+    if platform.system() != "Windows":
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
 
-    # ждём бесконечно (или до Ctrl+C)
-    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks = []
+    try:
+        for i in range(1, config.CONCURRENT_BROWSERS + 1):
+            task = asyncio.create_task(collector_task(i, writer))
+            tasks.append(task)
+
+            # небольшая задержка между стартом задач, чтобы не перегружать систему сразу
+            if i < config.CONCURRENT_BROWSERS:
+                await asyncio.sleep(config.INTERVAL_BETWEEN_STARTS)
+
+        # ждём бесконечно (или до Ctrl+C)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    except asyncio.CancelledError:
+        logger.info("Получен сигнал остановки, дописываем очередь")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await writer.close()
 
 
 if __name__ == "__main__":
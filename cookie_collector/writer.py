@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from api import cache
+from api.metrics import REGISTRY
+from api.models import Cookie
+from api.notify import notify_inserts
+from api.payloads import compress_payloads
+from api.proxies import intern_proxies
+from redis import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger("collector.writer")
+
+ROWS_SAVED = REGISTRY.counter("collector_rows_saved_total", "Куки, записанные в БД")
+FLUSH_SECONDS = REGISTRY.histogram(
+    "collector_flush_seconds", "Запись одного батча в БД (INSERT и commit)"
+)
+FAILED_FLUSHES = REGISTRY.counter(
+    "collector_failed_flushes_total", "Неудачные попытки записать батч"
+)
+QUEUE_DEPTH = REGISTRY.gauge("collector_queue_depth", "Куки в очереди на запись")
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int = 0
+    saved: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    last_batch_size: int = 0
+    last_flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+
+
+class CookieWriter:
+    """
+    Единственный писатель в БД для всех задач коллектора.
+
+    Задачи кладут куки в asyncio-очередь и сразу продолжают работу, писатель
+    сбрасывает накопленное одним многострочным INSERT, когда набралось
+    batch_size штук или прошло flush_seconds. Сама запись идёт в отдельном
+    потоке, чтобы commit не останавливал event loop.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        cache_client: Redis | None = None,
+        batch_size: int = 50,
+        flush_seconds: float = 1.0,
+        max_queue: int = 1000,
+        compress: bool = True,
+    ):
+        self.session_factory = session_factory
+        self.cache_client = cache_client
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue: asyncio.Queue[Cookie] = asyncio.Queue(max_queue)
+        self.stats = WriterStats()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    async def put(self, cookies: dict, proxy: str, after_captcha: bool) -> None:
+        # Время фиксируем в момент сбора, а не в момент записи
+        await self.queue.put(Cookie.create(cookies, proxy, after_captcha))
+        self.stats.queue_depth = self.queue.qsize()
+        QUEUE_DEPTH.set(self.stats.queue_depth)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Дописывает всё из очереди и останавливает писателя."""
+        self._closing = True
+        if self._task:
+            await self._task
+        logger.info(
+            f"Писатель остановлен | сохранено={self.stats.saved} | "
+            f"сбросов={self.stats.flushes} | ошибок={self.stats.failed_flushes}"
+        )
+
+    async def _next_batch(self) -> list[Cookie]:
+        batch: list[Cookie] = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._closing and self.queue.empty()):
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        pending: list[Cookie] = []
+        while True:
+            if len(pending) < self.batch_size:
+                pending.extend(await self._next_batch())
+            self.stats.queue_depth = self.queue.qsize()
+            QUEUE_DEPTH.set(self.stats.queue_depth)
+
+            if pending:
+                started = time.perf_counter()
+                try:
+                    await asyncio.to_thread(self._flush, pending)
+                except Exception:
+                    self.stats.failed_flushes += 1
+                    FAILED_FLUSHES.inc()
+                    logger.exception(
+                        f"Не удалось сохранить {len(pending)} куки, повтор позже"
+                    )
+                    if self._closing:
+                        return
+                    await asyncio.sleep(self.flush_seconds)
+                    continue
+                self._record_flush(len(pending), time.perf_counter() - started)
+                pending = []
+
+            if self._closing and self.queue.empty():
+                return
+
+    def _flush(self, batch: list[Cookie]) -> None:
+        if self.compress:
+            compress_payloads(batch)
+        with self.session_factory() as session:
+            intern_proxies(session, batch)
+            # Один INSERT ... VALUES (...), (...) RETURNING id на весь батч
+            session.add_all(batch)
+            session.flush()
+            notify_inserts(session, batch)
+            session.commit()
+            session.expunge_all()
+        self._cache(batch)
+
+    def _cache(self, batch: list[Cookie]) -> None:
+        if self.cache_client is None:
+            return
+        try:
+            pipe = self.cache_client.pipeline(transaction=False)
+            for cookie in batch:
+                cache.add_cookie(pipe, cookie)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Не удалось добавить {len(batch)} куки в кеш: {e}")
+
+    def _record_flush(self, size: int, seconds: float) -> None:
+        stats = self.stats
+        stats.saved += size
+        stats.flushes += 1
+        stats.last_batch_size = size
+        stats.last_flush_seconds = seconds
+        stats.max_flush_seconds = max(stats.max_flush_seconds, seconds)
+        ROWS_SAVED.inc(size)
+        FLUSH_SECONDS.observe(seconds)
+        logger.info(
+            f"Сохранено {size} куки за {seconds * 1000:.1f} мс | "
+            f"в очереди={stats.queue_depth} | всего={stats.saved}"
+        )
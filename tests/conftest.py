@@ -0,0 +1,184 @@
+"""
+Общие фикстуры тестов.
+
+Модули API импортируются так же, как их видит процесс API (каталог api/ в
+sys.path), коллектор и чистильщик - пакетами от корня проекта, как при
+CLEANER_IN_PROCESS=1.
+
+Фикстура pool - чистая БД пула с применёнными миграциями: SQLite во
+временном файле и PostgreSQL, если задан TEST_POSTGRES_URL (таблицы пула
+в этой БД ПЕРЕСОЗДАЮТСЯ, без него PostgreSQL-вариант пропускается).
+Фикстура api - TestClient приложения main.py поверх этой БД, busy_pool -
+все соединения пула API на время теста заняты. lagging_replica - реплика,
+отставшая от пула.
+"""
+
+import math
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "api"))
+# config.py API и чистильщика требуют DB_URL при импорте; движки у тестов свои
+os.environ.setdefault("DB_URL", "sqlite://")
+
+import database  # noqa: E402
+import main  # noqa: E402
+import payloads  # noqa: E402
+import pytest  # noqa: E402
+from api import payloads as api_payloads  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from latest import LatestCookieCache  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from sampler import CookieSampler  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+from storage import Storage, storage_for  # noqa: E402
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+POOL_TABLES = "cookies, proxies, payload_dicts, pool_state, schema_version"
+
+
+class Pool:
+    """БД пула для одного теста: синхронный движок и фабрики сессий."""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.engine = storage.create_engine()
+        self.sessions = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def async_sessions(self) -> async_sessionmaker:
+        # NullPool: каждый asyncio.run в тесте - свой event loop, соединения
+        # asyncpg/aiosqlite между ними переиспользовать нельзя
+        engine = self.storage.create_async_engine(poolclass=NullPool)
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def lagging_replica(pool: Pool, tmp_path: Path):
+    """
+    Фабрика сессий реплики, которая застряла на текущем состоянии пула и не
+    видит строк, вставленных после: в SQLite - копия файла, в PostgreSQL -
+    одна транзакция REPEATABLE READ со снимком на момент входа.
+    """
+    if pool.engine.dialect.name == "sqlite":
+        path = tmp_path / "replica.db"
+        with pool.engine.connect() as conn:
+            conn.exec_driver_sql(f"VACUUM INTO '{path}'")
+        engine = storage_for(f"sqlite:///{path}").create_async_engine(
+            poolclass=NullPool
+        )
+        yield async_sessionmaker(engine, expire_on_commit=False)
+        await engine.dispose()
+        return
+
+    engine = pool.storage.create_async_engine(
+        poolclass=NullPool, isolation_level="REPEATABLE READ"
+    )
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        await session.execute(text("SELECT 1"))  # снимок транзакции
+
+        @asynccontextmanager
+        async def same_session():
+            yield session
+
+        yield same_session
+    await engine.dispose()
+
+
+def _drop_pool_tables(url: str) -> None:
+    engine = storage_for(url).create_engine()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {POOL_TABLES} CASCADE"))
+    engine.dispose()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def database_url(request, tmp_path) -> str:
+    """Пустая БД без таблиц пула (для миграций); обычным тестам - pool."""
+    if request.param == "sqlite":
+        return f"sqlite:///{tmp_path / 'pool.db'}"
+    if not TEST_POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL не задан")
+    _drop_pool_tables(TEST_POSTGRES_URL)
+    return TEST_POSTGRES_URL
+
+
+@pytest.fixture
+def pool(database_url):
+    pool = Pool(storage_for(database_url))
+    run_migrations(pool.engine)
+    # Коллектор сжимает через api.payloads, API распаковывает через payloads
+    payloads.dictionaries.bind(pool.engine)
+    api_payloads.dictionaries.bind(pool.engine)
+    yield pool
+    pool.engine.dispose()
+
+
+@asynccontextmanager
+async def _no_lifespan(app):
+    # Миграции пул уже прошёл, супервизор и фоновые задачи тестам не нужны
+    yield
+
+
+@pytest.fixture
+def api(pool, monkeypatch):
+    """
+    TestClient приложения: все сессии main и database - к БД пула, пул
+    соединений как в проде; без Redis, снимка, LISTEN и lifespan.
+    """
+    engine = database._create_async_engine(pool.storage)
+    sessions = database._sessionmaker(engine)
+    router = database.ReplicaRouter(sessions, pool.engine, [], 0, 0)
+    for module in (database, main):
+        monkeypatch.setattr(module, "AsyncSessionLocal", sessions)
+        monkeypatch.setattr(module, "ReadSessionLocal", router)
+    monkeypatch.setattr(main, "async_engine", engine)
+    metrics_engine = database._create_metrics_engine(pool.storage)
+    monkeypatch.setattr(
+        main, "MetricsSessionLocal", database._sessionmaker(metrics_engine)
+    )
+    # Без NOTIFY кеш /latest-cookie не узнал бы о новых строках теста
+    monkeypatch.setattr(main, "latest_cache", LatestCookieCache(router, 0))
+    monkeypatch.setattr(main, "sampler", CookieSampler(primary=sessions))
+    monkeypatch.setattr(main, "pool_counted_at", -math.inf)
+    for name in ("pool_cache", "snapshot_reader", "snapshot_refresher", "broadcaster"):
+        monkeypatch.setattr(main, name, None)
+    monkeypatch.setattr(main.app.router, "lifespan_context", _no_lifespan)
+    # Один event loop на тест: соединения пула привязаны к нему
+    with TestClient(main.app) as client:
+        yield client
+        client.portal.call(engine.dispose)
+        client.portal.call(metrics_engine.dispose)
+
+
+def hold_connections(client: TestClient, engine, count: int) -> list:
+    """Берёт count соединений движка в event loop клиента и не отдаёт."""
+
+    async def take():
+        return [await engine.connect() for _ in range(count)]
+
+    return client.portal.call(take)
+
+
+def release_connections(client: TestClient, connections: list) -> None:
+    async def close():
+        for conn in connections:
+            await conn.close()
+
+    client.portal.call(close)
+
+
+@pytest.fixture
+def busy_pool(api):
+    connections = hold_connections(
+        api, main.async_engine, database.DB_POOL_SIZE + database.DB_MAX_OVERFLOW
+    )
+    yield
+    release_connections(api, connections)
@@ -0,0 +1,183 @@
+"""
+Допуск запросов: корзины токенов по клиентам (429), предел одновременных
+запросов (503) и 503 при занятом пуле соединений - только тем запросам,
+которым соединение действительно нужно.
+"""
+
+from types import SimpleNamespace
+
+import admission
+import database
+import fakeredis
+import main
+import pytest
+from admission import ConcurrencyLimiter, RateLimiter, TokenBucket
+from cache import PoolCache
+from latest import LatestCookieCache
+from starlette.requests import Request
+from tests.conftest import hold_connections, release_connections
+from tests.rows import PROXY_A, classes, insert
+from tests.test_cache import warm_empty
+from tests.test_metrics import scrape
+
+
+def request(host: str = "10.0.0.1", **headers: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [
+                (name.replace("_", "-").encode(), value.encode())
+                for name, value in headers.items()
+            ],
+            "client": (host, 40000),
+        }
+    )
+
+
+def shed(api, reason: str) -> float:
+    return scrape(api).get(f'http_requests_shed_total{{reason="{reason}"}}', 0)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=3, now=0)
+
+    assert [bucket.take(0) for _ in range(3)] == [0, 0, 0]
+    # Пустая корзина: следующий токен через 1/rate
+    assert bucket.take(0) == 0.5
+    assert bucket.take(0.25) == 0.25
+    assert bucket.take(0.5) == 0
+    assert not bucket.full(1)
+    assert bucket.full(2)
+
+
+def test_rate_limiter_clients(monkeypatch):
+    # Часы стоят: между вызовами корзины не пополняются
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=lambda: 100.0))
+    limiter = RateLimiter(1, 2, {"partner": 5, "internal": 0})
+
+    assert [limiter.acquire(request()) for _ in range(3)] == [0, 0, 1]
+    # Свой IP - своя корзина; незнакомый ключ не даёт новой корзины
+    assert limiter.acquire(request("10.0.0.2")) == 0
+    assert limiter.acquire(request(x_api_key="random")) == 1
+    # Ключ из списка - своя корзина со своим rate, 0 - без лимита
+    partner = [limiter.acquire(request(x_api_key="partner")) for _ in range(3)]
+    assert partner == [0, 0, 0.2]
+    assert all(limiter.acquire(request(x_api_key="internal")) == 0 for _ in range(50))
+
+
+def test_forwarded_for_only_when_trusted():
+    forwarded = {"x_forwarded_for": "203.0.113.7, 10.0.0.9"}
+    trusting = RateLimiter(1, 1, {}, trust_forwarded=True)
+    ignoring = RateLimiter(1, 1, {})
+
+    assert trusting.client(request(**forwarded)) == ("ip:203.0.113.7", 1)
+    assert ignoring.client(request(**forwarded)) == ("ip:10.0.0.1", 1)
+
+
+def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.active == 2
+
+    unlimited = ConcurrencyLimiter(0)
+    assert all(unlimited.try_acquire() for _ in range(1000))
+
+
+def test_rate_limit_middleware(pool, api, monkeypatch):
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(0.5, 2, {}))
+    before = shed(api, "rate_limit")
+
+    statuses = [api.get("/latest-cookie").status_code for _ in range(3)]
+    limited = api.get("/latest-cookie")
+
+    assert statuses == [200, 200, 429]
+    assert limited.headers["retry-after"] == "2"
+    assert limited.json() == {"detail": "Слишком много запросов"}
+    # /health и /metrics не ограничиваются
+    assert api.get("/health").status_code == 200
+    assert shed(api, "rate_limit") == before + 2
+
+
+@pytest.mark.parametrize("busy", [1, 2])
+def test_concurrency_middleware(pool, api, monkeypatch, busy):
+    limiter = ConcurrencyLimiter(2)
+    monkeypatch.setattr(main, "concurrency", limiter)
+    before = shed(api, "concurrency")
+    for _ in range(busy):
+        limiter.try_acquire()
+
+    response = api.get("/latest-cookie")
+
+    if busy < limiter.limit:
+        assert response.status_code == 200
+    else:
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert shed(api, "concurrency") == before + 1
+    # Ответ отпустил своё место
+    assert limiter.active == busy
+
+
+def test_saturated_pool_sheds_only_db_reads(pool, api, monkeypatch):
+    server = fakeredis.FakeServer()
+    warm_empty(pool, server)
+    ids = insert(pool, classes(2, 2), fakeredis.FakeRedis(server=server))
+    before = shed(api, "db_pool")
+
+    async def redis_cache():
+        # Асинхронный клиент - в event loop приложения
+        return PoolCache(fakeredis.FakeAsyncRedis(server=server), main.ReadSessionLocal)
+
+    monkeypatch.setattr(main, "pool_cache", api.portal.call(redis_cache))
+    latest_cache = LatestCookieCache(main.ReadSessionLocal, ttl=60)
+    monkeypatch.setattr(main, "latest_cache", latest_cache)
+
+    held = hold_connections(
+        api, main.async_engine, database.DB_POOL_SIZE + database.DB_MAX_OVERFLOW
+    )
+    try:
+        from_redis = [api.get("/latest-cookie"), api.get("/random-cookie")]
+        from_db = [
+            api.get("/random-cookie", params={"proxy": PROXY_A}),
+            api.get("/latest-cookie", params={"primary": True}),
+            api.get("/proxies"),
+        ]
+        health = api.get("/health")
+    finally:
+        release_connections(api, held)
+
+    assert [response.status_code for response in from_redis] == [200, 200]
+    assert from_redis[0].json()["id"] == ids[-1]
+    assert from_redis[1].json()["id"] in ids
+    for response in from_db:
+        assert response.status_code == 503, response.request.url
+        assert response.headers["retry-after"] == "1"
+    assert health.status_code == 200
+    assert shed(api, "db_pool") == before + len(from_db)
+    # Соединения отпущены - те же запросы снова идут в БД
+    assert api.get("/random-cookie", params={"proxy": PROXY_A}).status_code == 200
+
+
+def test_in_memory_latest_survives_saturation(pool, api, monkeypatch):
+    ids = insert(pool, classes(1, 1))
+    monkeypatch.setattr(
+        main, "latest_cache", LatestCookieCache(main.ReadSessionLocal, ttl=60)
+    )
+    assert api.get("/latest-cookie").json()["id"] == ids[-1]
+
+    held = hold_connections(
+        api, main.async_engine, database.DB_POOL_SIZE + database.DB_MAX_OVERFLOW
+    )
+    try:
+        cached = api.get("/latest-cookie")
+        # Другой класс ещё не в кеше - нужен запрос к БД
+        uncached = api.get("/latest-cookie", params={"after_captcha": False})
+    finally:
+        release_connections(api, held)
+
+    assert cached.status_code == 200
+    assert cached.json()["id"] == ids[-1]
+    assert uncached.status_code == 503
@@ -0,0 +1,164 @@
+"""
+PoolCache поверх fakeredis: холодный кеш и прогрев, чтения по классам,
+пополнение коллектором и удаление чистильщиком, очистка после смены эпохи.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import cache
+import fakeredis
+import pytest
+from cache import PoolCache
+from epoch import bump_epoch
+from models import Cookie
+from sqlalchemy import select
+from tests.rows import classes, insert
+
+
+@pytest.fixture
+def server() -> fakeredis.FakeServer:
+    """Один Redis на тест: коллектор пишет синхронно, API читает асинхронно."""
+    return fakeredis.FakeServer()
+
+
+def pool_cache(pool, server: fakeredis.FakeServer) -> PoolCache:
+    # Асинхронный клиент создаётся внутри event loop своего asyncio.run
+    return PoolCache(fakeredis.FakeAsyncRedis(server=server), pool.async_sessions())
+
+
+def bodies(pool) -> dict[int, bytes]:
+    with pool.sessions() as session:
+        cookies = session.scalars(select(Cookie)).all()
+        return {cookie.id: cookie.response_body() for cookie in cookies}
+
+
+def warm_empty(pool, server) -> None:
+    """Прогрев на пустом пуле: дальше кеш пополняет только коллектор."""
+
+    async def warm():
+        await pool_cache(pool, server).warm()
+
+    asyncio.run(warm())
+
+
+def test_cold_cache_falls_back_and_warms(pool, server):
+    ids = insert(pool, classes(2, 2))
+
+    async def scenario():
+        reader = pool_cache(pool, server)
+        # Холодный кеш: None - эндпоинт идёт в БД, а кеш греется в фоне
+        cold = await reader.latest(None), await reader.random(True)
+        await reader._warm_task
+        latest = {value: await reader.latest(value) for value in (None, False, True)}
+        return cold, latest, await reader.random(True)
+
+    cold, latest, random_body = asyncio.run(scenario())
+    expected = bodies(pool)
+
+    assert cold == (None, None)
+    assert latest[None].id == ids[-1]
+    assert latest[False].id == ids[1]
+    assert latest[False].body == expected[ids[1]]
+    assert random_body in [expected[i] for i in ids[2:]]
+
+
+def test_redis_down_falls_back(pool, server):
+    insert(pool, classes(1, 1))
+    warm_empty(pool, server)
+    server.connected = False
+
+    async def scenario():
+        reader = pool_cache(pool, server)
+        return await reader.latest(None), await reader.random(None)
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+def test_latest_and_random_per_class(pool, server):
+    warm_empty(pool, server)
+    ids = insert(pool, classes(3, 2), fakeredis.FakeRedis(server=server))
+    expected = bodies(pool)
+
+    async def scenario():
+        reader = pool_cache(pool, server)
+        latest = {value: await reader.latest(value) for value in (None, False, True)}
+        random = {
+            value: {await reader.random(value) for _ in range(50)}
+            for value in (None, False, True)
+        }
+        return latest, random
+
+    latest, random = asyncio.run(scenario())
+
+    assert {value: cookie.id for value, cookie in latest.items()} == {
+        None: ids[-1],
+        False: ids[2],
+        True: ids[-1],
+    }
+    assert latest[True].body == expected[ids[-1]]
+    # Время - из score ZSET (float), с точностью до микросекунд
+    timestamp = datetime.fromisoformat(json.loads(expected[ids[-1]])["timestamp"])
+    assert abs(latest[True].timestamp - timestamp) < timedelta(milliseconds=1)
+    assert random[False] <= {expected[i] for i in ids[:3]}
+    assert random[True] <= {expected[i] for i in ids[3:]}
+    # Без класса выбираются куки обоих классов
+    assert random[None] & random[False] and random[None] & random[True]
+
+
+def test_add_and_remove_cookies(pool, server):
+    warm_empty(pool, server)
+    client = fakeredis.FakeRedis(server=server)
+    ids = insert(pool, classes(2, 1), client)
+    expected = bodies(pool)
+
+    # Как чистильщик после DELETE ... RETURNING id, after_captcha
+    pipe = client.pipeline(transaction=False)
+    cache.remove_cookies(pipe, [(ids[1], False), (ids[2], True)])
+    pipe.execute()
+
+    async def scenario():
+        reader = pool_cache(pool, server)
+        latest = {value: await reader.latest(value) for value in (None, False, True)}
+        return latest, await reader.random(False), await reader.random(True)
+
+    latest, random_without, random_with = asyncio.run(scenario())
+
+    assert latest[None].id == latest[False].id == ids[0]
+    # В тёплом кеше класс пуст - это ответ, прогрев из БД не нужен
+    assert latest[True] is None and random_with is None
+    assert random_without == expected[ids[0]]
+    assert client.hkeys(cache.BODIES_KEY) == [str(ids[0]).encode()]
+
+
+def test_clear_after_epoch_bump(pool, server):
+    warm_empty(pool, server)
+    client = fakeredis.FakeRedis(server=server)
+    insert(pool, classes(2, 2), client)
+
+    async def invalidate():
+        # Как _invalidate_pool в main.py: эпоха, затем очистка кеша
+        async with pool.async_sessions()() as db:
+            await bump_epoch(db)
+        reader = pool_cache(pool, server)
+        await reader.clear()
+        return (
+            await reader.latest(None),
+            await reader.random(None),
+            reader._warm_task,
+        )
+
+    latest, random_body, warm_task = asyncio.run(invalidate())
+
+    assert (latest, random_body) == (None, None)
+    # Пустой кеш остаётся тёплым: прогрев из БД не запускается
+    assert warm_task is None
+    assert client.exists(cache.WARM_KEY)
+
+    fresh = insert(pool, classes(0, 1), client)
+
+    async def read():
+        return await pool_cache(pool, server).latest(None)
+
+    assert asyncio.run(read()).id == fresh[0]
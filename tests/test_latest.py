@@ -0,0 +1,149 @@
+"""
+/latest-cookie: кеш процесса с объединением одновременных запросов и
+чтением с primary после NOTIFY, ETag и 304, фильтр max_age.
+"""
+
+import asyncio
+from datetime import timedelta
+
+from latest import LatestCookieCache
+from models import Cookie, utcnow
+from sqlalchemy import event, update
+from tests.conftest import lagging_replica
+from tests.rows import classes, insert
+
+
+def count_selects(sessions) -> list[str]:
+    """SELECT-ы через движок фабрики сессий - по одному на запрос к БД."""
+    selects = []
+
+    @event.listens_for(sessions.kw["bind"].sync_engine, "before_cursor_execute")
+    def count(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    return selects
+
+
+def test_concurrent_gets_share_one_query(pool):
+    ids = insert(pool, classes(2, 2))
+    sessions = pool.async_sessions()
+    selects = count_selects(sessions)
+
+    async def scenario():
+        cache = LatestCookieCache(sessions, ttl=60)
+        together = await asyncio.gather(*(cache.get(True) for _ in range(20)))
+        queries = len(selects)
+        # В пределах ttl - из памяти
+        cached = await cache.get(True)
+        assert len(selects) == queries
+        # Другой класс - свой запрос
+        without = await cache.get(False)
+        return together, queries, cached, without
+
+    together, queries, cached, without = asyncio.run(scenario())
+
+    assert {cookie.id for cookie in together} == {ids[-1]}
+    assert queries == 1
+    assert cached.id == ids[-1]
+    assert without.id == ids[1]
+    assert len(selects) == 2
+
+
+def test_invalidate_drops_cached_and_inflight(pool):
+    ids = insert(pool, classes(1, 1))
+    sessions = pool.async_sessions()
+    selects = count_selects(sessions)
+
+    async def scenario():
+        cache = LatestCookieCache(sessions, ttl=60)
+        await cache.get(None)
+        # Новая кука без капчи сбрасывает и её класс, и None
+        cache.invalidate(ids[-1] + 1, False)
+        after_insert = len(selects)
+        await cache.get(None)
+        assert len(selects) == after_insert + 1
+
+        # Сброс, пока запрос в полёте: ожидающие получат его ответ, но в кеш
+        # он не попадёт - следующий get снова идёт в БД
+        inflight = asyncio.create_task(cache.get(True))
+        for _ in range(2):  # get создал задачу запроса, она дошла до БД
+            await asyncio.sleep(0)
+        cache.invalidate(ids[-1] + 1, True)
+        first = await inflight
+        before = len(selects)
+        second = await cache.get(True)
+        return first, second, len(selects) - before
+
+    first, second, queries = asyncio.run(scenario())
+
+    assert first.id == second.id == ids[-1]
+    assert queries == 1
+
+
+def test_reload_after_notify_reads_primary(pool, tmp_path):
+    (old,) = insert(pool, classes(1, 0))
+
+    async def scenario():
+        async with lagging_replica(pool, tmp_path) as replica:
+            primary = pool.async_sessions()
+            cache = LatestCookieCache(replica, 60, primary, primary_seconds=60)
+            # Без окна primary - ответ реплики, которая строку ещё не видит
+            replica_only = LatestCookieCache(replica, 60, primary, primary_seconds=0)
+            before = await cache.get(False), await replica_only.get(False)
+            (fresh,) = await asyncio.to_thread(insert, pool, classes(1, 0))
+            for each in (cache, replica_only):
+                each.invalidate(fresh, False)
+            after = [await cache.get(value) for value in (False, None)]
+            return fresh, before, after, await replica_only.get(False)
+
+    fresh, before, after, lagging = asyncio.run(scenario())
+
+    assert [cookie.id for cookie in before] == [old, old]
+    assert [cookie.id for cookie in after] == [fresh, fresh]
+    assert lagging.id == old
+
+
+def test_etag_and_not_modified(pool, api):
+    ids = insert(pool, classes(1, 1))
+
+    first = api.get("/latest-cookie")
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+    assert etag == f'"{ids[-1]}"'
+    assert first.headers["cache-control"] == "no-cache"
+    assert first.json()["id"] == ids[-1]
+
+    for if_none_match in (etag, f"W/{etag}", f'"0", {etag}', "*"):
+        response = api.get("/latest-cookie", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304, if_none_match
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+    other = api.get("/latest-cookie", headers={"If-None-Match": '"0"'})
+    assert other.status_code == 200
+
+    # ETag своего класса; новая кука - новый ETag
+    without = api.get("/latest-cookie", params={"after_captcha": False})
+    assert without.headers["etag"] == f'"{ids[0]}"'
+    fresh = insert(pool, classes(0, 1))
+    response = api.get("/latest-cookie", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == f'"{fresh[0]}"'
+
+
+def test_max_age(pool, api):
+    old, new = insert(pool, classes(1, 1))
+    with pool.sessions() as session:
+        session.execute(
+            update(Cookie)
+            .where(Cookie.id == old)
+            .values(timestamp=utcnow() - timedelta(hours=1))
+        )
+        session.commit()
+
+    for path in ("/latest-cookie", "/random-cookie"):
+        assert api.get(path, params={"max_age": 60}).json()["id"] == new
+        fresh_old = api.get(path, params={"max_age": 60, "after_captcha": False})
+        assert fresh_old.json() == {"error": "Нет подходящих куки"}
+        older = api.get(path, params={"max_age": 7200, "after_captcha": False})
+        assert older.json()["id"] == old
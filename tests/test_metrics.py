@@ -0,0 +1,146 @@
+"""
+Реестр метрик (текстовый формат Prometheus, serve()) и /metrics API: метрики
+пула из БД через своё соединение, редкий COUNT и прошлые значения, когда БД
+не ответила.
+"""
+
+import urllib.error
+import urllib.request
+
+import main
+import pytest
+from metrics import CONTENT_TYPE, Registry, serve
+from tests.conftest import hold_connections, release_connections
+from tests.rows import classes, insert
+
+
+def scrape(api) -> dict[str, float]:
+    """Сэмплы /metrics: "имя{метки}" -> значение."""
+    response = api.get("/metrics")
+    assert response.status_code == 200
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def test_registry_text_format():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Задачи", ("kind", "ok"))
+    gauge = registry.gauge("queue_depth", "Очередь")
+    histogram = registry.histogram("job_seconds", "Время", ("kind",), (0.1, 1))
+    counter.inc(kind='a"b\\c\nd', ok=True)
+    counter.inc(2, kind="plain", ok=False)
+    gauge.set(1.5)
+    gauge.inc(-0.5)
+    for seconds in (0.05, 0.5, 0.7, 3):
+        histogram.observe(seconds, kind="x")
+
+    assert registry.render().decode().splitlines() == [
+        "# HELP jobs_total Задачи",
+        "# TYPE jobs_total counter",
+        'jobs_total{kind="a\\"b\\\\c\\nd",ok="true"} 1',
+        'jobs_total{kind="plain",ok="false"} 2',
+        "# HELP queue_depth Очередь",
+        "# TYPE queue_depth gauge",
+        "queue_depth 1",
+        "# HELP job_seconds Время",
+        "# TYPE job_seconds histogram",
+        'job_seconds_bucket{kind="x",le="0.1"} 1',
+        'job_seconds_bucket{kind="x",le="1"} 3',
+        'job_seconds_bucket{kind="x",le="+Inf"} 4',
+        'job_seconds_sum{kind="x"} 4.25',
+        'job_seconds_count{kind="x"} 4',
+    ]
+
+
+def test_registry_rejects_mistakes():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Задачи", ("kind",))
+
+    with pytest.raises(ValueError):
+        registry.gauge("jobs_total", "Ещё раз")
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_serve():
+    registry = Registry()
+    registry.counter("jobs_total", "Задачи").inc(3)
+    server = serve(0, registry)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert b"jobs_total 3\n" in response.read()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_request_duration_by_route(api):
+    response = api.get("/metrics")
+    assert response.headers["content-type"] == CONTENT_TYPE
+    labels = 'method="GET",route="/health",status="200"'
+    sample = f"http_request_duration_seconds_count{{{labels}}}"
+    before = scrape(api).get(sample, 0)
+
+    api.get("/health")
+    api.get("/health")
+    api.get("/no-such-path")
+
+    samples = scrape(api)
+    assert samples[sample] == before + 2
+    assert any('route="unmatched",status="404"' in name for name in samples)
+
+
+def test_pool_gauges(pool, api, monkeypatch):
+    ids = insert(pool, classes(2, 1))
+
+    first = scrape(api)
+    assert first['cookies_pool_size{after_captcha="false"}'] == 2
+    assert first['cookies_pool_size{after_captcha="true"}'] == 1
+    assert first["cookies_inserted_total"] == ids[-1]
+    assert 0 <= first['cookies_newest_age_seconds{after_captcha="false"}'] < 60
+
+    # Размер пула - раз в METRICS_POOL_COUNT_SECONDS, остальное - каждый скрейп
+    fresh = insert(pool, classes(1, 0))
+    second = scrape(api)
+    assert second['cookies_pool_size{after_captcha="false"}'] == 2
+    assert second["cookies_inserted_total"] == fresh[-1]
+
+    monkeypatch.setattr(main, "METRICS_POOL_COUNT_SECONDS", 0)
+    assert scrape(api)['cookies_pool_size{after_captcha="false"}'] == 3
+
+
+def test_served_while_api_pool_is_busy(pool, api, busy_pool):
+    ids = insert(pool, classes(1, 1))
+
+    samples = scrape(api)
+
+    assert samples["cookies_inserted_total"] == ids[-1]
+    assert samples["db_pool_checked_out"] == main.async_engine.pool.checkedout()
+
+
+def test_last_values_when_db_does_not_answer(pool, api, monkeypatch):
+    ids = insert(pool, classes(1, 1))
+    before = scrape(api)
+    failures = before.get("cookies_pool_observe_failures_total", 0)
+
+    # Единственное соединение метрик занято - скрейп не ждёт дольше таймаута
+    monkeypatch.setattr(main, "METRICS_DB_TIMEOUT_SECONDS", 0.2)
+    metrics_engine = main.MetricsSessionLocal.kw["bind"]
+    held = hold_connections(api, metrics_engine, 1)
+    insert(pool, classes(1, 1))
+    after = scrape(api)
+    release_connections(api, held)
+
+    assert after["cookies_pool_observe_failures_total"] == failures + 1
+    assert after["cookies_inserted_total"] == ids[-1]
@@ -0,0 +1,110 @@
+"""
+Миграции на БД в схеме до версионирования (Base.metadata.create_all):
+данные старых строк переживают переход на payload, справочник прокси и
+сжатие словарём.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import migrations
+import payloads
+from migrations import run_migrations
+from models import Cookie
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.orm import sessionmaker
+from storage import storage_for
+from tests.rows import PROXY_A, PROXY_B
+
+# Таблица, которую создавал models.Cookie до миграций
+baseline_cookies = Table(
+    "cookies",
+    MetaData(),
+    Column("id", Integer, primary_key=True, index=True),
+    Column("timestamp", DateTime),
+    Column("cookies_json", String),
+    Column("proxy", String),
+    Column("after_captcha", Boolean, nullable=False),
+)
+
+START = datetime(2026, 1, 1, 12, 0, 0, 123456)
+ROWS = [
+    ({"_abck": "a0", "bm_sz": "s0"}, PROXY_A, False),
+    ({"_abck": "a1"}, PROXY_B, True),
+    ({"_abck": "a2", "ak_bmsc": "значение"}, None, False),
+    ({"_abck": "a3", "bm_sz": "s3"}, PROXY_A, True),
+    ({}, PROXY_B, False),
+    ({"bm_sv": "v5"}, PROXY_A, False),
+    ({"_abck": "a6"}, None, True),
+]
+
+
+def test_baseline_rows_survive_all_migrations(database_url, monkeypatch):
+    # Несколько батчей keyset на семь строк
+    monkeypatch.setattr(migrations, "MIGRATION_BATCH", 3)
+    engine = storage_for(database_url).create_engine()
+    baseline_cookies.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            baseline_cookies.insert(),
+            [
+                {
+                    "timestamp": START + timedelta(minutes=i),
+                    "cookies_json": json.dumps(cookies),
+                    "proxy": proxy,
+                    "after_captcha": after_captcha,
+                }
+                for i, (cookies, proxy, after_captcha) in enumerate(ROWS)
+            ],
+        )
+        ids = conn.scalars(select(baseline_cookies.c.id).order_by("id")).all()
+
+    assert run_migrations(engine) == max(m[0] for m in migrations.MIGRATIONS)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("cookies")}
+    assert {"payload", "payload_dict_id", "proxy_id", "lease_count"} <= columns
+    assert not {"cookies_json", "proxy"} & columns
+    with engine.connect() as conn:
+        proxies = conn.execute(text("SELECT url FROM proxies")).scalars().all()
+        dicts = conn.execute(text("SELECT id, names FROM payload_dicts")).all()
+    assert sorted(proxies) == [PROXY_A, PROXY_B]
+    assert len(dicts) == 1
+    assert set(json.loads(dicts[0].names)) == {
+        name for cookies, _, _ in ROWS for name in cookies
+    }
+
+    payloads.dictionaries.bind(engine)
+    with sessionmaker(bind=engine)() as session:
+        cookies = session.scalars(select(Cookie).order_by(Cookie.id)).all()
+        assert {cookie.payload_dict_id for cookie in cookies} == {dicts[0].id}
+        bodies = [json.loads(cookie.response_body()) for cookie in cookies]
+    assert bodies == [
+        {
+            "id": cookie_id,
+            "proxy": proxy,
+            "cookies": row_cookies,
+            "after_captcha": after_captcha,
+            "timestamp": (START + timedelta(minutes=i)).isoformat(),
+        }
+        for i, (cookie_id, (row_cookies, proxy, after_captcha)) in enumerate(
+            zip(ids, ROWS)
+        )
+    ]
+
+    # Повторный запуск ничего не меняет
+    assert run_migrations(engine) == max(m[0] for m in migrations.MIGRATIONS)
+    with sessionmaker(bind=engine)() as session:
+        again = session.scalars(select(Cookie).order_by(Cookie.id)).all()
+        assert [json.loads(cookie.response_body()) for cookie in again] == bodies
+    engine.dispose()
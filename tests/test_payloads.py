@@ -0,0 +1,75 @@
+"""
+Словари сжатия payload: новая версия при дрейфе имён куки, старые версии
+читаются дальше, другие процессы подхватывают текущую.
+"""
+
+import json
+from collections import Counter
+
+import payloads
+from models import Cookie
+from payloads import DRIFT_THRESHOLD, PayloadDictionaries, compress, decompress
+from sqlalchemy import select
+from tests.rows import PROXY_A, insert
+
+NAMES = Counter({f"name{i}": 10 + i for i in range(10)})
+
+
+def test_new_version_only_on_drift(pool):
+    dictionaries = PayloadDictionaries()
+    dictionaries.bind(pool.engine)
+
+    first_id, first = dictionaries.for_names(NAMES)
+    # Незнакомых имён не больше DRIFT_THRESHOLD - та же версия
+    few = int(DRIFT_THRESHOLD * (len(NAMES) + 2))
+    same_id, _ = dictionaries.for_names(
+        NAMES + Counter({f"new{i}": 1 for i in range(few)})
+    )
+    drifted = Counter({f"new{i}": 50 for i in range(5)}) + Counter(
+        dict(list(NAMES.items())[:5])
+    )
+    second_id, second = dictionaries.for_names(drifted)
+
+    assert same_id == first_id
+    assert second_id > first_id
+    assert second != first
+    # Старые имена остаются, новые - в конце, ближе к концу словаря
+    with pool.engine.connect() as conn:
+        names = json.loads(
+            conn.execute(
+                select(payloads.payload_dicts.c.names).where(
+                    payloads.payload_dicts.c.id == second_id
+                )
+            ).scalar_one()
+        )
+    assert names[: len(NAMES)] == sorted(NAMES, key=NAMES.__getitem__)
+    assert set(names[len(NAMES) :]) == {f"new{i}" for i in range(5)}
+
+    # Другой процесс: старая версия по id, текущая - последняя
+    other = PayloadDictionaries()
+    other.bind(pool.engine)
+    data = b'{"cookies":{"name3":"x"},"after_captcha":false}'
+    assert decompress(other.zdict(first_id), compress(first, data)) == data
+    assert other.for_names(drifted)[0] == second_id
+
+
+def test_rows_written_across_versions_decode(pool):
+    before = [({f"name{i}": f"v{i}" for i in range(10)}, PROXY_A, False)]
+    after = [({f"other{i}": f"w{i}" for i in range(10)}, PROXY_A, True)]
+    ids = insert(pool, before * 3) + insert(pool, after * 3)
+
+    with pool.sessions() as session:
+        cookies = session.scalars(select(Cookie).order_by(Cookie.id)).all()
+        versions = [cookie.payload_dict_id for cookie in cookies]
+        bodies = [json.loads(cookie.response_body()) for cookie in cookies]
+
+    # Батч с новыми именами получил свою версию словаря
+    assert versions[0] == versions[2] != versions[3] == versions[5]
+    assert [body["id"] for body in bodies] == ids
+    assert [body["cookies"] for body in bodies] == [
+        cookies for cookies, _, _ in before * 3 + after * 3
+    ]
+
+    # Перепривязка (другая БД или пересозданные таблицы) забывает версии
+    payloads.dictionaries.bind(pool.engine)
+    assert payloads.dictionaries._zdicts == {}
@@ -0,0 +1,82 @@
+"""
+Профайлер: стеки чужих потоков в свёрнутом виде и /admin/profile.
+"""
+
+import threading
+import time
+from collections import Counter
+
+import main
+import profiler
+import pytest
+
+
+def spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name="busy")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_sample_sees_other_threads(busy_thread):
+    counts = profiler.sample(0.2, 0.005)
+
+    busy = {stack: n for stack, n in counts.items() if stack.startswith("busy;")}
+    assert busy
+    # От корня к листу: поток, затем threading, затем целевая функция
+    assert all(stack.split(";")[-1] == "test_profiler.spin" for stack in busy)
+    assert all("threading.Thread.run" in stack for stack in busy)
+    # Поток профайлера себя не семплирует
+    assert not any("profiler.sample" in stack for stack in counts)
+
+
+def test_collapsed_most_common_first():
+    counts = Counter({"main;a.f": 2, "main;a.f;b.g": 5})
+
+    assert profiler.collapsed(counts) == "main;a.f;b.g 5\nmain;a.f 2\n"
+    assert profiler.collapsed(Counter()) == ""
+
+
+@pytest.fixture
+def admin(monkeypatch) -> dict[str, str]:
+    monkeypatch.setattr(main, "ADMIN_API_KEY", "secret")
+    return {"X-Api-Key": "secret"}
+
+
+def test_profile_endpoint(api, admin, busy_thread):
+    response = api.post("/admin/profile?seconds=0.2&interval_ms=5", headers=admin)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert any(line.startswith("busy;") for line in lines)
+    assert all(line.rpartition(" ")[2].isdigit() for line in lines)
+
+
+def test_profile_requires_admin(api, admin, monkeypatch):
+    assert api.post("/admin/profile?seconds=0.1").status_code == 403
+    wrong = {"X-Api-Key": "other"}
+    assert api.post("/admin/profile?seconds=0.1", headers=wrong).status_code == 403
+
+    monkeypatch.setattr(main, "ADMIN_API_KEY", None)
+    assert api.post("/admin/profile?seconds=0.1", headers=admin).status_code == 403
+
+
+def test_one_profile_at_a_time(api, admin):
+    api.portal.call(main.profile_lock.acquire)
+    try:
+        started = time.monotonic()
+        response = api.post("/admin/profile?seconds=5", headers=admin)
+    finally:
+        api.portal.call(main.profile_lock.release)
+
+    assert response.status_code == 409
+    assert time.monotonic() - started < 5
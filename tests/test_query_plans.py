@@ -0,0 +1,52 @@
+"""
+Планы горячих запросов: те же выражения, что выполняют API и чистильщик
+(подзапрос floor_id, LEFT OUTER JOIN proxies, FOR UPDATE SKIP LOCKED),
+идут по индексу и не сортируют таблицу.
+"""
+
+from datetime import datetime
+
+import pytest
+from cookie_cleaner.main import oldest_batch
+from latest import latest_query
+from lease import lease_statement
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+HOT_QUERIES = {
+    "latest": lambda: latest_query(None),
+    "latest_after_captcha": lambda: latest_query(True),
+    "lease": lambda: lease_statement(50, None),
+    "lease_after_captcha": lambda: lease_statement(50, True),
+    "cleanup_oldest": lambda: oldest_batch(True, 100, None),
+    "cleanup_next_batch": lambda: oldest_batch(True, 100, (datetime(2026, 1, 1), 1)),
+}
+
+
+def explain(conn: Connection, statement) -> str:
+    # Параметры - как их передаёт приложение: с LIMIT 1 литералом вместо
+    # параметра SQLite выбирает другой план
+    compiled = statement.compile(dialect=conn.dialect)
+    if conn.dialect.name == "postgresql":
+        rows = conn.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+    else:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_index(pool, name):
+    with pool.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # На пустой таблице планировщику дешевле seq scan и сортировка -
+            # запрещаем их, чтобы проверить именно наличие подходящего индекса
+            for setting in ("enable_seqscan", "enable_bitmapscan", "enable_sort"):
+                conn.execute(text(f"SET LOCAL {setting} = off"))
+            plan = explain(conn, HOT_QUERIES[name]())
+            assert "Seq Scan on cookies" not in plan, plan
+            assert "Sort" not in plan, plan
+        else:
+            plan = explain(conn, HOT_QUERIES[name]())
+            assert "SCAN cookies\n" not in f"{plan}\n", plan
+            assert "TEMP B-TREE" not in plan, plan
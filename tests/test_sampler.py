@@ -0,0 +1,114 @@
+"""
+Случайный выбор /random-cookie: индекс id в памяти (и id из NOTIFY, которых
+на реплике ещё нет) и pick_where с условиями.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from datetime import timedelta
+
+import pytest
+import sampler
+from models import Cookie, utcnow
+from proxies import proxy_condition
+from sampler import CookieSampler, pick_where
+from sqlalchemy import update
+from tests.conftest import lagging_replica
+from tests.rows import PROXY_A, PROXY_B, classes, insert
+
+PICKS = 400
+
+
+@pytest.fixture
+def gap_pool(pool):
+    """
+    Куки PROXY_A вперемешку с PROXY_B (дыры в id), а по времени - десять в
+    начале, десятичасовая пауза в сборе и ещё десять. Возвращает id PROXY_A.
+    """
+    rows = [({"_abck": f"{i}"}, (PROXY_A, PROXY_B)[i % 2], False) for i in range(40)]
+    ids = insert(pool, rows)
+    start = utcnow() - timedelta(hours=11)
+    with pool.sessions() as session:
+        for i, cookie_id in enumerate(ids):
+            minute = i // 2
+            offset = timedelta(minutes=minute if minute < 10 else 600 + minute)
+            session.execute(
+                update(Cookie)
+                .where(Cookie.id == cookie_id)
+                .values(timestamp=start + offset)
+            )
+        session.commit()
+    return ids[::2]
+
+
+@pytest.mark.parametrize(
+    "limits",
+    [
+        # Мало подходящих строк: счёт и k-я по индексу
+        {},
+        # Много: случайные id
+        {"PICK_COUNT_LIMIT": 5},
+        # Много и редки среди id: ни одна точка не попала, полный счёт
+        {"PICK_COUNT_LIMIT": 5, "PICK_ROUNDS": 0},
+    ],
+    ids=["count", "points", "recount"],
+)
+def test_pick_where_is_uniform_across_a_gap(gap_pool, pool, monkeypatch, limits):
+    for name, value in limits.items():
+        monkeypatch.setattr(sampler, name, value)
+    random.seed(13)
+
+    async def pick_many() -> Counter:
+        since = utcnow() - timedelta(hours=12)
+        picked = Counter()
+        async with pool.async_sessions()() as db:
+            for _ in range(PICKS):
+                cookie = await pick_where(
+                    db, False, proxy_condition(PROXY_A), Cookie.timestamp >= since
+                )
+                picked[cookie.id] += 1
+        return picked
+
+    picked = asyncio.run(pick_many())
+
+    assert set(picked) == set(gap_pool)
+    # По 20 в среднем; точка во времени отдавала бы ~95% первой строке после паузы
+    assert max(picked.values()) < 2 * PICKS / len(gap_pool)
+
+
+def test_pick_where_without_matches(pool):
+    insert(pool, [({"_abck": "x"}, PROXY_B, True)])
+
+    async def pick():
+        async with pool.async_sessions()() as db:
+            return await pick_where(db, None, proxy_condition(PROXY_A))
+
+    assert asyncio.run(pick()) is None
+
+
+def test_notified_id_missing_on_replica_is_read_from_primary(pool, tmp_path):
+    (old,) = insert(pool, classes(0, 1))
+
+    async def scenario():
+        async with lagging_replica(pool, tmp_path) as replica:
+            async with replica() as db:
+                sampler = CookieSampler(sync_seconds=60, primary=pool.async_sessions())
+                await sampler.sync(db, full=True)
+                (fresh,) = await asyncio.to_thread(insert, pool, classes(1, 0))
+                # NOTIFY о строке, которую реплика ещё не доиграла
+                sampler.add(fresh, False)
+                picked = await sampler.pick(db, False)
+                kept = len(sampler)
+
+                # А id, которого нет и на primary, удалён - выкидываем
+                sampler.add(fresh + 1000, False)
+                again = {(await sampler.pick(db, False)).id for _ in range(20)}
+                return fresh, picked, kept, again, len(sampler)
+
+    fresh, picked, kept, again, size = asyncio.run(scenario())
+
+    assert picked.id == fresh
+    assert kept == 2
+    assert again == {fresh}
+    assert size == 2
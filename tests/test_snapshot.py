@@ -0,0 +1,137 @@
+"""
+Снимок пула в mmap: сборка из БД, чтение, пересборка только новых строк,
+flock обновлятеля и эпоха при подмене файла.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import timedelta
+
+import pytest
+import snapshot
+from models import Cookie, utcnow
+from snapshot import (
+    Snapshot,
+    SnapshotReader,
+    SnapshotRefresher,
+    _file_epoch,
+    write_snapshot,
+)
+from sqlalchemy import select, update
+from tests.rows import classes, insert
+
+# flock есть только не в Windows, там main.py снимок не включает
+fcntl = pytest.importorskip("fcntl")
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / "pool.snapshot")
+
+
+def refresher(pool, path: str) -> SnapshotRefresher:
+    return SnapshotRefresher(path, lambda: pool.engine, refresh_seconds=1)
+
+
+def bodies(pool) -> dict[int, bytes]:
+    with pool.sessions() as session:
+        cookies = session.scalars(select(Cookie)).all()
+        return {cookie.id: cookie.response_body() for cookie in cookies}
+
+
+def test_build_and_read(pool, path):
+    ids = insert(pool, classes(3, 2))
+    with pool.sessions() as session:
+        session.execute(
+            update(Cookie)
+            .where(Cookie.id == ids[0])
+            .values(timestamp=utcnow() - timedelta(hours=1))
+        )
+        session.commit()
+    asyncio.run(refresher(pool, path).refresh())
+    expected = bodies(pool)
+
+    current = SnapshotReader(path, max_age=10).current()
+
+    assert current.latest(None).id == ids[-1]
+    assert current.latest(False).id == ids[2]
+    assert current.latest(False).body == expected[ids[2]]
+    assert {current.random(True) for _ in range(50)} == {expected[i] for i in ids[3:]}
+    since = utcnow() - timedelta(minutes=1)
+    assert {current.random(False, since) for _ in range(50)} == {
+        expected[i] for i in ids[1:3]
+    }
+    assert current.latest(False, utcnow() + timedelta(minutes=1)) is None
+    # Обновлятель отстал - снимка нет, читатели идут в БД
+    assert SnapshotReader(path, max_age=0).current() is None
+
+
+def test_rebuild_decodes_only_new_rows(pool, path, monkeypatch):
+    insert(pool, classes(2, 2))
+    updater = refresher(pool, path)
+    asyncio.run(updater.refresh())
+    reader = SnapshotReader(path, max_age=10)
+    first = reader.current()
+
+    decoded = []
+    build = snapshot.build_response_body
+
+    def counting(cookie_id, *args):
+        decoded.append(cookie_id)
+        return build(cookie_id, *args)
+
+    monkeypatch.setattr(snapshot, "build_response_body", counting)
+    fresh = insert(pool, classes(1, 1))
+    asyncio.run(updater.refresh())
+    second = reader.current()
+
+    assert decoded == fresh
+    # Подмена файла: читатель переоткрыл снимок по новому inode
+    assert second is not first and second.inode != first.inode
+    assert second.latest(None).id == fresh[-1]
+    assert Snapshot(path).body_spans().keys() == bodies(pool).keys()
+
+
+def test_invalidate_is_not_overwritten_by_an_older_epoch(pool, path):
+    insert(pool, classes(1, 1))
+    updater = refresher(pool, path)
+    asyncio.run(updater.refresh())
+    epoch = _file_epoch(path)
+
+    updater.invalidate(epoch + 1)
+    # Пересборка, начатая до инвалидации, пишет снимок старой эпохи
+    write_snapshot(path, epoch, [(1, utcnow(), False)], lambda _: b"{}")
+
+    current = SnapshotReader(path, max_age=10).current()
+    assert current.epoch == epoch + 1
+    assert current.latest(None) is None
+    assert [name for name in os.listdir(os.path.dirname(path)) if ".tmp" in name] == []
+
+
+def test_swap_waits_for_the_swap_lock(path):
+    write_snapshot(path, 1, [], {}.get)
+    with open(f"{path}.swap.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        writer = threading.Thread(target=write_snapshot, args=(path, 2, [], {}.get))
+        writer.start()
+        writer.join(0.2)
+        # Пока другой процесс сравнивает эпохи и подменяет файл, подмены нет
+        assert writer.is_alive()
+        assert _file_epoch(path) == 1
+    writer.join(5)
+    assert _file_epoch(path) == 2
+
+
+def test_one_refresher_per_path(pool, path):
+    first, second = refresher(pool, path), refresher(pool, path)
+
+    async def scenario():
+        assert first._try_lock()
+        assert not second._try_lock()
+        # Лидер остановился - следующий воркер забирает обновление снимка
+        await first.stop()
+        assert second._try_lock()
+        await second.stop()
+
+    asyncio.run(scenario())
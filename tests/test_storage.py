@@ -0,0 +1,200 @@
+"""
+Одни и те же сценарии пула на SQLiteStorage и PostgresStorage (фикстура pool):
+запись коллектором, чтения API, эпоха и чистильщик.
+"""
+
+import asyncio
+import json
+from datetime import timedelta
+
+import epoch
+import pytest
+from cookie_cleaner import config as cleaner_config
+from cookie_cleaner import main as cleaner
+from epoch import bump_epoch, reclaim
+from export import export_cookies
+from latest import fetch_latest
+from lease import lease_cookies
+from models import Cookie, utcnow
+from proxies import proxy_condition
+from sampler import CookieSampler, pick_where
+from sqlalchemy import event, select
+from tests.rows import PROXY_A, PROXY_B, classes, insert
+
+
+def pool_ids(pool) -> list[int]:
+    """Все строки таблицы, включая прошлые эпохи."""
+    with pool.sessions() as session:
+        return session.scalars(select(Cookie.id).order_by(Cookie.id)).all()
+
+
+def test_writer_inserts(pool):
+    ids = insert(
+        pool,
+        [
+            ({"_abck": "x", "bm_sz": "y"}, PROXY_A, False),
+            ({"_abck": "z"}, PROXY_A, True),
+            ({"bm_sz": "w"}, None, True),
+        ],
+    )
+
+    assert len(ids) == 3
+    with pool.sessions() as session:
+        cookies = session.scalars(select(Cookie).order_by(Cookie.id)).all()
+        bodies = [json.loads(cookie.response_body()) for cookie in cookies]
+    # Сжато словарём, прокси - через справочник
+    assert all(cookie.payload_dict_id is not None for cookie in cookies)
+    assert cookies[0].proxy_id == cookies[1].proxy_id
+    assert cookies[2].proxy_id is None
+    assert [body["id"] for body in bodies] == ids
+    assert bodies[0]["cookies"] == {"_abck": "x", "bm_sz": "y"}
+    assert [body["proxy"] for body in bodies] == [PROXY_A, PROXY_A, None]
+    assert [body["after_captcha"] for body in bodies] == [False, True, True]
+
+
+def test_latest_and_random(pool):
+    ids = insert(pool, classes(3, 2))
+
+    async def read():
+        async with pool.async_sessions()() as db:
+            latest = {
+                value: await fetch_latest(db, value) for value in (None, False, True)
+            }
+            since = utcnow() - timedelta(hours=1)
+            random_without = await pick_where(db, False, Cookie.timestamp >= since)
+            random_proxy = await pick_where(db, None, proxy_condition(PROXY_B))
+            none_fresh = await pick_where(
+                db, None, Cookie.timestamp >= utcnow() + timedelta(hours=1)
+            )
+            sampled = await CookieSampler(0, 0).pick(db, True)
+        return latest, random_without, random_proxy, none_fresh, sampled
+
+    latest, random_without, random_proxy, none_fresh, sampled = asyncio.run(read())
+
+    assert latest[None].id == ids[-1]
+    assert latest[True].id == ids[-1]
+    assert latest[False].id == ids[2]
+    assert json.loads(latest[False].body)["cookies"] == {"_abck": "a2"}
+    assert random_without.id in ids[:3]
+    assert random_proxy.id in ids[3:]
+    assert none_fresh is None
+    assert sampled.id in ids[3:]
+
+
+def test_lease(pool):
+    ids = insert(pool, classes(0, 5))
+
+    async def lease_twice():
+        async with pool.async_sessions()() as db:
+            first = await lease_cookies(db, 3, True)
+            second = await lease_cookies(db, 3, True)
+            none_left = await lease_cookies(db, 3, False)
+        return first, second, none_left
+
+    first, second, none_left = asyncio.run(lease_twice())
+
+    # Сначала ни разу не выданные по id, затем дольше всех не выдававшиеся
+    assert [cookie.id for cookie in first] == ids[:3]
+    assert {cookie.id for cookie in second} == {ids[0], ids[3], ids[4]}
+    assert none_left == []
+    with pool.sessions() as session:
+        counts = dict(session.execute(select(Cookie.id, Cookie.lease_count)).all())
+    assert counts == {ids[0]: 2, ids[1]: 1, ids[2]: 1, ids[3]: 1, ids[4]: 1}
+
+
+def test_export(pool):
+    ids = insert(pool, classes(3, 2))
+
+    async def export(**filters) -> list[dict]:
+        chunks = [
+            chunk async for chunk in export_cookies(pool.async_sessions(), 2, **filters)
+        ]
+        return [json.loads(line) for line in b"".join(chunks).splitlines()]
+
+    everything = asyncio.run(export())
+    with pool.sessions() as session:
+        cookies = session.scalars(select(Cookie).order_by(Cookie.id)).all()
+        expected = [json.loads(cookie.response_body()) for cookie in cookies]
+
+    assert everything == expected
+    assert [row["id"] for row in asyncio.run(export(since_id=ids[1]))] == ids[2:]
+    assert [row["id"] for row in asyncio.run(export(after_captcha=True))] == ids[3:]
+    assert [row["id"] for row in asyncio.run(export(proxy=PROXY_A))] == ids[:3]
+
+
+def test_epoch_bump_and_reclaim(pool, monkeypatch):
+    monkeypatch.setattr(epoch, "RECLAIM_BATCH_SIZE", 2)
+    old = insert(pool, classes(2, 3))
+
+    async def bump() -> tuple[int, int]:
+        async with pool.async_sessions()() as db:
+            return await bump_epoch(db)
+
+    async def visible():
+        async with pool.async_sessions()() as db:
+            return await fetch_latest(db, None), await lease_cookies(db, 10, None)
+
+    first_epoch, floor_id = asyncio.run(bump())
+    assert floor_id == old[-1]
+    # Инвалидация мгновенная: строки ещё в таблице, но читатели их не видят
+    assert asyncio.run(visible()) == (None, [])
+    assert pool_ids(pool) == old
+
+    # Новых строк нет: PostgreSQL - TRUNCATE, SQLite - батчами
+    asyncio.run(reclaim(pool.async_sessions(), floor_id))
+    assert pool_ids(pool) == []
+
+    stale = insert(pool, classes(1, 2))
+    second_epoch, floor_id = asyncio.run(bump())
+    assert (second_epoch, floor_id) == (first_epoch + 1, stale[-1])
+    fresh = insert(pool, classes(1, 0))
+    latest, leased = asyncio.run(visible())
+    assert latest.id == fresh[0]
+    assert [cookie.id for cookie in leased] == fresh
+
+    # Новые строки уже есть - только батчи по id <= floor_id
+    asyncio.run(reclaim(pool.async_sessions(), floor_id))
+    assert pool_ids(pool) == fresh
+
+
+@pytest.fixture
+def cleaner_pool(pool, monkeypatch):
+    """Чистильщик на БД пула теста, без Redis и пауз между батчами."""
+    monkeypatch.setattr(cleaner, "engine", pool.engine)
+    monkeypatch.setattr(cleaner, "SessionLocal", pool.sessions)
+    monkeypatch.setattr(cleaner, "cache_client", None)
+    monkeypatch.setattr(cleaner_config, "RETENTION_MODE", "delete")
+    monkeypatch.setattr(cleaner_config, "DELETE_BATCH_SIZE", 2)
+    monkeypatch.setattr(cleaner_config, "BATCH_PAUSE_SECONDS", 0)
+    monkeypatch.setattr(cleaner_config, "MIN_COUNT_TO_CLEAN", 1)
+    monkeypatch.setattr(cleaner_config, "MAX_AGE_MINUTES", 0)
+    monkeypatch.setattr(cleaner_config, "TARGET_SIZE", {True: 2, False: 3})
+    cleaner.stop_requested.clear()
+    return pool
+
+
+def test_cleaner_batches(cleaner_pool):
+    pool = cleaner_pool
+    stale = insert(pool, classes(2, 1))
+
+    async def bump():
+        async with pool.async_sessions()() as db:
+            await bump_epoch(db)
+
+    asyncio.run(bump())
+    ids = insert(pool, classes(6, 5))
+
+    deletes = []
+
+    @event.listens_for(pool.engine, "before_cursor_execute")
+    def count_deletes(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("DELETE"):
+            deletes.append(statement)
+
+    cleaner.cleanup_old_cookies()
+
+    # Прошлая эпоха целиком, затем самые старые сверх цели каждого класса
+    assert pool_ids(pool) == ids[3:6] + ids[9:]
+    assert not set(stale) & set(pool_ids(pool))
+    # По DELETE_BATCH_SIZE=2: эпоха 3 строки, after_captcha 3, без капчи 3
+    assert len(deletes) == 6
@@ -0,0 +1,145 @@
+"""
+Супервизор воркеров: запуск, остановка, перезапуск упавшего с растущей
+задержкой, неудачный запуск и команды через сокет лидера.
+"""
+
+import asyncio
+
+import pytest
+import supervisor
+from supervisor import Supervisor, WorkerSpec
+from tests.conftest import ROOT
+
+
+def spec(name: str, module: str = "tests.workers", function: str = "serve", **kw):
+    return WorkerSpec(name, module, function, ROOT, **kw)
+
+
+def make(*specs: WorkerSpec, control_path: str | None = None) -> Supervisor:
+    return Supervisor(
+        list(specs),
+        heartbeat_timeout=5,
+        drain_seconds=5,
+        backoff_max=0.04,
+        control_path=control_path,
+    )
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(supervisor, "MONITOR_SECONDS", 0.01)
+    monkeypatch.setattr(supervisor, "BACKOFF_MIN_SECONDS", 0.01)
+
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_start_stop_in_process():
+    async def scenario():
+        workers = make(spec("serve", in_process=True))
+        await workers.open()
+        started = await workers.start("serve")
+        again = await workers.start("serve")
+        running = (await workers.status())["workers"][0]
+        stopped = await workers.stop("serve")
+        after = (await workers.status())["workers"][0]
+        await workers.close()
+        return started, again, running, stopped, after
+
+    started, again, running, stopped, after = asyncio.run(scenario())
+
+    assert started["state"] == running["state"] == "running"
+    assert again is None
+    assert stopped is True
+    assert after["state"] == "stopped"
+    assert after["last_exit_code"] == 0
+
+
+def test_crashed_worker_restarts_with_backoff():
+    async def scenario():
+        workers = make(spec("crash", function="crash", in_process=True))
+        await workers.open()
+        await workers.start("crash")
+        worker = workers.workers["crash"]
+        # Упал в третий раз и ждёт перезапуска
+        await wait_for(lambda: worker.restarts >= 3 and worker.restart_at is not None)
+        status = worker.status()
+        backoff = worker.backoff
+        await workers.stop("crash")
+        return status, backoff, worker.status()
+
+    status, backoff, stopped = asyncio.run(scenario())
+
+    assert status["last_exit_code"] == 1
+    assert status["state"] == "restarting"
+    # Задержка удваивается до backoff_max
+    assert backoff == 0.04
+    assert stopped["state"] == "stopped"
+
+
+def test_failed_spawn_is_not_wanted():
+    async def scenario():
+        workers = make(spec("broken", module="tests.no_such_worker", in_process=True))
+        await workers.open()
+        with pytest.raises(ModuleNotFoundError):
+            await workers.start("broken")
+        status = (await workers.status())["workers"][0]
+        # Надзор не перезапускает то, что не запустилось
+        await asyncio.sleep(0.05)
+        worker = workers.workers["broken"]
+        # Повторный start снова пробует, а не отвечает "уже запущен"
+        with pytest.raises(ModuleNotFoundError):
+            await workers.start("broken")
+        stopped = await workers.stop("broken")
+        await workers.close()
+        return status, worker.restarts, stopped
+
+    status, restarts, stopped = asyncio.run(scenario())
+
+    assert status["state"] == "stopped"
+    assert restarts == 0
+    assert stopped is False
+
+
+def test_process_worker_and_leader_socket(tmp_path):
+    pytest.importorskip("fcntl")
+    control_path = str(tmp_path / "supervisor.sock")
+    specs = [
+        spec("serve"),
+        spec("broken", module="tests.no_such_worker", in_process=True),
+    ]
+
+    async def scenario():
+        leader = make(*specs, control_path=control_path)
+        follower = make(*specs, control_path=control_path)
+        await leader.open()
+        await follower.open()
+        try:
+            # Команды второго воркера uvicorn выполняет лидер
+            started = await follower.start("serve")
+            worker = leader.workers["serve"]
+            await wait_for(lambda: worker.heartbeat.value > 0, timeout=30)
+            status = await follower.status()
+            # Ошибка запуска у лидера доходит до вызвавшего
+            with pytest.raises(RuntimeError, match="no_such_worker"):
+                await follower.start("broken")
+            stopped = await follower.stop("serve")
+            return started, status, stopped, worker.status()
+        finally:
+            await follower.close()
+            await leader.close()
+
+    started, status, stopped, after = asyncio.run(scenario())
+
+    assert started["state"] == "running"
+    assert started["pid"] is not None
+    assert [w["state"] for w in status["workers"]] == ["running", "stopped"]
+    assert status["workers"][0]["heartbeat_age_seconds"] < 5
+    assert stopped is True
+    assert after["state"] == "stopped"
+    assert after["last_exit_code"] is not None
@@ -0,0 +1,70 @@
+"""
+Server-Timing: фазы запроса в заголовке, только для запросов с ключом админа.
+"""
+
+import time
+
+import main
+import pytest
+import timing
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Приложение с middleware Server-Timing из main.py и эндпоинтом с фазами."""
+    monkeypatch.setattr(main, "ADMIN_API_KEY", "secret")
+    app = FastAPI()
+    app.middleware("http")(main.server_timing)
+
+    @app.get("/work")
+    async def work():
+        time.sleep(0.02)
+        timing.record("db", 0.002)
+        timing.record("decode", 0.005)
+        timing.record("db", 0.001)
+        return {}
+
+    with TestClient(app) as client:
+        yield client
+
+
+def phases(header: str) -> dict[str, float]:
+    durations = {}
+    for item in header.split(","):
+        name, _, duration = item.strip().partition(";dur=")
+        durations[name] = float(duration)
+    return durations
+
+
+def test_phases_for_admin(client):
+    response = client.get("/work", headers={"X-Api-Key": "secret"})
+
+    durations = phases(response.headers["server-timing"])
+    assert list(durations) == ["checkout", "db", "orm", "decode", "app", "total"]
+    assert durations["db"] == 3.0
+    assert durations["decode"] == 5.0
+    assert durations["checkout"] == durations["orm"] == 0
+    assert durations["total"] >= 20
+    # app - остаток: фазы в сумме дают total с точностью до округления
+    parts = sum(v for name, v in durations.items() if name != "total")
+    assert parts == pytest.approx(durations["total"], abs=0.05)
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Api-Key": "wrong"}])
+def test_no_header_for_anonymous(client, headers):
+    response = client.get("/work", headers=headers)
+
+    assert response.status_code == 200
+    assert "server-timing" not in response.headers
+
+
+def test_no_header_without_admin_key(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_API_KEY", None)
+
+    assert "server-timing" not in client.get("/work", headers={"X-Api-Key": ""}).headers
+
+
+def test_record_outside_request_is_ignored():
+    timing.record("db", 1.0)
@@ -0,0 +1,14 @@
+"""Воркеры для тестов супервизора: как run_collector.main, async-функции."""
+
+import asyncio
+
+
+async def serve() -> None:
+    """Работает до отмены или SIGTERM."""
+    while True:
+        await asyncio.sleep(1)
+
+
+async def crash() -> None:
+    await asyncio.sleep(0.01)
+    raise RuntimeError("Воркер упал")